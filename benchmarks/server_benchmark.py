@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Church Presentation Web App servers
+Starts each server on free local ports, one at a time, and measures:
+
+    startup     process start to the first answered request
+    catalog     loading the whole song library the way the operator page
+                does: /api/songs, or one /songs/<file> request per song on
+                servers without it (cold, then the median of warm loads)
+    static      static file throughput and latency with concurrent
+                keep-alive clients, uncompressed and with gzip accepted
+    cpu         server CPU time per 1000 static requests for each encoding
+                (Linux, read from /proc), and what gzipping every static
+                file costs at levels 6 and 9
+    websocket   latency from operators sending slides to displays receiving
+                them (percentiles), first on its own and then with
+                slow-reading displays connected too
+
+Every client runs in this process, so it shares the machine with the server:
+compare runs made on the same machine, not absolute numbers. Results are
+written as JSON named after the current commit, and compare reports what
+changed between two result files (exit status 1 on a regression).
+
+Usage:
+    python benchmarks/server_benchmark.py run [--servers server,optimized,azure]
+        [--operators 1] [--displays 10] [--slow-clients 2] [--messages 200]
+        [--interval 0.02] [--concurrency 8] [--duration 5] [--output FILE]
+    python benchmarks/server_benchmark.py compare OLD.json NEW.json [--threshold 10]
+"""
+
+import argparse
+import asyncio
+import gzip
+import http.client
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote
+
+import websockets
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STATIC_DIR = REPO_ROOT / 'src' / 'static'
+SONGS_DIR = REPO_ROOT / 'src' / 'songs'
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+SERVERS = {
+    'server': REPO_ROOT / 'src' / 'server' / 'server.py',
+    'optimized': REPO_ROOT / 'src' / 'server' / 'server-optimized.py',
+    'azure': REPO_ROOT / 'deployment' / 'azure' / 'server-azure.py',
+}
+
+STARTUP_TIMEOUT = 60.0
+CATALOG_REPEATS = 5
+GZIP_LEVELS = (6, 9)
+
+# Displays alternate between these roles
+DISPLAY_ROLES = ('projector', 'viewer')
+
+# Seconds a slow display spends on each message it reads
+SLOW_CLIENT_DELAY = 0.2
+
+# How long displays get to receive the last slide once the operators finish
+SETTLE_TIMEOUT = 10.0
+
+
+def percentiles(values):
+    """p50/p90/p99/max in milliseconds of values in seconds, nearest rank"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(fraction):
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+    return {
+        'p50': round(rank(0.5) * 1000, 3),
+        'p90': round(rank(0.9) * 1000, 3),
+        'p99': round(rank(0.99) * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3)
+    }
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_cpu_seconds(pid):
+    """User plus system CPU time of a process, or None off Linux"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces; fields resume after ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def static_files():
+    """Every static file, as (URL path, file path)"""
+    return [
+        ('/' + path.relative_to(STATIC_DIR).as_posix(), path)
+        for path in sorted(STATIC_DIR.rglob('*'))
+        if path.is_file() and not any(part.startswith('.') for part in path.relative_to(STATIC_DIR).parts)
+    ]
+
+
+def song_files():
+    return sorted(path.name for path in SONGS_DIR.glob('*.json'))
+
+
+def sample_slide_text():
+    """A real verse, so messages are the size the displays usually get"""
+    for name in song_files():
+        with open(SONGS_DIR / name, encoding='utf-8') as f:
+            phrases = json.load(f).get('phrases') or []
+        if phrases:
+            phrase = phrases[0]
+            return '\n'.join(phrase) if isinstance(phrase, list) else phrase
+    return 'Amazing grace, how sweet the sound\nThat saved a wretch like me'
+
+
+class ServerProcess:
+    """One server started on free ports, stopped when the block ends"""
+
+    def __init__(self, name):
+        self.name = name
+        self.script = SERVERS[name]
+        self.http_port = free_port()
+        self.websocket_port = free_port()
+        self.process = None
+        self.startup_seconds = None
+        self._workdir = tempfile.TemporaryDirectory(prefix=f'bench-{name}-')
+        self._log_path = Path(self._workdir.name) / 'server.log'
+
+    @property
+    def websocket_url(self):
+        return f'ws://127.0.0.1:{self.websocket_port}/'
+
+    def __enter__(self):
+        cwd = self.script.parent
+        if self.name == 'azure':
+            # Serves its working directory, with the songs in ./songs
+            cwd = Path(self._workdir.name) / 'site'
+            shutil.copytree(STATIC_DIR, cwd)
+            shutil.copytree(SONGS_DIR, cwd / 'songs')
+
+        env = dict(os.environ, HTTP_PORT=str(self.http_port), PORT=str(self.http_port),
+                   WEBSOCKET_PORT=str(self.websocket_port), PYTHONUNBUFFERED='1')
+        env.pop('SINGLE_PORT', None)
+        log = open(self._log_path, 'wb')
+        start = time.perf_counter()
+        self.process = subprocess.Popen([sys.executable, str(self.script)], cwd=cwd, env=env,
+                                        stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        try:
+            self._wait_until_ready(start)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def _wait_until_ready(self, start):
+        deadline = start + STARTUP_TIMEOUT
+        http_ready = False
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with status {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                if not http_ready:
+                    status, _, _ = http_get(self.http_port, '/index.html', timeout=1)
+                    http_ready = status == 200
+                if http_ready:
+                    socket.create_connection(('127.0.0.1', self.websocket_port), timeout=1).close()
+                    self.startup_seconds = time.perf_counter() - start
+                    return
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f"{self.name} did not start within {STARTUP_TIMEOUT:g}s:\n{self.log_tail()}")
+
+    def log_tail(self, lines=20):
+        try:
+            return '\n'.join(self._log_path.read_text(errors='replace').splitlines()[-lines:])
+        except OSError:
+            return ''
+
+    def cpu_seconds(self):
+        return process_cpu_seconds(self.process.pid)
+
+    def __exit__(self, *exc_info):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._workdir.cleanup()
+
+
+def http_get(port, path, headers=None, connection=None, timeout=10):
+    """GET a path; returns (status, Content-Encoding, body length)"""
+    conn = connection or http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, response.getheader('Content-Encoding', 'identity'), len(body)
+    finally:
+        if connection is None:
+            conn.close()
+
+
+def bench_catalog(port):
+    """Time loading every song, as the operator page does at startup"""
+    headers = {'Accept-Encoding': 'gzip'}
+    names = song_files()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def load_api():
+        status, encoding, size = http_get(port, '/api/songs', headers, conn)
+        if status != 200:
+            raise RuntimeError(f"/api/songs answered {status}")
+        return size
+
+    def load_per_song():
+        total = 0
+        for name in names:
+            status, _, size = http_get(port, f'/songs/{quote(name)}', headers, conn)
+            if status != 200:
+                raise RuntimeError(f"/songs/{name} answered {status}")
+            total += size
+        return total
+
+    try:
+        start = time.perf_counter()
+        status, _, size = http_get(port, '/api/songs', headers, conn)
+        if status == 200:
+            method, load = 'api', load_api
+        else:
+            method, load = 'per-song', load_per_song
+            start = time.perf_counter()
+            size = load()
+        cold = time.perf_counter() - start
+
+        warm = []
+        for _ in range(CATALOG_REPEATS):
+            start = time.perf_counter()
+            load()
+            warm.append(time.perf_counter() - start)
+    finally:
+        conn.close()
+
+    warm.sort()
+    return {
+        'method': method,
+        'songs': len(names),
+        'bytes': size,
+        'cold_ms': round(cold * 1000, 3),
+        'warm_ms': round(warm[len(warm) // 2] * 1000, 3)
+    }
+
+
+def bench_static(server, paths, concurrency, duration, accept_encoding):
+    """Request static files from concurrent keep-alive clients for a while"""
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    latencies = []
+    totals = {'requests': 0, 'bytes': 0, 'errors': 0, 'compressed': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', server.http_port, timeout=10)
+        mine = []
+        counts = {'requests': 0, 'bytes': 0, 'errors': 0, 'compressed': 0}
+        index = offset
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            start = time.perf_counter()
+            try:
+                status, encoding, size = http_get(server.http_port, path, headers, conn)
+            except (OSError, http.client.HTTPException):
+                counts['errors'] += 1
+                conn.close()
+                continue
+            mine.append(time.perf_counter() - start)
+            counts['requests'] += 1
+            counts['bytes'] += size
+            counts['errors'] += status != 200
+            counts['compressed'] += encoding != 'identity'
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            for key, value in counts.items():
+                totals[key] += value
+
+    cpu_before = server.cpu_seconds()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cpu_after = server.cpu_seconds()
+
+    requests = totals['requests']
+    result = {
+        'requests': requests,
+        'errors': totals['errors'],
+        'compressed_responses': totals['compressed'],
+        'requests_per_second': round(requests / elapsed, 1),
+        'megabytes_per_second': round(totals['bytes'] / elapsed / 1e6, 3),
+        'latency_ms': percentiles(latencies),
+        'server_cpu_ms_per_1000_requests': None
+    }
+    if cpu_before is not None and cpu_after is not None and requests:
+        result['server_cpu_ms_per_1000_requests'] = round((cpu_after - cpu_before) * 1000 / requests * 1000, 1)
+    return result
+
+
+def bench_gzip(files):
+    """CPU cost of gzipping every static file once, per level"""
+    contents = [path.read_bytes() for _, path in files]
+    raw = sum(len(content) for content in contents)
+    results = {}
+    for level in GZIP_LEVELS:
+        start = time.process_time()
+        compressed = sum(len(gzip.compress(content, compresslevel=level)) for content in contents)
+        results[f'level_{level}'] = {
+            'cpu_ms': round((time.process_time() - start) * 1000, 3),
+            'ratio': round(compressed / raw, 3) if raw else None
+        }
+    return {'files': len(contents), 'bytes': raw, **results}
+
+
+async def bench_websocket(url, operators, displays, slow_clients, messages, interval):
+    """
+    Operators send numbered slides; every display reports how long each one
+    took to arrive. Slow displays read one message every SLOW_CLIENT_DELAY
+    seconds and are reported separately.
+    """
+    text = sample_slide_text()
+    run_id = uuid.uuid4().hex  # Slides replayed from an earlier run are not ours
+    fast_latencies = []
+    received = {'fast': 0, 'slow': 0}
+    disconnected = {'fast': 0, 'slow': 0}
+    last_seq = messages - 1
+    finished = asyncio.Event()
+    fast_done = set()
+    fast_count = displays
+
+    async def display(index, slow):
+        kind = 'slow' if slow else 'fast'
+        seen_last = set()
+        role = DISPLAY_ROLES[index % len(DISPLAY_ROLES)]
+        try:
+            # A small receive queue makes a slow reader push back on the server
+            async with websockets.connect(url, max_size=None, max_queue=1 if slow else 32) as ws:
+                await ws.send(json.dumps({'type': 'hello', 'role': role}))
+                while not finished.is_set():
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    arrived = time.perf_counter()
+                    if slow:
+                        await asyncio.sleep(SLOW_CLIENT_DELAY)
+                    data = json.loads(message)
+                    bench = data.get('bench') if isinstance(data, dict) else None
+                    if not isinstance(bench, dict) or bench.get('run') != run_id:
+                        continue  # Hello replies, other clients' hellos, earlier runs' slides
+                    received[kind] += 1
+                    if not slow:
+                        fast_latencies.append(arrived - bench['sent'])
+                        if bench['seq'] == last_seq:
+                            seen_last.add(bench['operator'])
+                            if len(seen_last) == operators:
+                                fast_done.add(index)
+                                if len(fast_done) == fast_count:
+                                    finished.set()
+        except (websockets.exceptions.ConnectionClosed, OSError):
+            disconnected[kind] += 1
+
+    async def operator(index):
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps({'type': 'hello', 'role': 'operator'}))
+
+            async def drain():
+                # Servers that broadcast to everyone send operators slides too
+                async for _ in ws:
+                    pass
+
+            reader = asyncio.ensure_future(drain())
+            for seq in range(messages):
+                await ws.send(json.dumps({
+                    'type': 'song_phrase', 'text': text, 'fontSize': 'auto', 'songTitle': 'Benchmark',
+                    'nextVersePreview': None,
+                    'bench': {'run': run_id, 'operator': index, 'seq': seq, 'sent': time.perf_counter()}
+                }))
+                await asyncio.sleep(interval)
+            await finished.wait()
+            reader.cancel()
+
+    display_tasks = [asyncio.ensure_future(display(i, slow=i >= displays)) for i in range(displays + slow_clients)]
+    await asyncio.sleep(0.5)  # Let every display say hello before the first slide
+    start = time.perf_counter()
+    operator_tasks = [asyncio.ensure_future(operator(i)) for i in range(operators)]
+    try:
+        await asyncio.wait_for(asyncio.shield(finished.wait()),
+                               timeout=messages * interval + SETTLE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+    finished.set()
+    await asyncio.gather(*operator_tasks, *display_tasks, return_exceptions=True)
+
+    sent = operators * messages
+    result = {
+        'operators': operators,
+        'displays': displays,
+        'slow_clients': slow_clients,
+        'messages_sent': sent,
+        'elapsed': round(elapsed, 3),
+        # Servers may coalesce slides a display falls behind on, so fast
+        # displays need not receive every one
+        'fast_delivered_ratio': round(received['fast'] / (sent * displays), 3) if displays else None,
+        'fast_disconnected': disconnected['fast'],
+        'all_fast_displays_current': len(fast_done) == displays,
+        'latency_ms': percentiles(fast_latencies)
+    }
+    if slow_clients:
+        result['slow_delivered_ratio'] = round(received['slow'] / (sent * slow_clients), 3)
+        result['slow_disconnected'] = disconnected['slow']
+    return result
+
+
+def bench_server(name, args):
+    files = static_files()
+    paths = [path for path, _ in files]
+    with ServerProcess(name) as server:
+        result = {'startup_seconds': round(server.startup_seconds, 3)}
+        print(f"[{name}] started in {server.startup_seconds:.2f}s, loading the catalog...", flush=True)
+        result['catalog'] = bench_catalog(server.http_port)
+
+        result['static'] = {}
+        for label, accept in (('identity', None), ('gzip', 'gzip')):
+            print(f"[{name}] static files ({label}) for {args.duration:g}s...", flush=True)
+            result['static'][label] = bench_static(server, paths, args.concurrency, args.duration, accept)
+
+        result['websocket'] = {}
+        for label, slow in (('baseline', 0), ('slow_clients', args.slow_clients)):
+            if label == 'slow_clients' and not slow:
+                continue
+            print(f"[{name}] WebSocket broadcast ({label})...", flush=True)
+            result['websocket'][label] = asyncio.run(bench_websocket(
+                server.websocket_url, args.operators, args.displays, slow, args.messages, args.interval))
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def run(args):
+    names = [name.strip() for name in args.servers.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SERVERS]
+    if unknown:
+        print(f"Unknown server(s): {', '.join(unknown)} (expected: {', '.join(SERVERS)})")
+        return 1
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('command', 'func', 'output')},
+        'gzip': bench_gzip(static_files()),
+        'servers': {}
+    }
+    for name in names:
+        try:
+            report['servers'][name] = bench_server(name, args)
+        except Exception as e:
+            print(f"[{name}] failed: {e}")
+            report['servers'][name] = {'error': str(e)}
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+    print(f"Results written to {output}")
+    return 0
+
+
+def numeric_leaves(value, prefix=''):
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from numeric_leaves(item, f'{prefix}.{key}' if prefix else key)
+
+
+def better_direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if neither"""
+    if metric.endswith(('per_second', 'delivered_ratio')):
+        return 1
+    if '_ms' in metric or metric.endswith(('seconds', 'errors', 'disconnected')):
+        return -1
+    return 0
+
+
+def compare(args):
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    old_values = dict(numeric_leaves(old.get('servers', {})))
+    new_values = dict(numeric_leaves(new.get('servers', {})))
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    if old.get('settings') != new.get('settings') or old.get('platform') != new.get('platform'):
+        print("Warning: the runs used different settings or machines")
+
+    regressions = 0
+    width = max((len(metric) for metric in new_values), default=10)
+    for metric, value in new_values.items():
+        direction = better_direction(metric)
+        if metric not in old_values or not direction:
+            continue
+        before = old_values[metric]
+        change = (value - before) / before * 100 if before else (0.0 if value == before else math.inf)
+        verdict = ''
+        if change * direction < -args.threshold:
+            verdict = 'REGRESSION'
+            regressions += 1
+        elif change * direction > args.threshold:
+            verdict = 'improved'
+        print(f"{metric:<{width}}  {before:>12g}  {value:>12g}  {change:+8.1f}%  {verdict}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:g}%")
+    return 1 if regressions else 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the Church Presentation Web App servers')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='benchmark the servers and write JSON results')
+    run_parser.add_argument('--servers', default=','.join(SERVERS),
+                            help=f"comma-separated, from: {', '.join(SERVERS)}")
+    run_parser.add_argument('--operators', type=int, default=1, help='operator clients sending slides')
+    run_parser.add_argument('--displays', type=int, default=10, help='projector and viewer clients')
+    run_parser.add_argument('--slow-clients', type=int, default=2, help='slow-reading displays added in a second pass')
+    run_parser.add_argument('--messages', type=int, default=200, help='slides each operator sends')
+    run_parser.add_argument('--interval', type=float, default=0.02, help='seconds between an operator\'s slides')
+    run_parser.add_argument('--concurrency', type=int, default=8, help='concurrent static file clients')
+    run_parser.add_argument('--duration', type=float, default=5.0, help='seconds per static file pass')
+    run_parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help='percent change reported as a regression')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv[1:])
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
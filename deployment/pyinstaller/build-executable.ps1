@@ -52,6 +52,7 @@ $indexPath = Join-Path $parentDir "index.html"
 $operatorPath = Join-Path $parentDir "operator.html"
 $projectorPath = Join-Path $parentDir "projector.html"
 $welcomePath = Join-Path $parentDir "welcome.html"
+$diagnosticsPath = Join-Path $parentDir "diagnostics.html"
 $serverPath = Join-Path $parentDir "server.py"
 
 # Verify files exist
@@ -64,6 +65,7 @@ $files = @(
     @{name="operator.html"; path=$operatorPath},
     @{name="projector.html"; path=$projectorPath},
     @{name="welcome.html"; path=$welcomePath},
+    @{name="diagnostics.html"; path=$diagnosticsPath},
     @{name="server.py"; path=$serverPath}
 )
 
@@ -96,6 +98,7 @@ if ($missingFiles.Count -gt 0) {
   --add-data="$operatorPath;." `
   --add-data="$projectorPath;." `
   --add-data="$welcomePath;." `
+  --add-data="$diagnosticsPath;." `
   "$serverPath"
 
 if ($LASTEXITCODE -ne 0) {
@@ -130,6 +133,7 @@ Copy-Item "$parentDir\index.html" "$distDir\" -Force
 Copy-Item "$parentDir\operator.html" "$distDir\" -Force
 Copy-Item "$parentDir\projector.html" "$distDir\" -Force
 Copy-Item "$parentDir\welcome.html" "$distDir\" -Force
+Copy-Item "$parentDir\diagnostics.html" "$distDir\" -Force
 Write-Host "✓ Copied HTML files" -ForegroundColor Green
 
 # Create launcher batch file
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Pre-compressed static asset cache for the Church Presentation Web App Server
+Reads every file under the static directory once at startup and keeps the
+raw bytes plus gzip (and Brotli, when the brotli package is installed)
+variants in memory with content-hash ETags. Entries are rebuilt when a
+file's mtime or size changes, so edits on disk show up on the next request.
+
+Pages reference scripts, styles and images by fingerprinted URLs such as
+js/operator.3fa2b1c4.js, rewritten into the HTML as it is cached. Those
+URLs name one exact version of a file, so they can be cached as immutable.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+import metrics
+from song_catalog import etag_matches
+
+log = logging.getLogger('Assets')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text formats worth compressing
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.xml', '.txt')
+
+# Larger files are left to the regular file handler, which sends them with
+# sendfile(); binary files gain nothing from compression, so only small
+# ones are kept in memory
+MAX_CACHED_FILE_SIZE = 4 * 1024 * 1024
+MAX_CACHED_BINARY_SIZE = 256 * 1024
+
+# Skip variants that save less than this share of the raw size
+MIN_COMPRESSION_SAVING = 0.1
+
+# Caching of fingerprinted URLs: the current version never changes, an
+# outdated one (a page from before an upgrade) gets today's file briefly
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STALE_FINGERPRINT_CACHE_CONTROL = 'public, max-age=60'
+
+ASSET_CACHE_LOOKUPS = metrics.counter(
+    'presenter_asset_cache_lookups_total',
+    'Static file requests: hit (served from memory), load (read from disk into the cache) '
+    'or miss (not cacheable, left to the file handler)', ('result',))
+
+_FINGERPRINTED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<fingerprint>[0-9a-f]{8})(?P<ext>\.[A-Za-z0-9]+)$')
+_PAGE_REFERENCE = re.compile(r'(?P<attr>\b(?:src|href)\s*=\s*)(?P<quote>["\'])(?P<url>[^"\'#?:]+)(?P=quote)')
+
+
+def fingerprinted_url(url, fingerprint):
+    """js/operator.js -> js/operator.<fingerprint>.js"""
+    root, ext = posixpath.splitext(url)
+    return f"{root}.{fingerprint}{ext}"
+
+
+def accepted_encodings(accept_encoding):
+    """Return the content codings an Accept-Encoding header allows"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = params.strip().lower()
+        if quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding)
+    return accepted
+
+
+class Asset:
+    """One static file with its pre-compressed variants"""
+
+    __slots__ = ('path', 'mtime_ns', 'size', 'content_type', 'last_modified',
+                 'mtime', 'fingerprint', 'dependencies', 'variants', 'etags')
+
+    def __init__(self, path, stat, content, content_type, dependencies=None):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.content_type = content_type
+        self.last_modified = formatdate(timeval=stat.st_mtime, localtime=False, usegmt=True)
+
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        self.fingerprint = digest[:8]
+        self.dependencies = dependencies or {}  # path -> fingerprint referenced by a page
+        self.variants = {None: (content, f'"{digest}"')}  # encoding -> (body, etag)
+
+        if path.endswith(COMPRESSIBLE_EXTENSIONS):
+            limit = len(content) * (1 - MIN_COMPRESSION_SAVING)
+            gzip_body = gzip.compress(content, compresslevel=9, mtime=0)
+            if len(gzip_body) < limit:
+                self.variants['gzip'] = (gzip_body, f'"{digest}-gz"')
+            if brotli is not None:
+                br_body = brotli.compress(content, quality=11)
+                if len(br_body) < limit:
+                    self.variants['br'] = (br_body, f'"{digest}-br"')
+
+        self.etags = [etag for _, etag in self.variants.values()]
+
+    @property
+    def compressible(self):
+        return len(self.variants) > 1
+
+    def is_current(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+    def select(self, accept_encoding):
+        """Return (body, encoding, etag) of the smallest variant the client accepts"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                body, etag = self.variants[encoding]
+                return body, encoding, etag
+        body, etag = self.variants[None]
+        return body, None, etag
+
+    def not_modified(self, headers):
+        """Check If-None-Match, then If-Modified-Since, against this asset"""
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            return any(etag_matches(if_none_match, etag) for etag in self.etags)
+
+        if_modified_since = headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since is None or since.tzinfo is None:
+                return False
+            return self.mtime <= since.timestamp()
+        return False
+
+
+class StaticAssetCache:
+    """In-memory static files keyed by absolute path"""
+
+    def __init__(self, static_dir, content_type_for=None):
+        self.static_dir = os.path.abspath(static_dir)
+        self.content_type_for = content_type_for or self._guess_type
+        self._lock = threading.Lock()
+        self._assets = {}  # absolute path -> Asset
+
+    def resolve(self, path):
+        """
+        Return (asset, cache_control) for a file path or a fingerprinted
+        path. cache_control is None for plain file paths.
+        """
+        match = None
+        asset, loaded = self._lookup(path)
+        if asset is None:
+            directory, name = os.path.split(path)
+            match = _FINGERPRINTED_NAME.match(name)
+            if match is not None:
+                asset, loaded = self._lookup(os.path.join(directory, match['stem'] + match['ext']))
+        if asset is None:
+            ASSET_CACHE_LOOKUPS.inc(result='miss')
+            return None, None
+        ASSET_CACHE_LOOKUPS.inc(result='load' if loaded else 'hit')
+
+        if match is None:
+            return asset, None
+        if match['fingerprint'] == asset.fingerprint:
+            return asset, IMMUTABLE_CACHE_CONTROL
+        return asset, STALE_FINGERPRINT_CACHE_CONTROL
+
+    def preload(self):
+        """Read and compress every file under the static directory"""
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                if not name.startswith('.'):
+                    self.get(os.path.join(root, name))
+
+        with self._lock:
+            assets = list(self._assets.values())
+        raw_bytes = sum(asset.size for asset in assets)
+        encodings = 'gzip + br' if brotli is not None else 'gzip'
+        log.info("Cached %d static files (%d KB, %s)", len(assets), raw_bytes // 1024, encodings)
+        return len(assets)
+
+    def get(self, path):
+        """
+        Return the Asset for a file path, reloading it if it changed on
+        disk, or None if it is missing, a directory or too large to cache
+        """
+        return self._lookup(path)[0]
+
+    def _lookup(self, path):
+        """get(), also saying whether the file was (re)read from disk"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._forget(path)
+            return None, False
+
+        asset = self._assets.get(path)
+        if asset is not None and asset.is_current(stat) and self._dependencies_current(asset):
+            return asset, False
+
+        max_size = MAX_CACHED_FILE_SIZE if path.endswith(COMPRESSIBLE_EXTENSIONS) else MAX_CACHED_BINARY_SIZE
+        if not os.path.isfile(path) or stat.st_size > max_size:
+            self._forget(path)
+            return None, False
+
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                content = f.read()
+        except OSError:
+            self._forget(path)
+            return None, False
+
+        dependencies = None
+        if path.endswith('.html'):
+            content, dependencies = self._fingerprint_references(path, content)
+
+        asset = Asset(path, stat, content, self.content_type_for(path), dependencies)
+        with self._lock:
+            self._assets[path] = asset
+        return asset, True
+
+    def _dependencies_current(self, asset):
+        """Check that the files a page references still have the fingerprints it names"""
+        for path, fingerprint in asset.dependencies.items():
+            dependency = self.get(path)
+            if dependency is None or dependency.fingerprint != fingerprint:
+                return False
+        return True
+
+    def _fingerprint_references(self, page_path, content):
+        """Rewrite a page's src/href references to fingerprinted URLs"""
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError:
+            return content, None
+
+        page_dir = os.path.dirname(page_path)
+        dependencies = {}
+
+        def rewrite(match):
+            url = match['url']
+            if url.startswith('//') or url.endswith('.html'):
+                return match[0]
+            if url.startswith('/'):
+                target = os.path.join(self.static_dir, url.lstrip('/'))
+            else:
+                target = os.path.join(page_dir, url)
+            target = os.path.normpath(target)
+            if not target.startswith(self.static_dir + os.sep):
+                return match[0]
+
+            asset = self.get(target)
+            if asset is None:
+                return match[0]
+            dependencies[target] = asset.fingerprint
+            return f"{match['attr']}{match['quote']}{fingerprinted_url(url, asset.fingerprint)}{match['quote']}"
+
+        text = _PAGE_REFERENCE.sub(rewrite, text)
+        return text.encode('utf-8'), dependencies
+
+    def _forget(self, path):
+        with self._lock:
+            self._assets.pop(path, None)
+
+    @staticmethod
+    def _guess_type(path):
+        content_type, _ = mimetypes.guess_type(path)
+        return content_type or 'application/octet-stream'
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+WebSocket routing for the Church Presentation Web App Server
+Clients announce who they are with a hello message when they connect:
+
+    {"type": "hello", "role": "projector", "channel": "main"}
+
+and each message is then delivered only to the roles that display it, in
+the sender's channel, instead of to every other connection. The server
+answers the hello with the same message plus the client's id.
+
+Clients that never send a hello (older pages) are treated as they were
+before: they may publish display messages and receive all of them.
+
+Every client has a bounded outbound queue drained by its own task, so a
+display on a stalled link never delays the others. When a queue is full
+the slow-client policy applies:
+
+    latest      drop the queued messages and keep only the newest, which
+                is all a display needs to show the current slide
+    disconnect  close the connection; the client reconnects and resyncs
+
+Display messages describe the whole screen, so they are not queued: each
+client holds at most one undelivered screen, replaced by newer ones, and
+a display that falls behind skips straight to the current slide. The last
+screen of every channel is kept and sent to clients as soon as they say
+hello.
+
+A hello may also ask for a more compact encoding (see ws_encoding):
+
+    {"type": "hello", "role": "viewer", "encoding": "msgpack", "songRefs": true}
+
+The reply says which encoding and songRefs setting were accepted; it is
+always sent as JSON text.
+
+With a prefetch function, each song phrase is followed by a prefetch hint
+carrying the slides expected next, for displays to lay out in advance.
+Like screens, hints are coalesced, and they are sent after the current
+screen. Older pages and songRefs clients (which have the songs) get none.
+
+With a tracer (see slide_trace), traced messages are timed from arrival
+to delivery and every display's slide_ack completes the trace. Any client
+may send clock_sync to estimate its clock offset from the server's.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+
+import websockets
+
+import metrics
+from slide_trace import clock_sync_reply
+from ws_encoding import ENCODINGS, Outbound, decode_incoming
+
+ROLES = ('operator', 'projector', 'stage', 'viewer')
+DEFAULT_CHANNEL = 'main'
+MAX_CHANNEL_LENGTH = 64
+
+# Roles that receive each message type
+ROUTES = {
+    'song_phrase': ('projector', 'stage', 'viewer'),
+    'simple_slide': ('projector', 'stage', 'viewer'),
+    'blank': ('projector', 'stage', 'viewer'),
+    'welcome_screen': ('projector', 'viewer'),
+    'library_changed': ('operator',),
+    'prefetch': ('projector', 'stage', 'viewer'),
+}
+
+# Message types that replace everything on screen; only the latest matters
+STATE_MESSAGES = ('song_phrase', 'simple_slide', 'blank', 'welcome_screen')
+
+# Message types only the server sends
+SERVER_MESSAGES = ('library_changed', 'prefetch')
+
+# Message types the server answers itself, from any client
+CLIENT_MESSAGES = ('hello', 'clock_sync', 'slide_ack')
+
+# Roles allowed to publish display messages (None: no hello yet)
+PUBLISHERS = ('operator', None)
+
+# Roles an unannounced client receives messages for
+LEGACY_ROLES = ('projector', 'stage', 'viewer')
+
+SLOW_CLIENT_POLICIES = ('latest', 'disconnect')
+DEFAULT_QUEUE_SIZE = 16
+
+# Close code for clients dropped by the 'disconnect' policy (try again later)
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+# Close code when sending to a client fails unexpectedly (it reconnects)
+INTERNAL_ERROR_CLOSE_CODE = 1011
+
+# Routed messages are logged (at DEBUG) once every this many
+MESSAGE_LOG_SAMPLE = 20
+
+log = logging.getLogger('WebSocket')
+
+WS_CLIENTS = metrics.gauge(
+    'presenter_websocket_clients', 'Connected WebSocket clients', ('role',))
+WS_MESSAGES_RECEIVED = metrics.counter(
+    'presenter_websocket_messages_received_total', 'WebSocket messages received', ('type',))
+WS_DELIVERY_SECONDS = metrics.histogram(
+    'presenter_websocket_delivery_seconds',
+    'Time from a message reaching the server to it being sent to one client (fan-out latency)', ('role',))
+WS_QUEUE_DEPTH = metrics.histogram(
+    'presenter_websocket_queue_depth', "Messages in a client's queue after each message is queued",
+    ('role',), buckets=(1, 2, 4, 8, 16, 32, 64))
+WS_DROPPED = metrics.counter(
+    'presenter_websocket_dropped_messages_total', 'Messages skipped because a client fell behind', ('role',))
+WS_SLOW_DISCONNECTS = metrics.counter(
+    'presenter_websocket_slow_disconnects_total', "Clients closed by the 'disconnect' policy", ('role',))
+
+
+class Client:
+    """One WebSocket connection and what it subscribed to"""
+
+    __slots__ = ('websocket', 'id', 'role', 'channel', 'encoding', 'song_refs',
+                 'queue', 'state', 'hint', 'wakeup', 'dropped', 'closing')
+
+    def __init__(self, websocket, client_id):
+        self.websocket = websocket
+        self.id = client_id
+        self.role = None
+        self.channel = DEFAULT_CHANNEL
+        self.encoding = 'json'
+        self.song_refs = False  # Send song_phrase as song_ref
+        self.queue = deque()  # Messages waiting to be sent
+        self.state = None  # Newest undelivered display message
+        self.hint = None  # Newest undelivered prefetch hint
+        self.wakeup = asyncio.Event()
+        self.dropped = 0  # Messages discarded because the client fell behind
+        self.closing = False
+
+    def __repr__(self):
+        return f"client {self.id} ({self.role or 'no role'}, {self.channel})"
+
+
+class DisplayHub:
+    """Connected clients indexed by (channel, role) for routing"""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, slow_client_policy='latest', prefetch=None, tracer=None):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Unknown slow client policy '{slow_client_policy}', "
+                             f"expected one of: {', '.join(SLOW_CLIENT_POLICIES)}")
+        self.queue_size = max(1, queue_size)
+        self.slow_client_policy = slow_client_policy
+        self.prefetch = prefetch  # prefetch(song_phrase data) -> slides expected next
+        self.tracer = tracer  # SlideTracer for slide latency, or None
+        self._ids = itertools.count(1)
+        self._subscribers = {}  # (channel, role) -> set of Client
+        self._state = {}  # channel -> last display message published there
+
+    def __len__(self):
+        return sum(len(clients) for clients in self._subscribers.values())
+
+    def clients(self, role=None, channel=None):
+        """Connected clients, optionally only one role and/or channel"""
+        return [
+            client
+            for (client_channel, client_role), clients in self._subscribers.items()
+            if (role is None or client_role == role) and (channel is None or client_channel == channel)
+            for client in clients
+        ]
+
+    def _add(self, client):
+        clients = self._subscribers.setdefault((client.channel, client.role), set())
+        if client not in clients:
+            clients.add(client)
+            WS_CLIENTS.inc(role=client.role or 'none')
+
+    def _remove(self, client):
+        key = (client.channel, client.role)
+        clients = self._subscribers.get(key)
+        if clients is not None and client in clients:
+            clients.discard(client)
+            WS_CLIENTS.dec(role=client.role or 'none')
+            if not clients:
+                del self._subscribers[key]
+
+    def hello(self, client, data):
+        """Apply a hello message; returns the reply, or an error message"""
+        role = data.get('role')
+        channel = data.get('channel') or DEFAULT_CHANNEL
+        if role not in ROLES:
+            return {'type': 'error', 'message': f"Unknown role '{role}', expected one of: {', '.join(ROLES)}"}
+        if not isinstance(channel, str) or len(channel) > MAX_CHANNEL_LENGTH:
+            return {'type': 'error', 'message': 'Invalid channel'}
+
+        self._remove(client)
+        client.role = role
+        client.channel = channel
+        # Unsupported encodings fall back to JSON; the reply says which is used
+        client.encoding = data.get('encoding') if data.get('encoding') in ENCODINGS else 'json'
+        client.song_refs = data.get('songRefs') is True
+        self._add(client)
+        return {'type': 'hello', 'clientId': client.id, 'role': role, 'channel': channel,
+                'encoding': client.encoding, 'songRefs': client.song_refs,
+                'hasState': channel in self._state}
+
+    def current_state(self, channel):
+        """The Outbound message on screen in a channel, or None"""
+        return self._state.get(channel)
+
+    def recipients(self, message_type, channel, exclude=None):
+        """Clients in a channel that need a message of this type"""
+        roles = ROUTES.get(message_type, ())
+        recipients = []
+        for role in roles:
+            recipients.extend(self._subscribers.get((channel, role), ()))
+        if any(role in LEGACY_ROLES for role in roles):
+            recipients.extend(self._subscribers.get((channel, None), ()))
+        return [client for client in recipients if client is not exclude]
+
+    def send(self, clients, message):
+        """
+        Queue a message (an Outbound, or a str sent as is) for each client
+        without waiting for any of them; the same object is shared by every
+        queue and encoded once per encoding
+        """
+        for client in clients:
+            if client.closing:
+                continue
+            if len(client.queue) >= self.queue_size:
+                if self.slow_client_policy == 'disconnect':
+                    self._disconnect_slow(client)
+                    continue
+                self._skip(client, len(client.queue))
+                client.queue.clear()
+            client.queue.append(message)
+            client.wakeup.set()
+            WS_QUEUE_DEPTH.observe(len(client.queue), role=client.role or 'none')
+
+    def send_state(self, clients, message):
+        """
+        Deliver a display message, replacing any screen a client has not
+        received yet instead of queueing behind it
+        """
+        for client in clients:
+            if client.closing:
+                continue
+            if client.state is not None:
+                if self.slow_client_policy == 'disconnect' and client.dropped + 1 >= self.queue_size:
+                    self._disconnect_slow(client)
+                    continue
+                self._skip(client, 1)
+            client.state = message
+            client.wakeup.set()
+
+    def send_hint(self, clients, message):
+        """Deliver a prefetch hint after any pending screen, replacing older hints"""
+        for client in clients:
+            if not client.closing:
+                client.hint = message
+                client.wakeup.set()
+
+    async def _send_prefetch(self, data, channel, exclude):
+        # The lookup waits on the catalog lock, which a library rebuild or
+        # a bulk import can hold for a while; never on the event loop
+        state = self._state.get(channel)
+        try:
+            slides = await asyncio.get_running_loop().run_in_executor(None, self.prefetch, data)
+        except Exception as e:
+            log.error("Prefetch failed: %s", e, exc_info=True)
+            return
+        # Hints for a slide that is no longer on screen are no use
+        if not slides or self._state.get(channel) is not state:
+            return
+        recipients = [client for client in self.recipients('prefetch', channel, exclude=exclude)
+                      if client.role is not None and not client.song_refs]
+        self.send_hint(recipients, Outbound.from_data({'type': 'prefetch', 'slides': slides}))
+
+    def _skip(self, client, count):
+        """Count undelivered messages; log once a client is well behind"""
+        if client.dropped < self.queue_size <= client.dropped + count:
+            log.warning("%s is falling behind, skipping to the latest message", client)
+        client.dropped += count
+        WS_DROPPED.inc(count, role=client.role or 'none')
+
+    async def send_to_role(self, role, data):
+        """Send a server message to every client with a role, in every channel"""
+        self.send(self.clients(role=role), Outbound.from_data(data))
+
+    def _send_current_state(self, client):
+        state = self._state.get(client.channel)
+        if state is None:
+            return
+        # Only what the client would have been sent live (a stage display
+        # never shows the welcome screen); the operator sees every slide
+        roles = ROUTES.get(state.data.get('type'), ())
+        if client.role == 'operator' or client.role in roles:
+            self.send_state([client], state.replay())
+
+    def _disconnect_slow(self, client):
+        log.warning("Disconnecting %s: too far behind", client)
+        WS_SLOW_DISCONNECTS.inc(role=client.role or 'none')
+        client.closing = True
+        client.queue.clear()
+        client.state = None
+        client.hint = None
+        client.wakeup.set()
+        asyncio.ensure_future(self._close(client.websocket, SLOW_CLIENT_CLOSE_CODE, 'Client too slow'))
+
+    @staticmethod
+    async def _close(websocket, code, reason):
+        try:
+            await websocket.close(code, reason)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _drain(self, client):
+        """Send a client's queued messages in order, then its screen, then its hint"""
+        try:
+            while not client.closing:
+                await client.wakeup.wait()
+                client.wakeup.clear()
+                while (client.queue or client.state is not None or client.hint is not None) and not client.closing:
+                    if client.queue:
+                        message = client.queue.popleft()
+                    elif client.state is not None:
+                        message, client.state = client.state, None
+                    else:
+                        message, client.hint = client.hint, None
+                    if isinstance(message, Outbound):
+                        try:
+                            payload = message.encode(client.encoding, client.song_refs)
+                        except Exception as e:
+                            # One message that can't be encoded (e.g. bytes
+                            # for a JSON client) must not stop the others
+                            log.error("Dropping a message %s can't be sent: %s", client, e, exc_info=True)
+                            continue
+                        await client.websocket.send(payload)
+                        WS_DELIVERY_SECONDS.observe(time.perf_counter() - message.created,
+                                                    role=client.role or 'none')
+                        if message.trace is not None and self.tracer:
+                            self.tracer.forwarded(message.trace, client)
+                    else:
+                        await client.websocket.send(message)
+                if client.dropped >= self.queue_size:
+                    log.info("%s caught up after skipping %d message(s)", client, client.dropped)
+                client.dropped = 0
+        except websockets.exceptions.ConnectionClosed:
+            pass  # Unregistered when its handler finishes
+        except Exception:
+            # Without its sender the client would stay connected and never
+            # hear another message; close it so it reconnects
+            log.error("Sending to %s failed, closing it", client, exc_info=True)
+            client.closing = True
+            await self._close(client.websocket, INTERNAL_ERROR_CLOSE_CODE, 'Internal error')
+
+    async def serve(self, websocket):
+        """Handle one WebSocket connection until it closes"""
+        client = Client(websocket, next(self._ids))
+        self._add(client)
+        sender = asyncio.ensure_future(self._drain(client))
+        log.info("Client connected. Total clients: %d", len(self))
+
+        try:
+            async for message in websocket:
+                data = decode_incoming(message)
+                if data is None:
+                    log.warning("Invalid message received from %s", client)
+                    continue
+                if not isinstance(data, dict):
+                    continue
+
+                message_type = data.get('type')
+                if not isinstance(message_type, str):
+                    message_type = None  # A list or object can't be looked up; unknown like a missing type
+                known = message_type in ROUTES or message_type in CLIENT_MESSAGES
+                WS_MESSAGES_RECEIVED.inc(type=message_type if known else 'other')
+                if message_type == 'hello':
+                    reply = self.hello(client, data)
+                    self.send([client], json.dumps(reply))
+                    if reply['type'] == 'hello':
+                        log.info("%s joined", client,
+                                 extra={'client': client.id, 'role': client.role, 'channel': client.channel})
+                        # Show a joining display (or operator) what is on screen now
+                        self._send_current_state(client)
+                    continue
+
+                if message_type == 'clock_sync':
+                    self.send([client], json.dumps(clock_sync_reply(data)))
+                    if self.tracer:
+                        self.tracer.clock(client, data)
+                    continue
+
+                if message_type == 'slide_ack':
+                    if self.tracer:
+                        self.tracer.painted(client, data)
+                    continue
+
+                if (client.role not in PUBLISHERS or message_type not in ROUTES
+                        or message_type in SERVER_MESSAGES):
+                    log.info("Ignored '%s' from %s", message_type, client)
+                    continue
+
+                # JSON clients get the original text; it is only parsed to route it
+                message = Outbound(text=message) if isinstance(message, str) else Outbound(data=data)
+                if self.tracer and 'trace' in data:
+                    message.trace = self.tracer.received(data['trace'], client)
+                recipients = self.recipients(message_type, client.channel, exclude=client)
+                if message_type in STATE_MESSAGES:
+                    self._state[client.channel] = message
+                    self.send_state(recipients, message)
+                    if message_type == 'song_phrase' and self.prefetch:
+                        asyncio.ensure_future(self._send_prefetch(data, client.channel, exclude=client))
+                else:
+                    self.send(recipients, message)
+                log.debug("%s from %s to %d client(s)", message_type, client, len(recipients),
+                          extra={'sample': MESSAGE_LOG_SAMPLE})
+
+                # Let the senders run before reading the rest of a burst
+                await asyncio.sleep(0)
+
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._remove(client)
+            client.closing = True
+            sender.cancel()
+            log.info("Client disconnected. Total clients: %d", len(self))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Zero-copy file responses for the Church Presentation Web App Server
+Sends files with socket.sendfile() so the bytes go from the page cache to
+the socket without passing through Python, and answers single-range
+requests (Range / If-Range) with 206 Partial Content.
+"""
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from song_catalog import etag_matches
+
+# Chunk size when there is no socket to sendfile() to (single-port mode)
+COPY_CHUNK_SIZE = 64 * 1024
+
+_UNSATISFIABLE = object()
+
+
+def file_etag(stat):
+    """Validator derived from a file's mtime and size"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(range_header, size):
+    """
+    Return (start, end) inclusive for a single 'bytes=' range, None when
+    the whole file should be sent, or _UNSATISFIABLE
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    spec = range_header[6:].strip()
+    if ',' in spec:
+        return None  # Multiple ranges: send the whole file instead
+
+    first, sep, last = spec.partition('-')
+    first, last = first.strip(), last.strip()
+    if not sep or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return _UNSATISFIABLE
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return _UNSATISFIABLE
+    return start, min(end, size - 1)
+
+
+class SendfileHandlerMixin:
+    """
+    File responses via sendfile() with Range support.
+    Mix in before SimpleHTTPRequestHandler.
+    """
+
+    def send_file(self, path, content_type, cache_control=None):
+        """Send a file from disk, honouring conditional and Range requests"""
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = file_etag(stat)
+            last_modified = formatdate(timeval=stat.st_mtime, localtime=False, usegmt=True)
+
+            if self._file_not_modified(etag, stat):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                if cache_control:
+                    self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+
+            byte_range = None
+            if_range = self.headers.get('If-Range')
+            if not if_range or if_range in (etag, last_modified):
+                byte_range = parse_range(self.headers.get('Range'), size)
+
+            if byte_range is _UNSATISFIABLE:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', end - start + 1)
+            if byte_range:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            if cache_control:
+                self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+
+            self.copy_file_range(f, start, end - start + 1)
+
+    def copy_file_range(self, f, offset, count):
+        """Write count bytes of f from offset to the client"""
+        if count <= 0:
+            return
+
+        if self.connection is not None:
+            self.wfile.flush()
+            sent = self.connection.sendfile(f, offset, count)
+        else:
+            # No socket to hand the file to - copy in chunks
+            f.seek(offset)
+            sent = 0
+            while sent < count:
+                chunk = f.read(min(COPY_CHUNK_SIZE, count - sent))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+        # The file shrank under us; the response is short, so drop the connection
+        if sent < count:
+            self.close_connection = True
+
+    def _file_not_modified(self, etag, stat):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return etag_matches(if_none_match, etag)
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since is None or since.tzinfo is None:
+                return False
+            return int(stat.st_mtime) <= since.timestamp()
+        return False
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Concurrent HTTP serving for the Church Presentation Web App Server
+Requests are handled by a bounded pool of worker threads so one slow
+client never holds up the others, with explicit limits on concurrency and
+on keep-alive reuse. Between requests, idle keep-alive connections wait
+in a selector rather than each holding a worker. When every worker is
+busy, requests wait their turn; only new connections are turned away,
+and only once the wait grows too long.
+"""
+
+import logging
+import selectors
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import metrics
+
+# Defaults, overridable per server
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_KEEPALIVE_TIMEOUT = 5.0
+DEFAULT_KEEPALIVE_REQUESTS = 100
+
+# Idle connections kept open between requests; beyond this the longest
+# idle is closed (select() on Windows watches at most 512 sockets)
+MAX_IDLE_CONNECTIONS = 256
+
+# How often idle connections are checked for the keep-alive timeout
+IDLE_CHECK_SECONDS = 1.0
+
+# With every worker busy, requests wait for one in arrival order. A new
+# connection is answered 503 if this many are already waiting or once it
+# has waited this long; the next request on a kept-alive connection always
+# waits, as browsers do not retry it
+MAX_WAITING_REQUESTS = 64
+BUSY_WAIT_SECONDS = 2.0
+
+log = logging.getLogger('HTTP')
+
+HTTP_REQUESTS = metrics.counter(
+    'presenter_http_requests_total', 'HTTP requests answered', ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'presenter_http_request_duration_seconds', 'Time to answer an HTTP request', ('route',))
+HTTP_RESPONSE_BYTES = metrics.counter(
+    'presenter_http_response_bytes_total', 'HTTP response body bytes sent, by content encoding',
+    ('route', 'encoding'))
+HTTP_IN_PROGRESS = metrics.gauge(
+    'presenter_http_requests_in_progress', 'HTTP requests being answered')
+HTTP_REJECTED = metrics.counter(
+    'presenter_http_rejected_connections_total', 'Connections turned away at the connection limit')
+HTTP_IDLE_CONNECTIONS = metrics.gauge(
+    'presenter_http_idle_connections', 'Keep-alive connections waiting for their next request')
+
+_METRIC_METHODS = ('GET', 'HEAD', 'POST', 'OPTIONS')
+
+_BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 12\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"Server busy\n"
+)
+
+
+class KeepAliveHandlerMixin:
+    """
+    Persistent HTTP/1.1 connections with an idle timeout and a cap on
+    the number of requests served per connection.
+    Mix in before SimpleHTTPRequestHandler.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = DEFAULT_KEEPALIVE_TIMEOUT  # Idle (or stalled) seconds before a connection is dropped
+    # Headers and body are separate writes; with Nagle's algorithm the body
+    # waits for the client's delayed ACK (~40 ms) on a reused connection
+    disable_nagle_algorithm = True
+    max_keepalive_requests = DEFAULT_KEEPALIVE_REQUESTS
+
+    def handle(self):
+        # A server that parks idle connections resumes them with a new handler
+        previous_requests = getattr(self.server, 'previous_requests', None)
+        self.requests_handled = previous_requests(self.request) if previous_requests else 0
+        self.close_connection = True
+        self.handle_one_request()
+        # Go on while the next request is already here; otherwise return the
+        # open connection to the server instead of waiting on it
+        while not self.close_connection and (previous_requests is None or self._request_waiting()):
+            self.handle_one_request()
+
+    def _request_waiting(self):
+        """Whether the next request has started to arrive, without waiting"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        self.header_names_sent = set()  # Lowercase names sent in the current response
+        if not super().parse_request():
+            return False
+        self.requests_handled += 1
+        if self.requests_handled >= self.max_keepalive_requests:
+            self.close_connection = True
+        return True
+
+    def send_header(self, keyword, value):
+        if not hasattr(self, 'header_names_sent'):
+            self.header_names_sent = set()
+        self.header_names_sent.add(keyword.lower())
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        # Tell the client when this is the last response on the connection
+        if self.close_connection and 'connection' not in getattr(self, 'header_names_sent', ()):
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def send_chunk(self, data):
+        """Write one chunk of a 'Transfer-Encoding: chunked' body; b'' ends it"""
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+class RequestMetricsMixin:
+    """
+    Request counts, latency and response bytes per route for /metrics.
+    Mix in first, before KeepAliveHandlerMixin.
+    """
+
+    # Paths reported as their own route; entries ending in '/' are
+    # prefixes. Other /api/ paths are '/api/other', everything else 'static'
+    metric_routes = ()
+
+    def handle_one_request(self):
+        self.path = ''
+        self.metric_status = None
+        self.metric_bytes = 0
+        self.metric_encoding = 'identity'
+        start = time.perf_counter()
+        HTTP_IN_PROGRESS.inc()
+        try:
+            super().handle_one_request()
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            if self.metric_status is not None:
+                self._record_request(time.perf_counter() - start)
+
+    def metric_route(self):
+        path = self.path.split('?', 1)[0]
+        for route in self.metric_routes:
+            if path == route or (route.endswith('/') and path.startswith(route)):
+                return route
+        return '/api/other' if path.startswith('/api/') else 'static'
+
+    def _record_request(self, seconds):
+        route = self.metric_route()
+        method = self.command if self.command in _METRIC_METHODS else 'other'
+        HTTP_REQUESTS.inc(route=route, method=method, status=self.metric_status)
+        HTTP_REQUEST_SECONDS.observe(seconds, route=route)
+        if self.metric_bytes and method != 'HEAD':
+            HTTP_RESPONSE_BYTES.inc(self.metric_bytes, route=route, encoding=self.metric_encoding)
+
+    def send_response(self, code, message=None):
+        self.metric_status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        name = keyword.lower()
+        if name == 'content-length':
+            self.metric_bytes = int(value)
+        elif name == 'content-encoding':
+            self.metric_encoding = value
+        super().send_header(keyword, value)
+
+    def send_chunk(self, data):
+        self.metric_bytes += len(data)
+        super().send_chunk(data)
+
+
+class AccessLogMixin:
+    """
+    One structured access log record per request (client, method, path,
+    status) through the logging module instead of stderr.
+    """
+
+    # Statuses logged at DEBUG rather than INFO, e.g. (200, 304) to log
+    # only the requests that did not go as expected
+    quiet_statuses = ()
+
+    def log_request(self, code='-', size='-'):
+        status = code.value if isinstance(code, HTTPStatus) else code
+        level = logging.DEBUG if status in self.quiet_statuses else logging.INFO
+        if not log.isEnabledFor(level):
+            return
+        log.log(level, '%s - "%s" %s', self.address_string(), self.requestline, status, extra={
+            'client': self.client_address[0],
+            'method': self.command,
+            'path': self.path,
+            'status': status
+        })
+
+    def log_message(self, format, *args):
+        # Malformed requests, timeouts and send_error() details
+        log.warning('%s - %s', self.address_string(), format % args)
+
+
+class BoundedThreadPoolHTTPServer(socketserver.TCPServer):
+    """
+    HTTP server that hands each request to a fixed-size worker pool.
+    Connections waiting for a request (new or kept alive) are watched by a
+    single thread and only given a worker once the request arrives.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_class, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_idle_connections=MAX_IDLE_CONNECTIONS):
+        self.max_connections = max_connections
+        self.max_idle_connections = max_idle_connections
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._pool = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='http-worker')
+        self._requests_before = {}  # connection -> requests served before it went idle
+        self._idle = OrderedDict()  # connection -> (client address, requests served, idle since)
+        self._parking = deque()  # Connections handed back by workers, for the idle thread
+        self._waiting = deque()  # (connection, client address, requests served, since) awaiting a worker
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._closed = False
+        super().__init__(server_address, handler_class)
+        self._wakeup_reader.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        threading.Thread(target=self._watch_idle, name='http-idle', daemon=True).start()
+
+    def process_request(self, request, client_address):
+        # Never blocks the accept loop: the connection waits with the idle
+        # ones until its first request arrives
+        self._park(request, client_address, 0)
+
+    def previous_requests(self, request):
+        """Requests served on a connection before it last went idle"""
+        return self._requests_before.get(request, 0)
+
+    def _dispatch(self, request, client_address, requests_handled):
+        # Every request being answered owns a worker; with all of them busy
+        # the request waits (in order) for one to be released
+        if requests_handled == 0 and len(self._waiting) >= MAX_WAITING_REQUESTS:
+            self._reject(request)
+            return
+        self._waiting.append((request, client_address, requests_handled, time.monotonic()))
+
+    def _dispatch_waiting(self):
+        while self._waiting and self._slots.acquire(blocking=False):
+            request, client_address, requests_handled, _ = self._waiting.popleft()
+            self._pool.submit(self._process_request_worker, request, client_address, requests_handled)
+        if not self._waiting:
+            return
+        waited_since = time.monotonic() - BUSY_WAIT_SECONDS
+        waiting = deque()
+        for entry in self._waiting:
+            request, _, requests_handled, since = entry
+            if requests_handled == 0 and since < waited_since:
+                self._reject(request)
+            else:
+                waiting.append(entry)
+        self._waiting = waiting
+
+    def _process_request_worker(self, request, client_address, requests_handled):
+        keep_open = False
+        self._requests_before[request] = requests_handled
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+            keep_open = not handler.close_connection
+            requests_handled = getattr(handler, 'requests_handled', requests_handled)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            del self._requests_before[request]
+            self._slots.release()
+            if self._waiting:
+                self._wake_idle_thread()
+            if keep_open:
+                self._park(request, client_address, requests_handled)
+            else:
+                self.shutdown_request(request)
+
+    def _park(self, request, client_address, requests_handled):
+        """Hand a connection to the idle thread until its next request"""
+        self._parking.append((request, client_address, requests_handled))
+        self._wake_idle_thread()
+
+    def _wake_idle_thread(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass  # Already woken (buffer full) or shutting down
+
+    def _watch_idle(self):
+        timeout = getattr(self.RequestHandlerClass, 'timeout', None)
+        while not self._closed:
+            while self._parking:
+                self._add_idle(*self._parking.popleft())
+            try:
+                events = self._selector.select(IDLE_CHECK_SECONDS)
+            except (OSError, ValueError):
+                break  # Selector closed
+            for key, _ in events:
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        while self._wakeup_reader.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                request = key.fileobj
+                self._selector.unregister(request)
+                client_address, requests_handled, _ = self._idle.pop(request)
+                self._dispatch(request, client_address, requests_handled)
+            self._dispatch_waiting()
+            if timeout is not None:
+                self._close_idle(time.monotonic() - timeout)
+            HTTP_IDLE_CONNECTIONS.set(len(self._idle))
+
+        self._close_idle(float('inf'))
+        while self._waiting:
+            self.shutdown_request(self._waiting.popleft()[0])
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _add_idle(self, request, client_address, requests_handled):
+        try:
+            self._selector.register(request, selectors.EVENT_READ)
+        except (OSError, ValueError):
+            self.shutdown_request(request)  # Closed by the client meanwhile
+            return
+        self._idle[request] = (client_address, requests_handled, time.monotonic())
+        while len(self._idle) > self.max_idle_connections:
+            self._drop_idle(next(iter(self._idle)))
+
+    def _close_idle(self, idle_before):
+        """Close the connections idle since before the given time"""
+        while self._idle:
+            request, (_, _, idle_since) = next(iter(self._idle.items()))
+            if idle_since >= idle_before:
+                break
+            self._drop_idle(request)
+
+    def _drop_idle(self, request):
+        del self._idle[request]
+        try:
+            self._selector.unregister(request)
+        except (KeyError, ValueError):
+            pass
+        self.shutdown_request(request)
+
+    def _reject(self, request):
+        HTTP_REJECTED.inc()
+        log.warning("All %d workers busy, rejecting client", self.max_connections)
+        try:
+            request.sendall(_BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._closed = True
+        self._wake_idle_thread()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def handle_error(self, request, client_address):
+        # Dropped phone connections are routine on church Wi-Fi
+        error = sys.exc_info()[1]
+        if isinstance(error, (ConnectionError, socket.timeout)):
+            return
+        log.error("Error handling request from %s", client_address[0], exc_info=True)
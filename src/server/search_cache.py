@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Precomputed transliteration cache for the song library
+Stores the Singlish and phonetic search forms of every title and lyric line
+in a sidecar file next to the songs, so nothing is transliterated at query
+time or recomputed on the next start.
+
+Rebuild the cache for existing songs with:
+    python src/server/search_cache.py [songs_dir]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from transliteration import to_singlish, normalize, normalize_phonetic
+
+log = logging.getLogger('Search')
+
+CACHE_FILENAME = '.search-cache'
+
+# Bump when the transliteration tables or phonetic rules change
+CACHE_VERSION = 1
+
+
+def song_fingerprint(song):
+    """Hash of the fields the search forms are derived from"""
+    source = json.dumps([song.get('title', ''), song.get('phrases', [])], ensure_ascii=False)
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def derive_search_forms(song):
+    """
+    Return {'title': [singlish, key], 'phrases': [[[singlish, key], ...], ...]}
+    where key is the phonetic-normalized Singlish used by the search index
+    """
+    def forms(text):
+        singlish = to_singlish(text)
+        return [singlish, normalize_phonetic(normalize(singlish))]
+
+    phrases = []
+    for phrase in song.get('phrases', []):
+        # Handle both string phrases (old format) and array phrases
+        lines = phrase if isinstance(phrase, list) else str(phrase).split('\n')
+        phrases.append([forms(line) for line in lines])
+
+    return {'title': forms(song.get('title', '')), 'phrases': phrases}
+
+
+class SearchFormCache:
+    """Sidecar file of derived search forms keyed by song filename"""
+
+    def __init__(self, songs_dir):
+        self.path = Path(songs_dir) / CACHE_FILENAME
+        self._entries = {}  # filename -> {'fingerprint', 'forms'}
+        self._dirty = False
+
+    def load(self):
+        """Read the sidecar file, ignoring it if missing or out of date"""
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self._entries = data.get('songs', {})
+        except (OSError, ValueError):
+            pass
+        return len(self._entries)
+
+    def get(self, filename, song):
+        """Return the search forms for a song, computing them if stale"""
+        fingerprint = song_fingerprint(song)
+        entry = self._entries.get(filename)
+        if entry is None or entry.get('fingerprint') != fingerprint:
+            entry = {'fingerprint': fingerprint, 'forms': derive_search_forms(song)}
+            self._entries[filename] = entry
+            self._dirty = True
+        return entry['forms']
+
+    def discard(self, filename):
+        """Forget a deleted song"""
+        if self._entries.pop(filename, None) is not None:
+            self._dirty = True
+
+    def retain(self, filenames):
+        """Drop entries for songs that no longer exist"""
+        for filename in set(self._entries) - set(filenames):
+            self.discard(filename)
+
+    def save(self):
+        """Write the sidecar file atomically if anything changed"""
+        return self.write(self.pending())
+
+    def pending(self):
+        """
+        Return a copy of the entries to write if anything changed since the
+        last save, or None; write() it later without holding up edits
+        """
+        if not self._dirty:
+            return None
+        self._dirty = False
+        return dict(self._entries)
+
+    def write(self, entries):
+        """Write entries from pending() to the sidecar file atomically"""
+        if entries is None:
+            return False
+
+        data = {'version': CACHE_VERSION, 'songs': entries}
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            self.path.parent.mkdir(exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            log.warning("Could not write search cache %s: %s", self.path, e)
+            self._dirty = True  # Try again on the next save
+            return False
+        return True
+
+
+def rebuild(songs_dir):
+    """Recompute the search forms for every song file in songs_dir"""
+    songs_dir = Path(songs_dir)
+    cache = SearchFormCache(songs_dir)
+
+    count = 0
+    for song_file in sorted(songs_dir.glob('*.json')):
+        try:
+            with open(song_file, 'r', encoding='utf-8') as f:
+                song = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Skipping unreadable song %s: %s", song_file.name, e)
+            continue
+        cache.get(song_file.name, song)
+        count += 1
+
+    cache._dirty = True
+    cache.save()
+    log.info("Rebuilt search cache for %d songs: %s", count, cache.path)
+    return count
+
+
+if __name__ == '__main__':
+    from server_logging import setup_logging
+    setup_logging()
+    default_dir = Path(__file__).parent.parent / 'songs'
+    rebuild(sys.argv[1] if len(sys.argv) > 1 else default_dir)
@@ -9,28 +9,103 @@ Features:
 
 import asyncio
 import http.server
-import socketserver
+import logging
 import threading
+import time
 import json
 import socket
 import os
-import gzip
-import io
+import sys
+from functools import partial
 from pathlib import Path
-from email.utils import formatdate
 import websockets
 
+import metrics
+from http_pool import AccessLogMixin, BoundedThreadPoolHTTPServer, KeepAliveHandlerMixin, RequestMetricsMixin
+from asset_cache import StaticAssetCache
+from display_hub import DisplayHub
+from file_transfer import SendfileHandlerMixin
+from song_catalog import SongCatalog, etag_matches
+from song_export import EXPORT_FORMATS, ChunkWriter, iter_library, parse_since, write_export
+from song_import import ImportFormatError, import_stream, import_text, preview_text, save_many, summarize
+from song_store import open_song_store
+from server_logging import setup_logging
+from slide_prefetch import next_slides
+from slide_trace import SlideTracer
+from song_watcher import SongWatcher
+from unified_server import UnifiedServer, WEBSOCKET_PATH
+from ws_encoding import selective_deflate_protocol
+
 # Configuration - Azure compatible
 HTTP_PORT = int(os.environ.get('HTTP_PORT', os.environ.get('PORT', 8000)))
 WEBSOCKET_PORT = int(os.environ.get('WEBSOCKET_PORT', 8765))
 
-# Store connected WebSocket clients
-connected_clients = set()
+# Serve HTTP and WebSocket (at /ws) on HTTP_PORT alone
+SINGLE_PORT = (os.environ.get('SINGLE_PORT', '').lower() in ('1', 'true', 'yes')
+               or '--single-port' in sys.argv)
+
+# HTTP concurrency limits
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 64))
+HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 5))
+HTTP_KEEPALIVE_REQUESTS = int(os.environ.get('HTTP_KEEPALIVE_REQUESTS', 100))
+
+# Outbound messages queued per WebSocket client, and what happens when a
+# slow client's queue is full: 'latest' (skip to the newest message) or
+# 'disconnect'
+WEBSOCKET_QUEUE_SIZE = int(os.environ.get('WEBSOCKET_QUEUE_SIZE', 16))
+WEBSOCKET_SLOW_CLIENTS = os.environ.get('WEBSOCKET_SLOW_CLIENTS', 'latest').lower()
+
+# permessage-deflate for WebSocket clients: 'auto' (only clients outside
+# the local network), 'always' or 'never'. Behind a reverse proxy every
+# client looks local, so use 'always' there to compress for remote viewers
+WEBSOCKET_COMPRESSION = os.environ.get('WEBSOCKET_COMPRESSION', 'auto').lower()
+
+# Slides after the current song phrase sent to displays ahead of time (0: off)
+PREFETCH_SLIDES = int(os.environ.get('PREFETCH_SLIDES', 2))
 
 # Change to the static directory for serving files
 STATIC_DIR = Path(__file__).parent.parent / 'static'
 SONGS_DIR = Path(__file__).parent.parent / 'songs'
 
+# Optional packed copy of the song library for fast cold starts
+# (build with: python src/server/song_pack.py pack)
+SONG_PACK = os.environ.get('SONG_PACK')
+
+# Song storage: 'json' (one file per song in SONGS_DIR) or 'sqlite' (SONG_DB)
+SONG_STORE = os.environ.get('SONG_STORE', 'json')
+SONG_DB = os.environ.get('SONG_DB', str(SONGS_DIR.parent / 'songs.db'))
+
+# Pick up songs edited outside the app: 'auto' (inotify, else polling),
+# 'inotify', 'poll' or 'off'
+SONG_WATCH = os.environ.get('SONG_WATCH', 'auto').lower()
+
+# Log level (DEBUG, INFO, WARNING, ERROR) and format: 'text' or 'json'
+# (one object per line, for log collectors)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+setup_logging(LOG_LEVEL, LOG_FORMAT)
+log = logging.getLogger('HTTP')
+
+song_store = open_song_store(SONG_STORE, SONGS_DIR, SONG_DB)
+
+# In-memory song library, loaded once at startup
+song_catalog = SongCatalog(SONGS_DIR, pack_path=SONG_PACK if song_store.kind == 'json' else None,
+                           store=song_store)
+
+# Static files with pre-compressed variants, loaded once at startup
+asset_cache = StaticAssetCache(STATIC_DIR)
+
+# Song files get the same pre-compressed responses as the static files
+song_file_cache = StaticAssetCache(SONGS_DIR)
+
+# Slide latency from operator click to display paint, per display
+slide_tracer = SlideTracer()
+
+# Connected WebSocket clients and who receives which messages
+display_hub = DisplayHub(queue_size=WEBSOCKET_QUEUE_SIZE, slow_client_policy=WEBSOCKET_SLOW_CLIENTS,
+                         prefetch=partial(next_slides, song_catalog, count=PREFETCH_SLIDES),
+                         tracer=slide_tracer)
+
 # Change working directory to static for HTTP server
 os.chdir(STATIC_DIR)
 
@@ -48,9 +123,21 @@ def get_local_ip():
         return "localhost"
 
 
-class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+class OptimizedHTTPRequestHandler(RequestMetricsMixin, AccessLogMixin, KeepAliveHandlerMixin, SendfileHandlerMixin, http.server.SimpleHTTPRequestHandler):
     """Optimized HTTP request handler with caching, compression, and CORS support"""
     
+    # Keep-alive limits
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+    max_keepalive_requests = HTTP_KEEPALIVE_REQUESTS
+    
+    # Routes reported separately in /metrics
+    metric_routes = ('/songs/', '/api/songs', '/api/search', '/api/export', '/api/save-songs',
+                     '/api/import-stream', '/api/import-text', '/api/update-song', '/api/delete-song',
+                     '/api/diagnostics/latency', '/server-info.json', '/metrics')
+    
+    # Only requests that did not go as expected are logged at INFO
+    quiet_statuses = (200, 304)
+    
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -60,13 +147,18 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         # Add caching headers based on file type
         path = self.path.lower()
         
+        # API responses and fingerprinted assets set their own caching headers
+        if path.startswith('/api/') or 'cache-control' in self.header_names_sent:
+            pass
+        
         # HTML files - minimal cache (5 minutes) to allow updates
-        if path.endswith('.html') or path == '/':
+        elif path.endswith('.html') or path == '/':
             self.send_header('Cache-Control', 'public, max-age=300')
         
-        # Static assets - aggressive caching (1 year)
+        # Static assets under their plain names - revalidate (cheap 304 by ETag);
+        # pages load them through fingerprinted URLs that are cached for a year
         elif path.endswith(('.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.eot')):
-            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.send_header('Cache-Control', 'no-cache')
         
         # JSON song files - moderate caching (1 hour)
         elif path.endswith('.json'):
@@ -80,6 +172,36 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     
     def do_GET(self):
         """Handle GET requests with compression support"""
+        # Whole song library in a single response
+        if self.path.split('?', 1)[0] == '/api/songs':
+            self.serve_song_catalog()
+            return
+        
+        # Ranked Singlish search over titles and lyrics
+        if self.path.split('?', 1)[0] == '/api/search':
+            self.serve_search_results()
+            return
+        
+        # Whole library as a download, streamed song by song
+        if self.path.split('?', 1)[0] == '/api/export':
+            self.serve_export()
+            return
+        
+        # Request, cache and WebSocket metrics for Prometheus
+        if self.path.split('?', 1)[0] == '/metrics':
+            self.serve_metrics()
+            return
+        
+        # Slide latency per display, for diagnostics.html
+        if self.path.split('?', 1)[0] == '/api/diagnostics/latency':
+            self.send_json_response(slide_tracer.report(), cache_control='no-store')
+            return
+        
+        # Server address and WebSocket location for clients
+        if self.path.split('?', 1)[0] == '/server-info.json':
+            self.serve_server_info()
+            return
+        
         # Handle songs directory
         if self.path.startswith('/songs/'):
             song_filename = self.path[7:]  # Remove '/songs/' prefix
@@ -92,18 +214,15 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.serve_song_file(song_filename)
                 return
         
-        # Check if client accepts gzip
-        accept_encoding = self.headers.get('Accept-Encoding', '')
-        can_gzip = 'gzip' in accept_encoding.lower()
+        # Static files come pre-compressed from the asset cache
+        if self.send_cached_asset():
+            return
         
-        # Get the file path
+        # Large and binary files go from disk to the socket with sendfile()
         path = self.translate_path(self.path)
-        
-        # Check if file exists and should be compressed
-        if os.path.isfile(path) and can_gzip:
-            # Only compress text-based files
-            if path.endswith(('.html', '.css', '.js', '.json', '.svg', '.xml', '.txt')):
-                return self.send_compressed_file(path)
+        if os.path.isfile(path):
+            self.send_file(path, self.guess_type(path))
+            return
         
         # Fall back to default behavior
         return super().do_GET()
@@ -111,10 +230,7 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def list_songs_directory(self):
         """List all songs in JSON format"""
         try:
-            songs = []
-            if SONGS_DIR.exists():
-                for song_file in sorted(SONGS_DIR.glob('*.json')):
-                    songs.append(song_file.name)
+            songs = song_catalog.filenames()
             
             response = json.dumps(songs)
             self.send_response(200)
@@ -124,89 +240,247 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(response.encode('utf-8'))
         except Exception as e:
-            print(f"[HTTP] Error listing songs: {e}")
+            log.error("Error listing songs: %s", e, exc_info=True)
             self.send_error(500, "Internal Server Error")
     
-    def serve_song_file(self, filename):
-        """Serve a specific song file with compression"""
+    def serve_song_catalog(self):
+        """Serve every song (filename, title, phrases) from the pre-built catalog"""
         try:
-            from urllib.parse import unquote
-            filename = unquote(filename)
-            filepath = SONGS_DIR / filename
+            # Incremental sync: ?since=<revision>&epoch=<epoch>
+            from urllib.parse import urlparse, parse_qs
+            query = parse_qs(urlparse(self.path).query)
+            since = query.get('since', [''])[0]
+            epoch = query.get('epoch', [''])[0]
+            
+            if since.isdigit() and epoch == song_catalog.epoch:
+                result = song_catalog.changes_since(int(since))
+                if result is not None:
+                    revision, changes = result
+                    self.send_catalog_changes(revision, changes)
+                    return
             
-            if not filepath.exists():
-                self.send_error(404, "Song not found")
+            # Unknown or expired revision - send the full snapshot
+            body, gzip_body, etag = song_catalog.snapshot()
+            
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
                 return
             
             # Check if client accepts gzip
             accept_encoding = self.headers.get('Accept-Encoding', '')
             can_gzip = 'gzip' in accept_encoding.lower()
+            content = gzip_body if can_gzip else body
             
-            with open(filepath, 'rb') as f:
-                content = f.read()
-            
-            # Try to compress if supported
-            if can_gzip:
-                buf = io.BytesIO()
-                with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gz:
-                    gz.write(content)
-                compressed_content = buf.getvalue()
-                
-                # Only use compression if it actually reduced size
-                if len(compressed_content) < len(content):
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.send_header('Content-Encoding', 'gzip')
-                    self.send_header('Content-Length', len(compressed_content))
-                    self.end_headers()
-                    self.wfile.write(compressed_content)
-                    return
-            
-            # Send uncompressed
             self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            if can_gzip:
+                self.send_header('Content-Encoding', 'gzip')
             self.send_header('Content-Length', len(content))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
             self.end_headers()
             self.wfile.write(content)
         except Exception as e:
-            print(f"[HTTP] Error serving song file: {e}")
+            log.error("Error serving song catalog: %s", e, exc_info=True)
             self.send_error(500, "Internal Server Error")
     
-    def send_compressed_file(self, filepath):
-        """Send file with gzip compression"""
+    def send_catalog_changes(self, revision, changes):
+        """Send only the songs that changed since the client's revision"""
+        response = {
+            'epoch': song_catalog.epoch,
+            'revision': revision,
+            'full': False,
+            'changes': changes
+        }
+        self.send_json_response(response, cache_control='no-store')
+    
+    def serve_server_info(self):
+        """Tell clients the server address and where to open the WebSocket"""
+        response = {
+            'ip': get_local_ip(),
+            'port': HTTP_PORT,
+            'singlePort': SINGLE_PORT,
+            'websocketPort': HTTP_PORT if SINGLE_PORT else WEBSOCKET_PORT,
+            'websocketPath': WEBSOCKET_PATH if SINGLE_PORT else '/'
+        }
+        self.send_json_response(response, cache_control='no-store')
+    
+    def serve_metrics(self):
+        """Serve every metric in the Prometheus text format"""
+        content = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', len(content))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def serve_export(self):
+        """
+        Stream the library as ?format=json|ndjson|zip with chunked encoding.
+        ?since=<unix seconds or ISO date> limits it to songs modified later;
+        X-Export-Time is the value to pass as since for the next backup.
+        """
+        from urllib.parse import urlparse, parse_qs
+        query = parse_qs(urlparse(self.path).query)
+        export_format = query.get('format', ['json'])[0]
+        
+        if export_format not in EXPORT_FORMATS:
+            self.send_json_response({'error': f"Unknown format '{export_format}'"}, 400)
+            return
         try:
-            with open(filepath, 'rb') as f:
-                content = f.read()
+            since = parse_since(query.get('since', [''])[0])
+        except ValueError:
+            self.send_json_response({'error': 'since must be Unix seconds or an ISO 8601 date'}, 400)
+            return
+        
+        content_type, extension = EXPORT_FORMATS[export_format]
+        export_time = time.time()
+        filename = f"church-songs-{time.strftime('%Y-%m-%d', time.localtime(export_time))}.{extension}"
+        
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Export-Time', f'{export_time:.3f}')
+        self.end_headers()
+        
+        out = ChunkWriter(self.send_chunk)
+        try:
+            count = write_export(out, export_format, iter_library(song_store, song_catalog, since))
+            out.flush()
+            log.info("Exported %d songs as %s (%d bytes)", count, export_format, out.bytes_written)
+        except Exception as e:
+            # Headers are gone; cut the response short so the client sees an error
+            log.error("Error exporting songs: %s", e, exc_info=True)
+            self.close_connection = True
+            return
+        self.send_chunk(b'')
+    
+    def serve_search_results(self):
+        """Serve the top ranked songs for /api/search?q=<query>&limit=<n>"""
+        try:
+            from urllib.parse import urlparse, parse_qs
+            query = parse_qs(urlparse(self.path).query)
+            search_term = query.get('q', [''])[0]
+            limit = query.get('limit', [''])[0]
+            limit = min(int(limit), 100) if limit.isdigit() else 20
             
-            # Compress content
-            buf = io.BytesIO()
-            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gz:
-                gz.write(content)
-            compressed_content = buf.getvalue()
+            response = {
+                'query': search_term,
+                'results': song_catalog.search(search_term, limit)
+            }
+            self.send_json_response(response, cache_control='no-store')
+        except Exception as e:
+            log.error("Error searching songs: %s", e, exc_info=True)
+            self.send_error(500, "Internal Server Error")
+    
+    def serve_song_file(self, filename):
+        """Serve a specific song file with compression"""
+        try:
+            from urllib.parse import unquote
+            filename = unquote(filename)
+            filepath = song_store.path_for(filename)
             
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-Type', self.guess_type(filepath))
-            self.send_header('Content-Encoding', 'gzip')
-            self.send_header('Content-Length', len(compressed_content))
-            self.send_header('Last-Modified', formatdate(timeval=os.path.getmtime(filepath), localtime=False, usegmt=True))
-            self.end_headers()
-            self.wfile.write(compressed_content)
+            # Songs kept in a database are served from the catalog
+            if filepath is None:
+                self.send_stored_song(filename)
+                return
             
+            if not filepath.exists():
+                self.send_error(404, "Song not found")
+                return
+            
+            # Compressed once and kept until the file changes on disk
+            asset = song_file_cache.get(filepath)
+            if asset is None:
+                self.send_file(filepath, 'application/json')
+                return
+            self.send_asset(asset)
         except Exception as e:
-            print(f"[HTTP] Error sending compressed file {filepath}: {e}")
+            log.error("Error serving song file: %s", e, exc_info=True)
             self.send_error(500, "Internal Server Error")
     
+    def send_stored_song(self, filename):
+        """Serve a song that has no file of its own"""
+        song = song_catalog.get(filename)
+        if song is None:
+            self.send_error(404, "Song not found")
+            return
+        self.send_json_response(song)
+    
+    def send_cached_asset(self):
+        """Serve a static file from the asset cache; False if it isn't cached"""
+        path = self.translate_path(self.path)
+        if path.endswith('/'):
+            path += 'index.html'
+        asset, cache_control = asset_cache.resolve(path)
+        if asset is None:
+            return False
+        self.send_asset(asset, cache_control)
+        return True
+    
+    def send_asset(self, asset, cache_control=None):
+        """Send a cached file in the smallest encoding the client accepts"""
+        # Byte ranges are served from the file itself
+        if self.headers.get('Range'):
+            self.send_file(asset.path, asset.content_type, cache_control)
+            return
+        
+        content, encoding, etag = asset.select(self.headers.get('Accept-Encoding'))
+        
+        if asset.not_modified(self.headers):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', asset.last_modified)
+            if cache_control:
+                self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        if cache_control:
+            self.send_header('Cache-Control', cache_control)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', len(content))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        if asset.compressible:
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        self.wfile.write(content)
+    
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', 0)
         self.end_headers()
     
+    def send_json_response(self, data, status=200, cache_control=None):
+        """Send a JSON body with an explicit length so keep-alive connections stay usable"""
+        content = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', len(content))
+        if cache_control:
+            self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(content)
+    
     def do_POST(self):
         """Handle POST requests"""
         if self.path == '/api/save-songs':
             self.handle_save_songs()
+        elif self.path == '/api/import-stream':
+            self.handle_import_stream()
+        elif self.path.split('?', 1)[0] == '/api/import-text':
+            self.handle_import_text()
         elif self.path == '/api/update-song':
             self.handle_update_song()
         elif self.path == '/api/delete-song':
@@ -223,54 +497,33 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             data = json.loads(post_data.decode('utf-8'))
             
             songs = data.get('songs', [])
-            saved_count = 0
-            skipped_count = 0
-            
-            # Create songs directory if it doesn't exist
-            SONGS_DIR.mkdir(exist_ok=True)
-            
-            for song in songs:
-                # Generate filename from title
-                filename = self.generate_filename(song['title'])
-                filepath = SONGS_DIR / filename
-                
-                # Skip if file already exists
-                if filepath.exists():
-                    print(f"[HTTP] Song '{song['title']}' already exists, skipping")
-                    skipped_count += 1
-                    continue
-                
-                # Save the song
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(song, f, indent=2, ensure_ascii=False)
-                
-                print(f"[HTTP] Saved song: {filename}")
-                saved_count += 1
+            
+            # Validate the whole batch, then write every new song at once
+            results = save_many(songs, song_store, song_catalog, self.generate_filename)
+            counts = summarize(results)
+            log.info("Bulk import: %d saved, %d skipped, %d invalid of %d",
+                  counts['saved'], counts['skipped'], counts['invalid'], len(songs))
             
             # Send response
             response = {
                 'success': True,
-                'saved': saved_count,
-                'skipped': skipped_count,
-                'total': len(songs)
+                'saved': counts['saved'],
+                'skipped': counts['skipped'],
+                'invalid': counts['invalid'],
+                'total': len(songs),
+                'results': results
             }
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.send_json_response(response)
             
         except Exception as e:
-            print(f"[HTTP] Error saving songs: {e}")
+            log.error("Error saving songs: %s", e, exc_info=True)
             error_response = {
                 'success': False,
                 'message': str(e)
             }
             
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+            self.send_json_response(error_response, 500)
     
     def generate_filename(self, title):
         """Generate a filename from song title"""
@@ -288,6 +541,78 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         filename = f"{filename}.json"
         return filename
     
+    def handle_import_stream(self):
+        """
+        Import a large song file without buffering it: songs are parsed as the
+        body arrives and saved in batches, with one NDJSON progress line per batch
+        """
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_error(411, "Content-Length required")
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        
+        def send_line(message):
+            self.send_chunk(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        
+        try:
+            report = import_stream(
+                self.rfile, content_length, song_store, song_catalog, self.generate_filename,
+                progress=lambda progress: send_line({'type': 'progress', **progress})
+            )
+            log.info("Streamed import: %d saved, %d skipped, %d invalid of %d",
+                  report['saved'], report['skipped'], report['invalid'], report['processed'])
+            send_line({'type': 'done', 'success': True, **report})
+        except Exception as e:
+            log.error("Error importing songs: %s", e, exc_info=True)
+            send_line({'type': 'error', 'success': False, 'message': str(e)})
+            # The rest of the body is unread
+            self.close_connection = True
+        
+        self.send_chunk(b'')
+    
+    def handle_import_text(self):
+        """
+        Import pasted lyrics sent as text/plain (a blank line ends a verse,
+        two blank lines end a song). With ?preview=1 the songs are parsed and
+        checked but not saved.
+        """
+        from urllib.parse import urlparse, parse_qs
+        query = parse_qs(urlparse(self.path).query)
+        preview = query.get('preview', ['0'])[0] in ('1', 'true')
+        
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_error(411, "Content-Length required")
+            return
+        
+        try:
+            if preview:
+                report = preview_text(self.rfile, content_length, song_catalog, self.generate_filename)
+            else:
+                report = import_text(self.rfile, content_length, song_store, song_catalog, self.generate_filename)
+                log.info("Text import: %d saved, %d skipped, %d invalid of %d",
+                      report['saved'], report['skipped'], report['invalid'], report['processed'])
+            
+            response = {'success': True, 'preview': preview, 'total': report['processed'], **report}
+            self.send_json_response(response)
+            
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            # The rest of the body is unread
+            self.close_connection = True
+            self.send_json_response({'success': False, 'message': str(e)}, 400)
+        except Exception as e:
+            log.error("Error importing songs: %s", e, exc_info=True)
+            self.close_connection = True
+            self.send_json_response({'success': False, 'message': str(e)}, 500)
+    
     def handle_update_song(self):
         """Handle updating a song"""
         try:
@@ -306,26 +631,23 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             from urllib.parse import unquote
             old_filename = unquote(old_filename)
             
-            old_filepath = SONGS_DIR / old_filename
-            
-            # Check if old file exists
-            if not old_filepath.exists():
+            # Check if old song exists
+            if not song_store.exists(old_filename):
                 raise FileNotFoundError(f"Song file {old_filename} not found")
             
             # Generate new filename from new title
             new_filename = self.generate_filename(song['title'])
-            new_filepath = SONGS_DIR / new_filename
             
-            # If title changed, delete old file
+            # If title changed, delete old song
             if old_filename != new_filename:
-                old_filepath.unlink()
-                print(f"[HTTP] Deleted old song file: {old_filename}")
+                song_store.delete(old_filename)
+                song_catalog.remove(old_filename)
+                log.info("Deleted old song: %s", old_filename)
             
             # Save updated song
-            with open(new_filepath, 'w', encoding='utf-8') as f:
-                json.dump(song, f, indent=2, ensure_ascii=False)
-            
-            print(f"[HTTP] Updated song: {new_filename}")
+            song_store.write(new_filename, song)
+            song_catalog.put(new_filename, song)
+            log.info("Updated song: %s", new_filename)
             
             # Send response
             response = {
@@ -333,22 +655,16 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 'filename': new_filename
             }
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.send_json_response(response)
             
         except Exception as e:
-            print(f"[HTTP] Error updating song: {e}")
+            log.error("Error updating song: %s", e, exc_info=not isinstance(e, (ValueError, FileNotFoundError)))
             error_response = {
                 'success': False,
                 'message': str(e)
             }
             
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+            self.send_json_response(error_response, 500)
     
     def handle_delete_song(self):
         """Handle deleting a song"""
@@ -367,15 +683,11 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             from urllib.parse import unquote
             filename = unquote(filename)
             
-            filepath = SONGS_DIR / filename
-            
-            # Check if file exists
-            if not filepath.exists():
+            # Delete the song
+            if not song_store.delete(filename):
                 raise FileNotFoundError(f"Song file {filename} not found")
-            
-            # Delete the file
-            filepath.unlink()
-            print(f"[HTTP] Deleted song: {filename}")
+            song_catalog.remove(filename)
+            log.info("Deleted song: %s", filename)
             
             # Send response
             response = {
@@ -383,64 +695,21 @@ class OptimizedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 'message': 'Song deleted successfully'
             }
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            self.send_json_response(response)
             
         except Exception as e:
-            print(f"[HTTP] Error deleting song: {e}")
+            log.error("Error deleting song: %s", e, exc_info=not isinstance(e, (ValueError, FileNotFoundError)))
             error_response = {
                 'success': False,
                 'message': str(e)
             }
             
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
-
-    
-    def log_message(self, format, *args):
-        # Custom logging - only log errors
-        if '200' not in format % args and '304' not in format % args:
-            print(f"[HTTP] {self.address_string()} - {format % args}")
+            self.send_json_response(error_response, 500)
 
 
 async def websocket_handler(websocket):
-    """Handle WebSocket connections"""
-    # Register the client
-    connected_clients.add(websocket)
-    print(f"[WebSocket] Client connected. Total clients: {len(connected_clients)}")
-    
-    try:
-        async for message in websocket:
-            # Parse the message
-            try:
-                data = json.loads(message)
-                print(f"[WebSocket] Received: {data.get('type', 'unknown')}")
-                
-                # Broadcast to all connected clients (mainly projector)
-                disconnected = set()
-                for client in connected_clients:
-                    if client != websocket:  # Don't send back to sender
-                        try:
-                            await client.send(message)
-                        except websockets.exceptions.ConnectionClosed:
-                            disconnected.add(client)
-                
-                # Remove disconnected clients
-                connected_clients.difference_update(disconnected)
-                
-            except json.JSONDecodeError:
-                print(f"[WebSocket] Invalid JSON received")
-                
-    except websockets.exceptions.ConnectionClosed:
-        pass
-    finally:
-        # Unregister the client
-        connected_clients.discard(websocket)
-        print(f"[WebSocket] Client disconnected. Total clients: {len(connected_clients)}")
+    """Handle WebSocket connections, routing each message by type and role"""
+    await display_hub.serve(websocket)
 
 
 def start_http_server():
@@ -448,7 +717,7 @@ def start_http_server():
     handler = OptimizedHTTPRequestHandler
     
     # Create server with address reuse enabled
-    class ReuseAddrTCPServer(socketserver.ThreadingTCPServer):
+    class ReuseAddrTCPServer(BoundedThreadPoolHTTPServer):
         allow_reuse_address = True
         
         def server_bind(self):
@@ -467,8 +736,7 @@ def start_http_server():
     
     for attempt in range(max_retries):
         try:
-            httpd = ReuseAddrTCPServer(("", HTTP_PORT), handler)
-            httpd.request_queue_size = 10  # Increase queue size
+            httpd = ReuseAddrTCPServer(("", HTTP_PORT), handler, max_connections=HTTP_MAX_CONNECTIONS)
             
             local_ip = get_local_ip()
             print(f"\n{'='*60}")
@@ -478,7 +746,7 @@ def start_http_server():
             print(f"Performance optimizations enabled:")
             print(f"  ✅ Gzip compression")
             print(f"  ✅ Aggressive caching")
-            print(f"  ✅ Threading support")
+            print(f"  ✅ Worker pool ({HTTP_MAX_CONNECTIONS} connections, keep-alive {HTTP_KEEPALIVE_TIMEOUT:g}s)")
             print(f"{'='*60}\n")
             
             httpd.serve_forever()
@@ -487,17 +755,45 @@ def start_http_server():
         except OSError as e:
             if e.errno == 98:  # Address already in use
                 if attempt < max_retries - 1:
-                    print(f"[HTTP] Port {HTTP_PORT} in use, waiting {retry_delay}s... (attempt {attempt + 1}/{max_retries})")
+                    log.warning("Port %d in use, waiting %ss... (attempt %d/%d)", HTTP_PORT, retry_delay, attempt + 1, max_retries)
                     import time
                     time.sleep(retry_delay)
                 else:
-                    print(f"[HTTP] ERROR: Port {HTTP_PORT} still in use after {max_retries} attempts")
-                    print(f"[HTTP] Another process may be using this port.")
+                    log.error("Port %d still in use after %d attempts. Another process may be using this port.",
+                              HTTP_PORT, max_retries)
                     raise
             else:
                 raise
 
 
+def start_song_watcher():
+    """
+    Apply songs edited outside the app to the catalog and tell the
+    operators. Call from the event loop that serves the WebSocket clients.
+    """
+    if song_store.kind != 'json':
+        return None  # Only the JSON store has files to watch
+    
+    loop = asyncio.get_running_loop()
+    
+    def library_changed(filenames):
+        message = {
+            'type': 'library_changed',
+            'epoch': song_catalog.epoch,
+            'revision': song_catalog.revision,
+            'changed': len(filenames)
+        }
+        asyncio.run_coroutine_threadsafe(display_hub.send_to_role('operator', message), loop)
+    
+    try:
+        watcher = SongWatcher(SONGS_DIR, song_catalog, on_change=library_changed, mode=SONG_WATCH)
+        watcher.start()
+    except (OSError, ValueError) as e:
+        logging.getLogger('Watcher').warning("Not watching %s: %s", SONGS_DIR, e)
+        return None
+    return watcher
+
+
 async def start_websocket_server():
     """Start the WebSocket server"""
     local_ip = get_local_ip()
@@ -507,6 +803,8 @@ async def start_websocket_server():
     print(f"  - ws://{local_ip}:{WEBSOCKET_PORT}")
     print(f"{'='*60}\n")
     
+    start_song_watcher()
+    
     # Configure WebSocket server with optimizations
     async with websockets.serve(
         websocket_handler, 
@@ -514,11 +812,29 @@ async def start_websocket_server():
         WEBSOCKET_PORT,
         max_size=10 * 1024 * 1024,  # 10MB max message size
         max_queue=32,  # Max queued messages
-        compression=None  # Disable compression for better latency
+        # Deflate only where bandwidth matters more than latency
+        create_protocol=selective_deflate_protocol(WEBSOCKET_COMPRESSION)
     ):
         await asyncio.Future()  # Run forever
 
 
+async def start_single_port_server():
+    """Serve HTTP and WebSocket from one port and one event loop"""
+    local_ip = get_local_ip()
+    print(f"\n{'='*60}")
+    print(f"HTTP and WebSocket Server running on:")
+    print(f"  - http://localhost:{HTTP_PORT}")
+    print(f"  - http://{local_ip}:{HTTP_PORT}")
+    print(f"  - ws://{local_ip}:{HTTP_PORT}{WEBSOCKET_PATH}")
+    print(f"{'='*60}\n")
+    
+    start_song_watcher()
+    
+    server = UnifiedServer(OptimizedHTTPRequestHandler, websocket_handler, max_workers=HTTP_MAX_CONNECTIONS,
+                           compression=WEBSOCKET_COMPRESSION)
+    await server.serve_forever("", HTTP_PORT)
+
+
 def main():
     """Main entry point"""
     local_ip = get_local_ip()
@@ -532,11 +848,27 @@ def main():
     print("="*60)
     print(f"\nStarting optimized servers...")
     print(f"HTTP Port: {HTTP_PORT}")
-    print(f"WebSocket Port: {WEBSOCKET_PORT}")
+    if SINGLE_PORT:
+        print(f"WebSocket: port {HTTP_PORT}, path {WEBSOCKET_PATH}")
+    else:
+        print(f"WebSocket Port: {WEBSOCKET_PORT}")
     print(f"\nAccess the application at:")
     print(f"  http://{local_ip}:{HTTP_PORT}/index.html")
     print(f"\nPress Ctrl+C to stop the servers\n")
     
+    # Load the song library into memory before accepting requests
+    song_catalog.load()
+    asset_cache.preload()
+    
+    # HTTP and WebSocket share one port and event loop
+    if SINGLE_PORT:
+        try:
+            asyncio.run(start_single_port_server())
+        except KeyboardInterrupt:
+            print("\n\nShutting down server...")
+            print("Goodbye!\n")
+        return
+    
     # Start HTTP server in a separate thread
     http_thread = threading.Thread(target=start_http_server, daemon=True)
     http_thread.start()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Logging for the Church Presentation Web App Server
+Records go through a bounded queue to a background writer thread, so a
+slow stdout (an Azure log stream, a Windows console) never holds up a
+request or a slide change. If the writer falls behind and the queue
+fills, records are dropped and counted instead of waited for.
+
+    LOG_LEVEL    DEBUG, INFO (default), WARNING or ERROR
+    LOG_FORMAT   text  "[HTTP] message" lines, as the servers always printed
+                 json  one object per line: time, level, logger, message,
+                       any extra={...} fields and the exception, if any
+
+High-volume records (one per WebSocket message or per static file) are
+sampled: a record logged with extra={'sample': N} is kept once every N
+times per message template. Use %-style arguments for those, so every
+occurrence shares its template.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+LOG_FORMATS = ('text', 'json')
+
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Message templates tracked for sampling before the counts start over
+MAX_SAMPLED_TEMPLATES = 1000
+
+LOG_RECORDS_DROPPED = metrics.counter(
+    'presenter_log_records_dropped_total', 'Log records dropped because the log writer fell behind')
+
+# LogRecord attributes that are not extra={...} fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class TextFormatter(logging.Formatter):
+    """[logger] message, with the traceback on the following lines"""
+
+    def __init__(self):
+        super().__init__('[%(name)s] %(message)s')
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        sample = getattr(record, 'sample', None)
+        return f"{text} (1 in {sample})" if sample else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Keep one in N of the records logged with extra={'sample': N}"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._counts = {}  # (logger, message template) -> records seen
+
+    def filter(self, record):
+        every = getattr(record, 'sample', None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            if len(self._counts) >= MAX_SAMPLED_TEMPLATES and key not in self._counts:
+                self._counts.clear()
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % every == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records rather than wait for a full queue"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments now, while they still hold these values, but
+        # leave formatting (tracebacks included) to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def _dropped_record(self):
+        return logging.LogRecord('Logging', logging.WARNING, __file__, 0,
+                                 f"Log writer fell behind, dropped {self.dropped} record(s)", None, None)
+
+
+def setup_logging(level='INFO', log_format='text'):
+    """
+    Send every logger's records (the websockets library's included) to
+    stdout through the background writer. Returns the QueueListener.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}', expected one of: {', '.join(LOG_FORMATS)}")
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SampleFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    # The websockets library logs every connection at INFO
+    if root.level > logging.DEBUG:
+        logging.getLogger('websockets').setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
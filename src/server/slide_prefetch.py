@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Next-slide prefetch for the Church Presentation Web App Server
+When the operator shows a song phrase, the phrases that follow it are
+usually shown next. Looking them up in the song catalog lets the server
+send them to the displays ahead of time, so a display can lay them out
+(auto font size included) before the operator clicks.
+
+Slides are built exactly as operator.js builds its song_phrase messages.
+Nothing is prefetched when the phrase the operator sent does not match the
+catalog's copy of the song (a song edited since the operator loaded it).
+"""
+
+# Slides after the current one sent to displays
+DEFAULT_PREFETCH_SLIDES = 2
+
+
+def phrase_text(phrase):
+    """Handle both string phrases (old format) and array phrases"""
+    return '\n'.join(phrase) if isinstance(phrase, list) else phrase
+
+
+def first_line(phrase):
+    if isinstance(phrase, list):
+        return phrase[0] if phrase else None
+    return phrase.split('\n')[0]
+
+
+def next_slides(catalog, data, count=DEFAULT_PREFETCH_SLIDES):
+    """The song_phrase messages for up to `count` phrases after the one in data"""
+    if count <= 0:
+        return []
+    song_file = data.get('songFile')
+    index = data.get('phraseIndex')
+    if not isinstance(song_file, str) or not isinstance(index, int) or index < 0:
+        return []
+
+    song = catalog.get(song_file)
+    phrases = song.get('phrases') if isinstance(song, dict) else None
+    if not isinstance(phrases, list) or index >= len(phrases):
+        return []
+    if phrase_text(phrases[index]) != data.get('text'):
+        return []
+
+    slides = []
+    for next_index in range(index + 1, min(index + 1 + count, len(phrases))):
+        following = phrases[next_index + 1] if next_index + 1 < len(phrases) else None
+        slides.append({
+            'type': 'song_phrase',
+            'text': phrase_text(phrases[next_index]),
+            'fontSize': data.get('fontSize'),
+            'songTitle': song.get('title'),
+            'nextVersePreview': first_line(following) if following is not None else None,
+            'songFile': song_file,
+            'phraseIndex': next_index
+        })
+    return slides
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Slide latency tracing for the Church Presentation Web App Server
+The operator page tags every message it sends with a trace:
+
+    {"type": "song_phrase", ..., "trace": {"id": "k3f9-12", "sentAt": 1760000000123.4}}
+
+The hub notes when the server received it and when it was written to each
+display, and each display answers once the slide is on screen:
+
+    {"type": "slide_ack", "trace": "k3f9-12", "receivedAt": ..., "paintedAt": ...}
+
+The server's own stamps are kept here rather than added to the message, so
+the message is still forwarded as received and encoded once for everyone.
+
+Times are milliseconds on the server's clock. Every page estimates how far
+its clock is from the server's with clock_sync round trips (NTP style: the
+sample with the shortest round trip wins) and converts its stamps, so each
+slide's latency splits into:
+
+    operator   operator click to the server receiving it
+    server     waiting in the server until written to the display
+    network    written by the server to received by the display
+    display    received to painted (fade out, layout, fade in)
+    total      operator click to painted
+
+Percentiles are kept per display (role, channel and address, so they
+survive reconnects) over its most recent slides.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+
+STAGES = ('operator', 'server', 'network', 'display', 'total')
+
+# Traces waiting for their acknowledgements; older ones are forgotten
+MAX_PENDING_TRACES = 256
+
+# Slides kept per display for percentiles, and displays tracked
+SAMPLES_PER_DISPLAY = 500
+MAX_DISPLAYS = 64
+
+MAX_TRACE_ID_LENGTH = 64
+
+SLIDE_LATENCY_SECONDS = metrics.histogram(
+    'presenter_slide_latency_seconds', 'Slide latency from operator click to display paint, by stage',
+    ('stage',))
+
+
+def server_time():
+    """Milliseconds since the epoch on the server's clock"""
+    return time.time() * 1000
+
+
+def clock_sync_reply(data):
+    """Answer a clock_sync request with the server's time"""
+    return {'type': 'clock_sync', 't0': data.get('t0'), 'serverTime': server_time()}
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _display_key(client):
+    address = getattr(client.websocket, 'remote_address', None)
+    host = address[0] if isinstance(address, tuple) and address else 'unknown'
+    return (client.role or 'none', client.channel, host)
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1)
+    return round(sorted_values[max(index, 0)], 1)
+
+
+class SlideTracer:
+    """Joins operator traces, server stamps and display acknowledgements"""
+
+    def __init__(self, samples_per_display=SAMPLES_PER_DISPLAY):
+        self.samples_per_display = samples_per_display
+        self._lock = threading.Lock()  # Reports are read from HTTP threads
+        self._pending = OrderedDict()  # trace id -> {'sentAt', 'receivedAt', 'forwarded': {client id: time}}
+        self._displays = OrderedDict()  # display key -> {stage: deque of ms}
+        self._clocks = OrderedDict()  # (role, channel, address) -> latest clock estimate
+
+    def received(self, trace, sender):
+        """Stamp a traced message as received; returns its trace id, or None"""
+        trace_id = trace.get('id') if isinstance(trace, dict) else None
+        if not isinstance(trace_id, str) or not trace_id or len(trace_id) > MAX_TRACE_ID_LENGTH:
+            return None
+        sent_at = trace.get('sentAt')
+        with self._lock:
+            self._pending[trace_id] = {
+                'sentAt': sent_at if _number(sent_at) else None,
+                'receivedAt': server_time(),
+                'forwarded': {}
+            }
+            self._pending.move_to_end(trace_id)
+            while len(self._pending) > MAX_PENDING_TRACES:
+                self._pending.popitem(last=False)
+        return trace_id
+
+    def forwarded(self, trace_id, client):
+        """Stamp a traced message as written to one client"""
+        now = server_time()
+        with self._lock:
+            pending = self._pending.get(trace_id)
+            if pending is not None:
+                pending['forwarded'][client.id] = now
+
+    def painted(self, client, data):
+        """
+        Record a display's slide_ack; returns the stage latencies in ms, or
+        None for slides this display was not sent (a replay when it joined)
+        """
+        trace_id = data.get('trace')
+        received_at = data.get('receivedAt')
+        painted_at = data.get('paintedAt')
+        if not isinstance(trace_id, str) or not _number(received_at) or not _number(painted_at):
+            return None
+        with self._lock:
+            pending = self._pending.get(trace_id)
+            forwarded_at = pending['forwarded'].pop(client.id, None) if pending else None
+            if forwarded_at is None:
+                return None
+            stages = {
+                'server': forwarded_at - pending['receivedAt'],
+                'network': received_at - forwarded_at,
+                'display': painted_at - received_at
+            }
+            if pending['sentAt'] is not None:
+                stages['operator'] = pending['receivedAt'] - pending['sentAt']
+                stages['total'] = painted_at - pending['sentAt']
+            self._record(_display_key(client), stages)
+        for stage, ms in stages.items():
+            SLIDE_LATENCY_SECONDS.observe(max(ms, 0) / 1000, stage=stage)
+        return stages
+
+    def _record(self, key, stages):
+        samples = self._displays.get(key)
+        if samples is None:
+            samples = self._displays[key] = {stage: deque(maxlen=self.samples_per_display) for stage in STAGES}
+            while len(self._displays) > MAX_DISPLAYS:
+                self._displays.popitem(last=False)
+        self._displays.move_to_end(key)
+        for stage, ms in stages.items():
+            samples[stage].append(ms)
+
+    def clock(self, client, data):
+        """Record the clock offset (server minus client, ms) a page reports"""
+        offset = data.get('offset')
+        rtt = data.get('rtt')
+        if not _number(offset) or not _number(rtt):
+            return
+        key = _display_key(client)
+        with self._lock:
+            self._clocks[key] = {'offset': round(offset, 1), 'rtt': round(rtt, 1), 'updated': server_time()}
+            self._clocks.move_to_end(key)
+            while len(self._clocks) > MAX_DISPLAYS:
+                self._clocks.popitem(last=False)
+
+    def report(self):
+        """Per-display latency percentiles and clock estimates, for /api/diagnostics/latency"""
+        with self._lock:
+            displays = [(key, {stage: sorted(values) for stage, values in samples.items()})
+                        for key, samples in self._displays.items()]
+            clocks = list(self._clocks.items())
+            pending = len(self._pending)
+
+        now = server_time()
+        return {
+            'serverTime': now,
+            'pendingTraces': pending,
+            'displays': [
+                {
+                    'role': role,
+                    'channel': channel,
+                    'address': address,
+                    'slides': len(samples['display']),
+                    'stages': {
+                        stage: {
+                            'p50': _percentile(values, 0.5),
+                            'p90': _percentile(values, 0.9),
+                            'p99': _percentile(values, 0.99),
+                            'max': round(values[-1], 1)
+                        }
+                        for stage, values in samples.items() if values
+                    }
+                }
+                for (role, channel, address), samples in displays
+            ],
+            'clocks': [
+                {'role': role, 'channel': channel, 'address': address, 'offsetMs': clock['offset'],
+                 'rttMs': clock['rtt'], 'ageSeconds': round((now - clock['updated']) / 1000, 1)}
+                for (role, channel, address), clock in clocks
+            ]
+        }
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+In-memory song catalog for the Church Presentation Web App Server
+Loads the songs directory once and serves the whole library as a single
+pre-serialized, pre-compressed JSON response. Every change bumps a revision
+number and is recorded in a bounded change log so clients can sync
+incrementally.
+
+With a song pack, songs that have not been edited since the pack was
+written are read from it on demand rather than kept decoded in memory.
+Edits rewrite the pack and the search cache on a background thread a
+little later, so a burst of edits costs one write and never holds up a
+request.
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+from pathlib import Path
+
+import os
+
+import metrics
+from song_pack import EMPTY_DIRECTORY_DIGEST, SongPack, SongPackError, directory_digest, write_pack
+from song_search import SongSearchIndex
+from song_store import JsonDirectoryStore
+
+log = logging.getLogger('Catalog')
+
+# Number of changes remembered for incremental sync
+CHANGE_LOG_SIZE = 500
+
+# Seconds after an edit before the song pack and search cache are rewritten
+WRITE_DELAY_SECONDS = 2.0
+
+# Stands in for a song that is read from the pack when needed
+_IN_PACK = object()
+
+SNAPSHOT_LOOKUPS = metrics.counter(
+    'presenter_catalog_snapshot_lookups_total',
+    'Full library responses: hit (reused) or rebuild (serialized and compressed again)', ('result',))
+
+
+class SongCatalog:
+    """In-memory copy of the song library, kept in sync by the write handlers"""
+
+    def __init__(self, songs_dir, change_log_size=CHANGE_LOG_SIZE, pack_path=None, store=None,
+                 write_delay=WRITE_DELAY_SECONDS):
+        self.songs_dir = Path(songs_dir)
+        self.store = store or JsonDirectoryStore(self.songs_dir)
+        self.pack_path = Path(pack_path) if pack_path else None  # Optional packed copy of the JSON directory
+        self.write_delay = write_delay
+        self._lock = threading.RLock()
+        self._songs = {}  # filename -> song dict, or _IN_PACK
+        self._pack = None  # Open SongPack backing the _IN_PACK songs
+        self._pack_stale = False  # Edited since the pack was written
+        self._write_timer = None
+        self._flush_lock = threading.Lock()  # One background write at a time
+        self._snapshot = None  # Cached (body, gzip_body, etag)
+        self._snapshot_lock = threading.Lock()
+        self._search_index = SongSearchIndex()
+        self._search_cache = self.store.search_form_cache()
+
+        # Revisions restart on every server start, so clients must also
+        # match the epoch before trusting a revision number
+        self.epoch = uuid.uuid4().hex[:12]
+        self.revision = 0
+        self._changes = deque(maxlen=change_log_size)  # (revision, filename)
+
+        # Write out the last edits on shutdown
+        atexit.register(self.flush)
+
+    def load(self):
+        """
+        Populate the catalog from the song pack when it is up to date,
+        otherwise read the whole store once (and rebuild the pack)
+        """
+        pack = self._open_pack() if self.pack_path else None
+        from_pack = pack is not None
+        if from_pack:
+            songs = dict.fromkeys(pack.filenames(), _IN_PACK)
+            # Songs unpacked from it get new mtimes, so record those
+            pack_stale = directory_digest(self.songs_dir) != pack.source_digest
+        else:
+            songs = self.store.load_all()
+            pack_stale = bool(self.pack_path)
+
+        with self._lock:
+            if self._pack is not None:
+                self._pack.close()
+            self._pack = pack
+            self._songs = songs
+            self._snapshot = None
+            self._search_cache.load()
+            # Decodes each packed song once, without keeping it
+            self._search_index.rebuild(pack if from_pack else songs, self._search_cache.get)
+            self._search_cache.retain(songs)
+            self._search_cache.save()
+            self.revision += 1
+            self._changes.clear()
+            self._pack_stale = pack_stale
+        if self._pack_stale:
+            self.flush()
+
+        source = self.pack_path if from_pack else getattr(self.store, 'db_path', self.songs_dir)
+        log.info("Loaded %d songs from %s", len(songs), source)
+        return len(songs)
+
+    def _open_pack(self):
+        """Return the open song pack, or None if it is missing or stale"""
+        try:
+            pack = SongPack(self.pack_path)
+        except SongPackError as e:
+            if self.pack_path.exists():
+                log.warning("%s", e)
+            return None
+        current = directory_digest(self.songs_dir)
+        if current == EMPTY_DIRECTORY_DIGEST and len(pack):
+            self._unpack(pack)
+        elif current != pack.source_digest:
+            log.info("Song pack %s is out of date, rescanning", self.pack_path)
+            pack.close()
+            return None
+        return pack
+
+    def _unpack(self, pack):
+        """
+        Write the songs of a pack that came without song files (e.g. a
+        bundled build) out to the store, so they can be edited, served and
+        exported like any other song
+        """
+        try:
+            self.store.write_many(pack.items())
+        except OSError as e:
+            log.warning("Could not unpack %s into %s: %s", self.pack_path, self.songs_dir, e)
+            return
+        log.info("Unpacked %d songs from %s into %s", len(pack), self.pack_path, self.songs_dir)
+
+    def _song(self, filename):
+        song = self._songs.get(filename)
+        return self._pack.get(filename) if song is _IN_PACK else song
+
+    def _schedule_write(self):
+        """Persist an edit a little later, on a background thread"""
+        if self.pack_path:
+            self._pack_stale = True
+        if self._write_timer is None:
+            self._write_timer = threading.Timer(self.write_delay, self.flush)
+            self._write_timer.daemon = True
+            self._write_timer.start()
+
+    def flush(self):
+        """
+        Write the search cache and rewrite the song pack now, if songs
+        changed since they were last written
+        """
+        with self._flush_lock:
+            # Taken before the songs are copied, so a file written meanwhile
+            # makes the new pack look stale rather than current
+            digest = directory_digest(self.songs_dir) if self.pack_path else None
+            with self._lock:
+                if self._write_timer is not None:
+                    self._write_timer.cancel()
+                    self._write_timer = None
+                search_forms = self._search_cache.pending()
+                pack_stale = self._pack_stale
+                self._pack_stale = False
+                written = dict(self._songs) if pack_stale else None
+                pack = self._pack
+
+            self._search_cache.write(search_forms)
+            if not pack_stale:
+                return
+
+            # Only this thread replaces the pack, so it can be read unlocked
+            songs = {filename: pack.get(filename) if song is _IN_PACK else song
+                     for filename, song in written.items()}
+            staged = self.pack_path.with_name(self.pack_path.name + '.new')
+            try:
+                write_pack(staged, songs, digest)
+            except OSError as e:
+                log.warning("Could not write song pack %s: %s", self.pack_path, e)
+                with self._lock:
+                    self._pack_stale = True
+                return
+
+            with self._lock:
+                self._swap_pack(staged, songs, written)
+
+    def _swap_pack(self, staged, songs, written):
+        """Put a freshly written pack in place and read unedited songs from it"""
+        # A mapped file can't be replaced on Windows
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+        try:
+            os.replace(staged, self.pack_path)
+            self._pack = SongPack(self.pack_path)
+        except (OSError, SongPackError) as e:
+            log.warning("Could not replace song pack %s: %s", self.pack_path, e)
+            # Keep every song in memory until the next rewrite
+            for filename, song in self._songs.items():
+                if song is _IN_PACK:
+                    self._songs[filename] = songs[filename]
+            self._pack_stale = True
+            return
+
+        for filename, song in written.items():
+            # Songs edited while the pack was being written stay in memory
+            if self._songs.get(filename) is song:
+                self._songs[filename] = _IN_PACK
+
+    def filenames(self):
+        """Return the sorted list of song filenames"""
+        with self._lock:
+            return sorted(self._songs)
+
+    def get(self, filename):
+        """Return the song stored under filename, or None"""
+        with self._lock:
+            return self._song(filename)
+
+    def contains(self, filename):
+        """Check whether a song with this filename is in the catalog"""
+        with self._lock:
+            return filename in self._songs
+
+    def put(self, filename, song):
+        """Add or replace a song after it has been written to the store"""
+        return self.put_many([(filename, song)]) > 0
+
+    def put_many(self, items):
+        """
+        Add or replace several (filename, song) pairs, persisting their
+        search forms once. Returns the number of songs that changed.
+        """
+        changed = 0
+        with self._lock:
+            for filename, song in items:
+                if self._song(filename) == song:
+                    continue
+                self._songs[filename] = song
+                self._search_index.add(filename, song, self._search_cache.get(filename, song))
+                self._record_change(filename)
+                changed += 1
+            if changed:
+                self._schedule_write()
+        return changed
+
+    def remove(self, filename):
+        """Drop a song after it has been deleted from the store"""
+        with self._lock:
+            if self._songs.pop(filename, None) is None:
+                return False
+            self._search_index.remove(filename)
+            self._search_cache.discard(filename)
+            self._record_change(filename)
+            self._schedule_write()
+            return True
+
+    def _record_change(self, filename):
+        self.revision += 1
+        self._changes.append((self.revision, filename))
+        self._snapshot = None
+
+    def changes_since(self, revision):
+        """
+        Return (current_revision, changes) for the songs added, updated or
+        deleted after the given revision. Each change is {'filename', 'song'}
+        where song is None for a deletion. Returns None when the revision is unknown or has fallen out of the
+        change log, in which case the client needs a full snapshot.
+        """
+        with self._lock:
+            if revision > self.revision:
+                return None
+            if revision == self.revision:
+                return self.revision, []
+            if not self._changes or self._changes[0][0] > revision + 1:
+                return None
+
+            # Only the latest state of each song matters
+            changed = dict.fromkeys(
+                filename for change_revision, filename in self._changes
+                if change_revision > revision
+            )
+
+            return self.revision, [
+                {'filename': filename, 'song': self._song(filename)}
+                for filename in changed
+            ]
+
+    def search(self, query, limit=20):
+        """Return ranked search hits for a Singlish, Sinhala or Tamil query"""
+        # A store with its own full-text index answers substring queries;
+        # short and fuzzy queries fall through to the in-memory index
+        hits = self.store.search(query, limit)
+        if hits:
+            return hits
+        with self._lock:
+            return self._search_index.search(query, limit)
+
+    def snapshot(self):
+        """
+        Return (body, gzip_body, etag) for the whole library.
+        The response is only rebuilt after the catalog has changed.
+        """
+        # One rebuild at a time, so a burst of requests after an edit waits
+        # for it rather than each building its own
+        with self._snapshot_lock:
+            with self._lock:
+                if self._snapshot is not None:
+                    SNAPSHOT_LOOKUPS.inc(result='hit')
+                    return self._snapshot
+                # Packed songs are copied as bytes and decoded unlocked
+                revision = self.revision
+                entries = [(filename, self._pack.blob(filename) if song is _IN_PACK else song)
+                           for filename, song in sorted(self._songs.items())]
+
+            # Serializing and compressing the library takes a while; reads
+            # and edits go on meanwhile
+            snapshot = self._build_snapshot(revision, entries)
+            SNAPSHOT_LOOKUPS.inc(result='rebuild')
+            with self._lock:
+                if self.revision == revision:
+                    self._snapshot = snapshot
+            return snapshot
+
+    def _build_snapshot(self, revision, entries):
+        songs = []
+        for filename, song in entries:
+            if isinstance(song, bytes):
+                song = json.loads(song)
+            songs.append({
+                'filename': filename,
+                'title': song.get('title', ''),
+                'phrases': song.get('phrases', [])
+            })
+
+        payload = {
+            'epoch': self.epoch,
+            'revision': revision,
+            'full': True,
+            'songs': songs
+        }
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        gzip_body = gzip.compress(body, compresslevel=9)
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return body, gzip_body, etag
+
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header value against a strong ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Streaming library export for the Church Presentation Web App Server
+Writes the song library one song at a time, so memory use stays constant
+however large the library is:
+
+    json    a pretty-printed array of {title, phrases}, the format the
+            operator's import accepts
+    ndjson  one {filename, modified, title, phrases} object per line
+    zip     one pretty-printed JSON file per song, as in the songs directory
+
+An export can be limited to songs modified after a point in time, for
+incremental backups. Deleted songs are not reported.
+"""
+
+import json
+import time
+import zipfile
+from datetime import datetime
+
+EXPORT_FORMATS = {
+    'json': ('application/json; charset=utf-8', 'json'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'zip': ('application/zip', 'zip'),
+}
+
+# Bytes collected before a chunk is sent to the client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def parse_since(value):
+    """
+    Parse ?since= as Unix seconds or an ISO 8601 date/time (local time when
+    no offset is given). Returns None when absent; raises ValueError.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+class ChunkWriter:
+    """File-like object that sends its writes in EXPORT_CHUNK_SIZE pieces"""
+
+    def __init__(self, send_chunk):
+        self._send_chunk = send_chunk
+        self._buffer = bytearray()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= EXPORT_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._send_chunk(bytes(self._buffer))
+            self._buffer.clear()
+
+    def tell(self):
+        return self.bytes_written
+
+
+def iter_library(store, catalog, since=None):
+    """Yield (filename, modified time, song) in filename order"""
+    times = store.modified_times()
+    for filename in sorted(times):
+        modified = times[filename]
+        if since is not None and modified <= since:
+            continue
+        song = catalog.get(filename)
+        if song is None:
+            song = store.read(filename)
+        if song is not None:
+            yield filename, modified, song
+
+
+def write_export(out, export_format, songs):
+    """Write (filename, modified, song) items to out; returns the song count"""
+    count = 0
+
+    if export_format == 'ndjson':
+        for filename, modified, song in songs:
+            line = {'filename': filename, 'modified': modified,
+                    'title': song.get('title', ''), 'phrases': song.get('phrases', [])}
+            out.write(json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n')
+            count += 1
+
+    elif export_format == 'zip':
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for filename, modified, song in songs:
+                info = zipfile.ZipInfo(f'songs/{filename}', time.localtime(max(modified, 315532800))[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, json.dumps(song, indent=2, ensure_ascii=False))
+                count += 1
+
+    else:
+        out.write(b'[')
+        for filename, modified, song in songs:
+            entry = {'title': song.get('title', ''), 'phrases': song.get('phrases', [])}
+            text = json.dumps(entry, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+            out.write((',\n  ' if count else '\n  ').encode('utf-8') + text.encode('utf-8'))
+            count += 1
+        out.write(b'\n]\n' if count else b']\n')
+
+    return count
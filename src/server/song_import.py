@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Bulk song ingest for the Church Presentation Web App Server
+Validates a whole batch up front, checks every title against the in-memory
+catalog and against the rest of the batch, then hands all new songs to the
+store in a single write and updates the catalog once.
+
+Large uploads are parsed incrementally and saved in batches, so memory
+use is bounded by the batch size rather than by the size of the upload:
+    import_stream()  a JSON export (iter_songs)
+    import_text()    pasted plain-text lyrics (parse_bulk_songs)
+"""
+
+import codecs
+import json
+
+# Bytes read from the request body at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+# Songs written per batch while streaming an import
+STREAM_BATCH_SIZE = 200
+
+# Largest single song accepted by the streaming parser
+MAX_SONG_BYTES = 4 * 1024 * 1024
+
+# Skipped and invalid results kept for the final report
+MAX_REPORTED_PROBLEMS = 500
+
+# Per-song outcomes
+SAVED = 'saved'
+SKIPPED = 'skipped'
+INVALID = 'invalid'
+
+
+def validate_song(song):
+    """Return why a song can't be saved, or None if it is valid"""
+    if not isinstance(song, dict):
+        return "Song must be an object"
+
+    title = song.get('title')
+    if not isinstance(title, str) or not title.strip():
+        return "Song has no title"
+
+    phrases = song.get('phrases')
+    if not isinstance(phrases, list) or not phrases:
+        return "Song has no phrases"
+    for phrase in phrases:
+        # Handle both string phrases (old format) and array phrases
+        if isinstance(phrase, str):
+            continue
+        if not isinstance(phrase, list) or not all(isinstance(line, str) for line in phrase):
+            return "Phrases must be lists of lines"
+    return None
+
+
+def save_many(songs, store, catalog, filename_for, first_index=0, dry_run=False):
+    """
+    Save every new, valid song in one batch.
+    filename_for(title) names the song's file, as generate_filename() does.
+    With dry_run nothing is written; the results say what would happen.
+    Returns one result per input song, in order, numbered from first_index:
+        {'index', 'title', 'filename', 'status', 'message'}
+    with status SAVED, SKIPPED (already exists) or INVALID.
+    """
+    results = []
+    pending = {}  # filename -> song, in input order
+
+    for index, song in enumerate(songs, first_index):
+        title = song.get('title') if isinstance(song, dict) else None
+        result = {'index': index, 'title': title, 'filename': None, 'status': INVALID, 'message': None}
+        results.append(result)
+
+        error = validate_song(song)
+        if error is None:
+            filename = filename_for(title)
+            if filename == '.json':
+                error = "Title has no letters or digits to name the file"
+        if error is not None:
+            result['message'] = error
+            continue
+
+        result['filename'] = filename
+        if filename in pending or catalog.contains(filename):
+            result['status'] = SKIPPED
+            result['message'] = "Song already exists"
+            continue
+
+        pending[filename] = song
+        result['status'] = SAVED
+
+    if pending and not dry_run:
+        store.write_many(pending.items())
+        catalog.put_many(pending.items())
+    return results
+
+
+def summarize(results):
+    """Count results by status"""
+    counts = {SAVED: 0, SKIPPED: 0, INVALID: 0}
+    for result in results:
+        counts[result['status']] += 1
+    return counts
+
+
+class ImportFormatError(ValueError):
+    """Raised when an upload is not a song array or {"songs": [...]}"""
+
+
+class _BodyReader:
+    """Incrementally decoded text from a binary stream of known length"""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = length
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = length == 0
+
+    def fill(self):
+        """Read the next chunk; False at the end of the body"""
+        if self.eof:
+            return False
+        data = self._stream.read(min(READ_CHUNK_SIZE, self._remaining))
+        self._remaining -= len(data)
+        self.bytes_read += len(data)
+        if not data or self._remaining <= 0:
+            self.eof = True
+        # Drop what has been consumed so the buffer only holds unparsed text
+        self.buffer = self.buffer[self.pos:] + self._decoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def drain(self):
+        """
+        Read and discard the rest of the body, so the next request on a
+        keep-alive connection starts where it should
+        """
+        while self.fill():
+            self.buffer = ''
+
+    def peek(self):
+        """Next non-whitespace character, or '' at the end of the body"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ImportFormatError(f"Expected '{char}' at byte {self.bytes_read}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise ImportFormatError(f"Invalid JSON: {e}") from e
+            if len(self.buffer) - self.pos > MAX_SONG_BYTES:
+                raise ImportFormatError(f"Song larger than {MAX_SONG_BYTES} bytes")
+            self.fill()
+
+    def lines(self):
+        """Yield each line of the body without its line ending"""
+        while True:
+            newline = self.buffer.find('\n', self.pos)
+            if newline >= 0:
+                line = self.buffer[self.pos:newline]
+                self.pos = newline + 1
+                yield line.rstrip('\r')
+            elif len(self.buffer) - self.pos > MAX_SONG_BYTES:
+                raise ImportFormatError(f"Line longer than {MAX_SONG_BYTES} bytes")
+            elif not self.fill():
+                if self.pos < len(self.buffer):
+                    yield self.buffer[self.pos:]
+                    self.pos = len(self.buffer)
+                return
+
+
+def iter_songs(stream, length):
+    """
+    Yield the songs of a JSON upload one at a time without reading the whole
+    body: either a bare array of songs (the operator's export format) or an
+    object with a "songs" array (the /api/save-songs format)
+    """
+    return _iter_songs(_BodyReader(stream, length))
+
+
+def _iter_songs(reader):
+    if reader.peek() == '{':
+        reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                return  # No songs key
+            key = reader.value()
+            reader.expect(':')
+            if key == 'songs':
+                break
+            reader.value()  # Skip other members
+            if reader.peek() == ',':
+                reader.expect(',')
+    reader.expect('[')
+
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() == ']':
+            return
+        reader.expect(',')
+
+
+def parse_bulk_songs(lines):
+    """
+    Yield songs from pasted lyrics, one song at a time.
+    The first line of a song is its title; a blank line ends a verse and
+    two blank lines in a row end the song. Songs without verses are dropped.
+    """
+    song = None
+    verse = []
+    blank_lines = 0
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            blank_lines += 1
+            if verse and song:
+                song['phrases'].append(verse)
+                verse = []
+
+            # Two or more blank lines in a row = new song
+            if blank_lines >= 2 and song:
+                if song['phrases']:
+                    yield song
+                song = None
+            continue
+
+        blank_lines = 0
+        if not song:
+            song = {'title': line, 'phrases': []}
+        else:
+            verse.append(line)
+
+    # Don't forget the last verse and song
+    if verse and song:
+        song['phrases'].append(verse)
+    if song and song['phrases']:
+        yield song
+
+
+def import_stream(stream, length, store, catalog, filename_for, progress=None,
+                  batch_size=STREAM_BATCH_SIZE):
+    """
+    Parse and save a JSON upload batch by batch.
+    progress(report) is called after every batch with the running counts.
+    Returns the final report: counts plus the first MAX_REPORTED_PROBLEMS
+    skipped or invalid results.
+    """
+    reader = _BodyReader(stream, length)
+    return _save_batches(_iter_songs(reader), reader, length, store, catalog, filename_for,
+                         progress, batch_size)
+
+
+def import_text(stream, length, store, catalog, filename_for, progress=None,
+                batch_size=STREAM_BATCH_SIZE):
+    """Parse and save a plain-text lyrics upload batch by batch, as import_stream() does"""
+    reader = _BodyReader(stream, length)
+    return _save_batches(parse_bulk_songs(reader.lines()), reader, length, store, catalog, filename_for,
+                         progress, batch_size)
+
+
+def preview_text(stream, length, catalog, filename_for, limit=MAX_REPORTED_PROBLEMS):
+    """
+    Parse a plain-text lyrics upload without saving it.
+    Returns the counts import_text() would report and a summary of the
+    first `limit` songs: title, verse and line counts, and outcome.
+    """
+    reader = _BodyReader(stream, length)
+    songs = list(parse_bulk_songs(reader.lines()))
+    results = save_many(songs, None, catalog, filename_for, dry_run=True)
+
+    preview = []
+    for song, result in zip(songs[:limit], results):
+        preview.append({
+            **result,
+            'verses': len(song['phrases']),
+            'lines': sum(len(verse) for verse in song['phrases']),
+            'firstLine': song['phrases'][0][0]
+        })
+    return {'processed': len(songs), **summarize(results), 'songs': preview}
+
+
+def _save_batches(songs, reader, length, store, catalog, filename_for, progress, batch_size):
+    counts = {SAVED: 0, SKIPPED: 0, INVALID: 0}
+    problems = []
+    processed = 0
+    batch = []
+
+    def report():
+        return {'processed': processed, **counts, 'bytesRead': reader.bytes_read, 'totalBytes': length}
+
+    def flush():
+        nonlocal processed
+        results = save_many(batch, store, catalog, filename_for, first_index=processed)
+        for result in results:
+            counts[result['status']] += 1
+            if result['status'] != SAVED and len(problems) < MAX_REPORTED_PROBLEMS:
+                problems.append(result)
+        processed += len(batch)
+        batch.clear()
+        if progress:
+            progress(report())
+
+    for song in songs:
+        batch.append(song)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    # Anything after the songs array ('}' of {"songs": [...]}, a newline)
+    reader.drain()
+
+    return {**report(), 'problems': problems}
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Packed song library for the Church Presentation Web App Server
+A single file holding every song as a compact UTF-8 JSON blob behind a
+hash index, read through mmap. Opening the pack costs one file open, and
+looking up a song by filename is O(1) without parsing any other song.
+
+The per-file JSON songs directory stays the editable source of truth; the
+pack records a digest of the directory it was built from so stale packs
+are detected and rebuilt.
+
+Layout (little-endian):
+    header   magic, version, song count, slot count, section offsets,
+             sha256 digest of the source directory listing
+    slots    open-addressing hash table: (fnv1a-64 of filename, entry + 1)
+    entries  one (data offset, name length, blob length) per song,
+             sorted by filename
+    data     filename bytes followed by the song's JSON blob
+
+Usage:
+    python src/server/song_pack.py pack [songs_dir] [pack_file]
+    python src/server/song_pack.py unpack <pack_file> [songs_dir]
+    python src/server/song_pack.py list <pack_file>
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+
+log = logging.getLogger('Pack')
+
+PACK_MAGIC = b'SPAK'
+PACK_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHIIQQQ32s')  # magic, version, flags, count, slots, offsets..., digest
+_SLOT = struct.Struct('<QI4x')  # filename hash, entry index + 1 (0 = empty)
+_ENTRY = struct.Struct('<QII')  # data offset, filename length, blob length
+
+_FNV_OFFSET = 0xcbf29ce484222325
+_FNV_PRIME = 0x100000001b3
+_MASK64 = 0xffffffffffffffff
+
+
+class SongPackError(Exception):
+    """Raised for a missing, truncated or foreign pack file"""
+
+
+def filename_hash(name_bytes):
+    """FNV-1a 64-bit hash of a UTF-8 filename"""
+    value = _FNV_OFFSET
+    for byte in name_bytes:
+        value = ((value ^ byte) * _FNV_PRIME) & _MASK64
+    return value
+
+
+def directory_digest(songs_dir):
+    """
+    Digest of the name, size and mtime of every *.json file in songs_dir.
+    Costs one stat per file but never opens one.
+    """
+    listing = []
+    try:
+        with os.scandir(songs_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    stat = entry.stat()
+                    listing.append(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}")
+    except OSError:
+        pass
+    listing.sort()
+    return hashlib.sha256('\n'.join(listing).encode('utf-8')).digest()
+
+
+# Digest of a missing or empty songs directory
+EMPTY_DIRECTORY_DIGEST = hashlib.sha256(b'').digest()
+
+
+def write_pack(pack_path, songs, source_digest=b'\0' * 32):
+    """Write a {filename: song} mapping to pack_path atomically"""
+    names = sorted(songs)
+    slot_count = 1
+    while slot_count < max(len(names) * 2, 8):
+        slot_count *= 2
+
+    slots_offset = _HEADER.size
+    entries_offset = slots_offset + slot_count * _SLOT.size
+    data_offset = entries_offset + len(names) * _ENTRY.size
+
+    slots = [(0, 0)] * slot_count
+    entries = []
+    data = bytearray()
+    for index, name in enumerate(names):
+        name_bytes = name.encode('utf-8')
+        blob = json.dumps(songs[name], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        entries.append(_ENTRY.pack(data_offset + len(data), len(name_bytes), len(blob)))
+        data += name_bytes
+        data += blob
+
+        hashed = filename_hash(name_bytes)
+        slot = hashed & (slot_count - 1)
+        while slots[slot][1]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = (hashed, index + 1)
+
+    header = _HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, len(names), slot_count,
+                          slots_offset, entries_offset, data_offset, source_digest)
+
+    pack_path = Path(pack_path)
+    temp_path = pack_path.with_name(pack_path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(b''.join(_SLOT.pack(*slot) for slot in slots))
+        f.write(b''.join(entries))
+        f.write(data)
+    os.replace(temp_path, pack_path)
+    return len(names)
+
+
+class SongPack:
+    """Read-only, memory-mapped view of a pack file"""
+
+    def __init__(self, pack_path):
+        self.path = Path(pack_path)
+        try:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise SongPackError(f"Cannot open song pack {self.path}: {e}") from e
+
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise SongPackError(f"Truncated song pack {self.path}")
+
+        (magic, version, _flags, self.count, self._slot_count, self._slots_offset,
+         self._entries_offset, self._data_offset, self.source_digest) = _HEADER.unpack_from(self._map)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise SongPackError(f"Not a version {PACK_VERSION} song pack: {self.path}")
+        if self._data_offset > len(self._map):
+            self.close()
+            raise SongPackError(f"Truncated song pack {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, filename):
+        return self._find(filename) is not None
+
+    def filenames(self):
+        """Return the sorted list of packed filenames"""
+        return [self._entry(index)[0] for index in range(self.count)]
+
+    def get(self, filename):
+        """Return the song stored under filename, or None"""
+        index = self._find(filename)
+        if index is None:
+            return None
+        return json.loads(self._blob(index))
+
+    def blob(self, filename):
+        """Return the JSON bytes stored under filename, or None"""
+        index = self._find(filename)
+        return None if index is None else self._blob(index)
+
+    def items(self):
+        """Yield (filename, song) for every packed song in filename order"""
+        for index in range(self.count):
+            name, start, end = self._entry(index)
+            yield name, json.loads(self._map[start:end])
+
+    def _find(self, filename):
+        name_bytes = filename.encode('utf-8')
+        hashed = filename_hash(name_bytes)
+        mask = self._slot_count - 1
+        slot = hashed & mask
+        for _ in range(self._slot_count):
+            slot_hash, entry = _SLOT.unpack_from(self._map, self._slots_offset + slot * _SLOT.size)
+            if not entry:
+                return None
+            if slot_hash == hashed:
+                offset, name_length, _ = _ENTRY.unpack_from(
+                    self._map, self._entries_offset + (entry - 1) * _ENTRY.size)
+                if self._map[offset:offset + name_length] == name_bytes:
+                    return entry - 1
+            slot = (slot + 1) & mask
+        return None
+
+    def _entry(self, index):
+        """Return (filename, blob start, blob end) of an entry"""
+        offset, name_length, blob_length = _ENTRY.unpack_from(
+            self._map, self._entries_offset + index * _ENTRY.size)
+        name = self._map[offset:offset + name_length].decode('utf-8')
+        start = offset + name_length
+        return name, start, start + blob_length
+
+    def _blob(self, index):
+        _, start, end = self._entry(index)
+        return self._map[start:end]
+
+
+def pack_directory(songs_dir, pack_path):
+    """Build a pack from every song file in songs_dir"""
+    songs_dir = Path(songs_dir)
+    digest = directory_digest(songs_dir)
+    songs = {}
+    for song_file in sorted(songs_dir.glob('*.json')):
+        try:
+            with open(song_file, 'r', encoding='utf-8') as f:
+                songs[song_file.name] = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Skipping unreadable song %s: %s", song_file.name, e)
+    count = write_pack(pack_path, songs, digest)
+    log.info("Packed %d songs into %s", count, pack_path)
+    return count
+
+
+def unpack_to_directory(pack_path, songs_dir):
+    """Write every packed song back out as an editable JSON file"""
+    songs_dir = Path(songs_dir)
+    songs_dir.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with SongPack(pack_path) as pack:
+        for filename, song in pack.items():
+            filepath = songs_dir / filename
+            temp_path = filepath.with_name(filepath.name + '.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(song, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, filepath)
+            count += 1
+    log.info("Unpacked %d songs into %s", count, songs_dir)
+    return count
+
+
+def main(argv):
+    from server_logging import setup_logging
+    setup_logging()
+    default_songs_dir = Path(__file__).parent.parent / 'songs'
+    default_pack = Path(__file__).parent.parent / 'songs.pack'
+
+    command = argv[1] if len(argv) > 1 else ''
+    if command == 'pack':
+        songs_dir = argv[2] if len(argv) > 2 else default_songs_dir
+        pack_path = argv[3] if len(argv) > 3 else default_pack
+        pack_directory(songs_dir, pack_path)
+    elif command == 'unpack' and len(argv) > 2:
+        unpack_to_directory(argv[2], argv[3] if len(argv) > 3 else default_songs_dir)
+    elif command == 'list' and len(argv) > 2:
+        with SongPack(argv[2]) as pack:
+            for filename in pack.filenames():
+                print(filename)
+    else:
+        print(__doc__.split('Usage:', 1)[1].rstrip())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Server-side Singlish search for the Church Presentation Web App Server
+Builds a trigram inverted index over the phonetic Singlish form of every
+song title and lyric line so a query only touches matching lines. The
+Singlish forms come precomputed from search_cache, so only the query itself
+is transliterated at search time.
+"""
+
+import re
+from collections import Counter, defaultdict
+
+from search_cache import derive_search_forms
+from transliteration import search_key, normalize, normalize_phonetic
+
+# Share of query trigrams a line needs for a fuzzy (non-substring) hit
+FUZZY_THRESHOLD = 0.6
+
+# Longest run of words considered when highlighting a match
+MAX_HIGHLIGHT_WORDS = 12
+
+_WORD = re.compile(r'\S+')
+
+
+def trigrams(key):
+    """Return the set of 3-character substrings of a search key"""
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class SearchEntry:
+    """A single indexed title or lyric line"""
+
+    __slots__ = ('filename', 'phrase_index', 'line_index', 'text', 'singlish', 'key')
+
+    def __init__(self, filename, phrase_index, line_index, text, singlish, key):
+        self.filename = filename
+        self.phrase_index = phrase_index  # None for the title
+        self.line_index = line_index
+        self.text = text
+        self.singlish = singlish
+        self.key = key
+
+    @property
+    def is_title(self):
+        return self.phrase_index is None
+
+
+class SongSearchIndex:
+    """Trigram inverted index over song titles and lyric lines"""
+
+    def __init__(self):
+        self._entries = {}  # entry id -> SearchEntry
+        self._song_entries = {}  # filename -> [entry ids]
+        self._titles = {}  # filename -> title
+        self._postings = defaultdict(set)  # trigram -> entry ids
+        self._next_id = 0
+
+    def rebuild(self, songs, forms_for=None):
+        """
+        Index every song in a {filename: song} mapping from scratch.
+        forms_for(filename, song) supplies precomputed search forms.
+        """
+        self._entries.clear()
+        self._song_entries.clear()
+        self._titles.clear()
+        self._postings.clear()
+        for filename, song in songs.items():
+            forms = forms_for(filename, song) if forms_for else None
+            self.add(filename, song, forms)
+
+    def add(self, filename, song, forms=None):
+        """Index a song, replacing any previous version"""
+        self.remove(filename)
+        if forms is None:
+            forms = derive_search_forms(song)
+
+        title = song.get('title', '')
+        self._titles[filename] = title
+        entry_ids = [self._add_entry(filename, None, None, title, forms['title'])]
+
+        for phrase_index, phrase in enumerate(song.get('phrases', [])):
+            # Handle both string phrases (old format) and array phrases
+            lines = phrase if isinstance(phrase, list) else str(phrase).split('\n')
+            phrase_forms = forms['phrases'][phrase_index]
+            for line_index, line in enumerate(lines):
+                entry_ids.append(self._add_entry(
+                    filename, phrase_index, line_index, line, phrase_forms[line_index]
+                ))
+
+        self._song_entries[filename] = entry_ids
+
+    def remove(self, filename):
+        """Drop every indexed line of a song"""
+        for entry_id in self._song_entries.pop(filename, []):
+            entry = self._entries.pop(entry_id)
+            for gram in trigrams(entry.key):
+                postings = self._postings.get(gram)
+                if postings is not None:
+                    postings.discard(entry_id)
+                    if not postings:
+                        del self._postings[gram]
+        self._titles.pop(filename, None)
+
+    def _add_entry(self, filename, phrase_index, line_index, text, forms):
+        entry_id = self._next_id
+        self._next_id += 1
+
+        singlish, key = forms
+        self._entries[entry_id] = SearchEntry(filename, phrase_index, line_index, text, singlish, key)
+        for gram in trigrams(key):
+            self._postings[gram].add(entry_id)
+        return entry_id
+
+    def search(self, query, limit=20):
+        """
+        Return up to limit ranked hits for a Singlish, Sinhala, Tamil or
+        English query. Each hit names the song and its best matching line.
+        """
+        key = search_key(query)
+        if not key:
+            return []
+
+        scored = self._score_entries(key)
+        matches = [(self._entries[entry_id], score) for entry_id, score in scored]
+        return rank_matches(matches, self._titles, key, limit)
+
+    def _score_entries(self, key):
+        """Return (entry id, score) for every line matching the search key"""
+        # Too short for trigrams - scan the keys directly
+        if len(key) < 3:
+            return [
+                (entry_id, exact_score(entry, key))
+                for entry_id, entry in self._entries.items()
+                if key in entry.key
+            ]
+
+        grams = trigrams(key)
+        postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+
+        # Substring matches must contain every trigram of the query
+        if postings[0]:
+            candidates = set.intersection(*postings)
+            exact = [
+                (entry_id, exact_score(self._entries[entry_id], key))
+                for entry_id in candidates
+                if key in self._entries[entry_id].key
+            ]
+            if exact:
+                return exact
+
+        # Fall back to lines sharing most of the query's trigrams
+        overlap = Counter()
+        for posting in postings:
+            overlap.update(posting)
+
+        needed = len(grams) * FUZZY_THRESHOLD
+        fuzzy = []
+        for entry_id, count in overlap.items():
+            if count >= needed:
+                ratio = count / len(grams)
+                weight = 45 if self._entries[entry_id].is_title else 30
+                fuzzy.append((entry_id, weight * ratio))
+        return fuzzy
+
+
+def exact_score(entry, key):
+    """Score of a line whose search key contains the query key"""
+    if entry.is_title:
+        return 120 if entry.key.startswith(key) else 100
+    return 50
+
+
+def rank_matches(matches, titles, key, limit):
+    """
+    Turn (SearchEntry, score) matches into at most limit ranked hits, one
+    per song, using titles ({filename: title}) for display and ties
+    """
+    # Keep the best line per song, with a small bonus for extra matches
+    best = {}
+    match_counts = Counter()
+    for entry, score in matches:
+        match_counts[entry.filename] += 1
+        current = best.get(entry.filename)
+        if current is None or score > current[1]:
+            best[entry.filename] = (entry, score)
+
+    ranked = []
+    for filename, (entry, score) in best.items():
+        score += min(match_counts[filename] - 1, 10)
+        ranked.append((-score, titles[filename], entry))
+    ranked.sort(key=lambda item: item[:2])
+
+    results = []
+    for negative_score, title, entry in ranked[:limit]:
+        results.append({
+            'filename': entry.filename,
+            'title': title,
+            'score': round(-negative_score, 2),
+            'match': 'title' if entry.is_title else 'lyrics',
+            'phraseIndex': entry.phrase_index,
+            'lineIndex': entry.line_index,
+            'line': entry.text,
+            'highlight': highlight_span(entry.text, entry.singlish, key)
+        })
+    return results
+
+
+def highlight_span(text, singlish, key):
+    """
+    Return [start, end] character offsets of the shortest run of words in
+    text whose search key contains the query key, or None.
+    Transliteration keeps whitespace, so the words of text and of its
+    Singlish form line up one to one.
+    """
+    spans = [(match.start(), match.end()) for match in _WORD.finditer(text)]
+    singlish_words = singlish.split()
+    if len(spans) != len(singlish_words):
+        return None
+
+    words = [(start, end, normalize_phonetic(normalize(word)))
+             for (start, end), word in zip(spans, singlish_words)]
+
+    for size in range(1, min(len(words), MAX_HIGHLIGHT_WORDS) + 1):
+        for first in range(len(words) - size + 1):
+            window = words[first:first + size]
+            joined = ' '.join(word_key for _, _, word_key in window if word_key)
+            if key in joined:
+                return [window[0][0], window[-1][1]]
+    return None
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Song storage backends for the Church Presentation Web App Server
+The write handlers and the catalog go through a store instead of touching
+the songs directory directly:
+
+    json    one pretty-printed JSON file per song in the songs directory
+            (the default, and the format the operator's export uses)
+    sqlite  a single SQLite database with a full-text index, see sqlite_store
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+
+from search_cache import SearchFormCache
+
+log = logging.getLogger('Store')
+
+STORE_KINDS = ('json', 'sqlite')
+
+
+class JsonDirectoryStore:
+    """One JSON file per song, named by generate_filename()"""
+
+    kind = 'json'
+
+    def __init__(self, songs_dir):
+        self.songs_dir = Path(songs_dir)
+
+    def load_all(self):
+        """Return {filename: song} for every readable song file"""
+        songs = {}
+        if self.songs_dir.exists():
+            for song_file in sorted(self.songs_dir.glob('*.json')):
+                try:
+                    with open(song_file, 'r', encoding='utf-8') as f:
+                        songs[song_file.name] = json.load(f)
+                except (OSError, ValueError) as e:
+                    log.warning("Skipping unreadable song %s: %s", song_file.name, e)
+        return songs
+
+    def exists(self, filename):
+        return (self.songs_dir / filename).exists()
+
+    def modified_times(self):
+        """Return {filename: last modified time} for every song"""
+        times = {}
+        try:
+            with os.scandir(self.songs_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') and entry.is_file():
+                        times[entry.name] = entry.stat().st_mtime
+        except OSError:
+            pass
+        return times
+
+    def read(self, filename):
+        """Return the stored song, or None"""
+        try:
+            with open(self.songs_dir / filename, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path_for(self, filename):
+        """File backing a song, so it can be sent with sendfile()"""
+        return self.songs_dir / filename
+
+    def write(self, filename, song):
+        self.write_many([(filename, song)])
+
+    def write_many(self, items):
+        """
+        Write several (filename, song) pairs without ever leaving a
+        half-written song file: every song goes to a temp file synced to
+        disk, then each temp file is renamed into place and the directory
+        is synced once for the whole batch
+        """
+        items = list(items)
+        if not items:
+            return
+        self.songs_dir.mkdir(exist_ok=True)
+
+        staged = []  # (temp path, final path)
+        try:
+            for filename, song in items:
+                temp_path = self.songs_dir / f".{filename}.tmp"
+                staged.append((temp_path, self.songs_dir / filename))
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(song, f, indent=2, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            for temp_path, path in staged:
+                os.replace(temp_path, path)
+            _fsync_directory(self.songs_dir)
+        except BaseException:
+            for temp_path, _ in staged:
+                try:
+                    temp_path.unlink()
+                except OSError:
+                    pass
+            raise
+
+    def delete(self, filename):
+        """Remove a song; False if it did not exist"""
+        try:
+            (self.songs_dir / filename).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def search(self, query, limit=20):
+        """No full-text index of its own; the catalog's index answers"""
+        return None
+
+    def search_form_cache(self):
+        """Where the derived Singlish search forms are persisted"""
+        return SearchFormCache(self.songs_dir)
+
+    def close(self):
+        pass
+
+
+def _fsync_directory(path):
+    """Persist renames in a directory (not supported on Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def open_song_store(kind, songs_dir, db_path=None):
+    """Create the store selected by SONG_STORE"""
+    kind = (kind or 'json').lower()
+    if kind == 'json':
+        return JsonDirectoryStore(songs_dir)
+    if kind == 'sqlite':
+        from sqlite_store import SqliteSongStore
+        return SqliteSongStore(db_path or Path(songs_dir).parent / 'songs.db')
+    raise ValueError(f"Unknown song store '{kind}', expected one of: {', '.join(STORE_KINDS)}")
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Songs directory watcher for the Church Presentation Web App Server
+Picks up songs added, edited or deleted outside the app (git pull, rsync,
+an editor on a mounted volume) and applies them to the song catalog one
+file at a time, without reloading the library.
+
+Uses inotify on Linux and falls back to polling the directory listing
+elsewhere, or when inotify is unavailable (some network and Docker
+Desktop volumes never deliver events; use SONG_WATCH=poll there).
+Events are debounced so a burst of writes is applied as one change.
+
+A song is only dropped from the catalog when a file the watcher has seen
+goes away, never because a song (from the song pack, say) has no file or
+the directory can't be read.
+"""
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+
+log = logging.getLogger('Watcher')
+
+WATCH_MODES = ('auto', 'inotify', 'poll', 'off')
+
+# Quiet time after the last event before changes are applied
+DEBOUNCE_SECONDS = 0.5
+
+# Longest a change waits while events keep arriving
+MAX_DELAY_SECONDS = 5.0
+
+# Seconds between directory scans in polling mode
+POLL_INTERVAL_SECONDS = 2.0
+
+# inotify(7) flags
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_WATCH_MASK = (_IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+_RESCAN = object()  # Pending marker: compare the whole directory with the catalog
+
+
+def is_song_file(name):
+    """Song files are *.json; editor backups and our own .tmp files are not"""
+    return name.endswith('.json') and not name.startswith('.')
+
+
+class _Inotify:
+    """Minimal inotify binding over libc with ctypes"""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {path}")
+
+    def wait(self, timeout):
+        """Return True when events are ready to read"""
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def read(self):
+        """Return changed filenames, with _RESCAN after an overflow, and
+        whether the watched directory itself went away"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set(), False
+
+        names = set()
+        gone = False
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                names.add(_RESCAN)
+            elif mask & (_IN_DELETE_SELF | _IN_MOVE_SELF | _IN_IGNORED):
+                gone = True
+            elif name:
+                names.add(name)
+        return names, gone
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SongWatcher:
+    """
+    Keeps a SongCatalog in step with its songs directory.
+    on_change(filenames) is called from the watcher thread after each
+    debounced batch that changed the catalog.
+    """
+
+    def __init__(self, songs_dir, catalog, on_change=None, mode='auto',
+                 debounce=DEBOUNCE_SECONDS, poll_interval=POLL_INTERVAL_SECONDS):
+        if mode not in WATCH_MODES:
+            raise ValueError(f"Unknown watch mode '{mode}', expected one of: {', '.join(WATCH_MODES)}")
+        self.songs_dir = Path(songs_dir)
+        self.catalog = catalog
+        self.on_change = on_change
+        self.mode = mode
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._files = set()  # Song files seen in the directory
+
+    def start(self):
+        """Start watching in a daemon thread; returns the mode in use"""
+        if self.mode == 'off':
+            return 'off'
+        self._files = set(self._listing() or ())
+
+        inotify = None
+        if self.mode in ('auto', 'inotify'):
+            try:
+                inotify = _Inotify(self.songs_dir)
+            except (OSError, AttributeError) as e:
+                if self.mode == 'inotify':
+                    raise
+                log.info("inotify unavailable (%s), polling every %gs", e, self.poll_interval)
+
+        target = (lambda: self._watch_inotify(inotify)) if inotify else self._watch_polling
+        self._thread = threading.Thread(target=target, name='song-watcher', daemon=True)
+        self._thread.start()
+        mode = 'inotify' if inotify else 'poll'
+        log.info("Watching %s for song changes (%s)", self.songs_dir, mode)
+        return mode
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _watch_inotify(self, inotify):
+        pending = set()
+        first_event = last_event = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if pending:
+                    due = min(last_event + self.debounce, first_event + MAX_DELAY_SECONDS)
+                    if now >= due:
+                        self._apply(pending)
+                        pending = set()
+                        continue
+                    timeout = min(due - now, 1.0)
+                else:
+                    timeout = 1.0
+
+                if not inotify.wait(timeout):
+                    continue
+                names, gone = inotify.read()
+                if gone:
+                    log.warning("%s was removed or replaced, switching to polling", self.songs_dir)
+                    break
+                names = {name for name in names if name is _RESCAN or is_song_file(name)}
+                if names:
+                    if not pending:
+                        first_event = time.monotonic()
+                    last_event = time.monotonic()
+                    pending |= names
+        finally:
+            inotify.close()
+
+        if not self._stop.is_set():
+            self._apply({_RESCAN})
+            self._watch_polling()
+
+    def _watch_polling(self):
+        listing = self._listing() or {}
+        while not self._stop.wait(self.poll_interval):
+            current = self._listing()
+            if current is None:
+                continue  # Directory missing or unreadable: nothing to compare
+            changed = {name for name in listing.keys() | current.keys()
+                       if listing.get(name) != current.get(name)}
+            if changed:
+                failed = self._apply(changed)
+                # Retry files that were still being written on the next scan
+                for name in failed:
+                    current.pop(name, None)
+            listing = current
+
+    def _listing(self):
+        """{filename: (size, mtime)} for every song file, or None if the directory can't be read"""
+        listing = {}
+        try:
+            with os.scandir(self.songs_dir) as entries:
+                for entry in entries:
+                    if is_song_file(entry.name):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        listing[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+        return listing
+
+    def _apply(self, names):
+        """Re-read the named files into the catalog; returns unreadable names"""
+        if _RESCAN in names:
+            listing = self._listing()
+            if listing is None:
+                log.warning("Cannot read %s, leaving the catalog as it is", self.songs_dir)
+                return []
+            # Files that went away since they were seen; songs that never
+            # had a file are not deletions
+            names = set(listing) | self._files
+
+        updated = []
+        removed = []
+        failed = []
+        for name in sorted(names):
+            try:
+                with open(self.songs_dir / name, 'r', encoding='utf-8') as f:
+                    song = json.load(f)
+            except FileNotFoundError:
+                if name in self._files and self.catalog.remove(name):
+                    removed.append(name)
+                self._files.discard(name)
+                continue
+            except (OSError, ValueError) as e:
+                log.warning("Skipping unreadable song %s: %s", name, e)
+                failed.append(name)
+                continue
+            self._files.add(name)
+            if not isinstance(song, dict):
+                log.warning("Skipping %s: not a song object", name)
+                failed.append(name)
+                continue
+            if self.catalog.get(name) != song:
+                updated.append((name, song))
+
+        if updated:
+            self.catalog.put_many(updated)
+        changed = [name for name, _ in updated] + removed
+        if changed:
+            log.info("Applied %d updated and %d deleted song(s)", len(updated), len(removed))
+            if self.on_change:
+                try:
+                    self.on_change(changed)
+                except Exception as e:
+                    log.error("Change notification failed: %s", e, exc_info=True)
+        return failed
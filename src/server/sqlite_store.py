@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+SQLite song store for the Church Presentation Web App Server
+Keeps the library in one database file with transactional writes, indexes
+on filename and title, and an FTS5 trigram index over every title and
+lyric line (original text, Singlish and the phonetic search key).
+
+Enable with SONG_STORE=sqlite (database path in SONG_DB, default
+src/songs.db). Move songs between the JSON directory and the database with:
+    python src/server/sqlite_store.py import [songs_dir] [db_file]
+    python src/server/sqlite_store.py export [db_file] [songs_dir]
+"""
+
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from search_cache import derive_search_forms, song_fingerprint
+from song_search import SearchEntry, exact_score, rank_matches
+from song_store import JsonDirectoryStore
+from transliteration import search_key
+
+log = logging.getLogger('Store')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    search_forms TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS songs_title ON songs(title);
+CREATE INDEX IF NOT EXISTS songs_updated_at ON songs(updated_at);
+
+CREATE TABLE IF NOT EXISTS song_lines (
+    id INTEGER PRIMARY KEY,
+    song_id INTEGER NOT NULL REFERENCES songs(id),
+    phrase_index INTEGER,
+    line_index INTEGER,
+    text TEXT NOT NULL,
+    singlish TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS song_lines_song ON song_lines(song_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS song_lines_fts USING fts5(
+    text, singlish, key,
+    content='song_lines', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS song_lines_ai AFTER INSERT ON song_lines BEGIN
+    INSERT INTO song_lines_fts(rowid, text, singlish, key)
+    VALUES (new.id, new.text, new.singlish, new.key);
+END;
+CREATE TRIGGER IF NOT EXISTS song_lines_ad AFTER DELETE ON song_lines BEGIN
+    INSERT INTO song_lines_fts(song_lines_fts, rowid, text, singlish, key)
+    VALUES ('delete', old.id, old.text, old.singlish, old.key);
+END;
+"""
+
+_SEARCH_SQL = """
+SELECT s.filename, s.title, l.phrase_index, l.line_index, l.text, l.singlish, l.key
+FROM song_lines_fts
+JOIN song_lines l ON l.id = song_lines_fts.rowid
+JOIN songs s ON s.id = l.song_id
+WHERE song_lines_fts MATCH ?
+"""
+
+
+class SqliteSongStore:
+    """Songs, their search forms and a full-text index in one SQLite file"""
+
+    kind = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._lock = threading.RLock()
+        self._forms = {}  # filename -> (fingerprint, search forms)
+
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def load_all(self):
+        """Return {filename: song} for every stored song"""
+        with self._lock:
+            rows = self._db.execute('SELECT filename, body FROM songs ORDER BY filename').fetchall()
+        return {filename: json.loads(body) for filename, body in rows}
+
+    def exists(self, filename):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM songs WHERE filename = ?', (filename,)).fetchone() is not None
+
+    def modified_times(self):
+        """Return {filename: last modified time} for every song"""
+        with self._lock:
+            return dict(self._db.execute('SELECT filename, updated_at FROM songs').fetchall())
+
+    def read(self, filename):
+        """Return the stored song, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT body FROM songs WHERE filename = ?', (filename,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def path_for(self, filename):
+        """Songs live inside the database, not in files"""
+        return None
+
+    def write(self, filename, song):
+        self.write_many([(filename, song)])
+
+    def write_many(self, items):
+        """Add or replace several (filename, song) pairs in one transaction"""
+        with self._transaction() as db:
+            for filename, song in items:
+                self._upsert(db, filename, song)
+
+    def _upsert(self, db, filename, song):
+        fingerprint = song_fingerprint(song)
+        cached = self._forms.get(filename)
+        forms = cached[1] if cached and cached[0] == fingerprint else derive_search_forms(song)
+
+        body = json.dumps(song, ensure_ascii=False, separators=(',', ':'))
+        forms_json = json.dumps(forms, ensure_ascii=False, separators=(',', ':'))
+        title = song.get('title', '')
+        now = time.time()
+
+        row = db.execute('SELECT id FROM songs WHERE filename = ?', (filename,)).fetchone()
+        if row:
+            song_id = row[0]
+            db.execute(
+                'UPDATE songs SET title = ?, body = ?, fingerprint = ?, search_forms = ?, updated_at = ? '
+                'WHERE id = ?', (title, body, fingerprint, forms_json, now, song_id))
+            db.execute('DELETE FROM song_lines WHERE song_id = ?', (song_id,))
+        else:
+            song_id = db.execute(
+                'INSERT INTO songs (filename, title, body, fingerprint, search_forms, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (filename, title, body, fingerprint, forms_json, now)).lastrowid
+
+        lines = [(song_id, None, None, title, *forms['title'])]
+        for phrase_index, phrase in enumerate(song.get('phrases', [])):
+            # Handle both string phrases (old format) and array phrases
+            phrase_lines = phrase if isinstance(phrase, list) else str(phrase).split('\n')
+            for line_index, line in enumerate(phrase_lines):
+                lines.append((song_id, phrase_index, line_index, line,
+                              *forms['phrases'][phrase_index][line_index]))
+        db.executemany(
+            'INSERT INTO song_lines (song_id, phrase_index, line_index, text, singlish, key) '
+            'VALUES (?, ?, ?, ?, ?, ?)', lines)
+
+        self._forms[filename] = (fingerprint, forms)
+
+    def delete(self, filename):
+        """Remove a song; False if it did not exist"""
+        with self._transaction() as db:
+            row = db.execute('SELECT id FROM songs WHERE filename = ?', (filename,)).fetchone()
+            if row is None:
+                return False
+            db.execute('DELETE FROM song_lines WHERE song_id = ?', (row[0],))
+            db.execute('DELETE FROM songs WHERE id = ?', (row[0],))
+        self._forms.pop(filename, None)
+        return True
+
+    def search(self, query, limit=20):
+        """
+        Ranked substring matches from the FTS5 index, in the same form as
+        SongSearchIndex.search(). Returns None for queries too short for
+        trigrams, leaving them (and fuzzy matching) to the catalog's index.
+        """
+        key = search_key(query)
+        if len(key) < 3:
+            return None
+
+        match = 'key : "' + key.replace('"', '""') + '"'
+        with self._lock:
+            rows = self._db.execute(_SEARCH_SQL, (match,)).fetchall()
+
+        titles = {}
+        matches = []
+        for filename, title, phrase_index, line_index, text, singlish, line_key in rows:
+            if key not in line_key:
+                continue
+            entry = SearchEntry(filename, phrase_index, line_index, text, singlish, line_key)
+            matches.append((entry, exact_score(entry, key)))
+            titles[filename] = title
+        return rank_matches(matches, titles, key, limit)
+
+    def search_form_cache(self):
+        """Search forms are stored with each song, so no sidecar file is needed"""
+        return _StoredSearchForms(self)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _StoredSearchForms:
+    """SearchFormCache interface over the forms kept in the songs table"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def load(self):
+        with self._store._lock:
+            rows = self._store._db.execute('SELECT filename, fingerprint, search_forms FROM songs').fetchall()
+        self._store._forms = {
+            filename: (fingerprint, json.loads(forms))
+            for filename, fingerprint, forms in rows
+        }
+        return len(rows)
+
+    def get(self, filename, song):
+        fingerprint = song_fingerprint(song)
+        cached = self._store._forms.get(filename)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+        forms = derive_search_forms(song)
+        self._store._forms[filename] = (fingerprint, forms)
+        return forms
+
+    def discard(self, filename):
+        self._store._forms.pop(filename, None)
+
+    def retain(self, filenames):
+        for filename in set(self._store._forms) - set(filenames):
+            self.discard(filename)
+
+    def save(self):
+        # Written together with each song
+        return False
+
+    def pending(self):
+        return None
+
+    def write(self, entries):
+        return False
+
+
+def import_directory(songs_dir, db_path):
+    """Copy every song file from songs_dir into the database"""
+    songs = JsonDirectoryStore(songs_dir).load_all()
+    store = SqliteSongStore(db_path)
+    try:
+        store.write_many(songs.items())
+    finally:
+        store.close()
+    log.info("Imported %d songs into %s", len(songs), db_path)
+    return len(songs)
+
+
+def export_directory(db_path, songs_dir):
+    """Write every song in the database out as an editable JSON file"""
+    store = SqliteSongStore(db_path)
+    try:
+        songs = store.load_all()
+    finally:
+        store.close()
+    JsonDirectoryStore(songs_dir).write_many(songs.items())
+    log.info("Exported %d songs to %s", len(songs), songs_dir)
+    return len(songs)
+
+
+def main(argv):
+    from server_logging import setup_logging
+    setup_logging()
+    default_songs_dir = Path(__file__).parent.parent / 'songs'
+    default_db = Path(__file__).parent.parent / 'songs.db'
+
+    command = argv[1] if len(argv) > 1 else ''
+    if command == 'import':
+        import_directory(argv[2] if len(argv) > 2 else default_songs_dir,
+                         argv[3] if len(argv) > 3 else default_db)
+    elif command == 'export':
+        export_directory(argv[2] if len(argv) > 2 else default_db,
+                         argv[3] if len(argv) > 3 else default_songs_dir)
+    else:
+        print(__doc__.split('with:', 1)[1].rstrip())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
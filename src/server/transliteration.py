@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Transliteration utility for Sinhala and Tamil to Singlish (Romanized)
+Python port of static/js/transliteration.js used by the server-side search
+"""
+
+import re
+
+# Sinhala to Singlish mapping
+SINHALA_MAP = {
+    # Vowels
+    'අ': 'a', 'ආ': 'aa', 'ඇ': 'ae', 'ඈ': 'aae', 'ඉ': 'i', 'ඊ': 'ii',
+    'උ': 'u', 'ඌ': 'uu', 'ඍ': 'ru', 'ඎ': 'ruu', 'ඏ': 'lu', 'ඐ': 'luu',
+    'එ': 'e', 'ඒ': 'ee', 'ඓ': 'ai', 'ඔ': 'o', 'ඕ': 'oo', 'ඖ': 'au',
+
+    # Consonants
+    'ක': 'ka', 'ඛ': 'kha', 'ග': 'ga', 'ඝ': 'gha', 'ඞ': 'nga',
+    'ච': 'cha', 'ඡ': 'chha', 'ජ': 'ja', 'ඣ': 'jha', 'ඤ': 'gna',
+    'ට': 'ta', 'ඨ': 'tta', 'ඩ': 'da', 'ඪ': 'dda', 'ණ': 'na',
+    'ත': 'tha', 'ථ': 'thha', 'ද': 'dha', 'ධ': 'dhha', 'න': 'na', 'ඳ': 'nda',
+    'ප': 'pa', 'ඵ': 'pha', 'බ': 'ba', 'භ': 'bha', 'ම': 'ma',
+    'ය': 'ya', 'ර': 'ra', 'ල': 'la', 'ව': 'va', 'ශ': 'sha',
+    'ෂ': 'sha', 'ස': 'sa', 'හ': 'ha', 'ළ': 'lla', 'ෆ': 'fa',
+
+    # Vowel signs (combining marks)
+    'ා': 'aa', 'ැ': 'ae', 'ෑ': 'aae', 'ි': 'i', 'ී': 'ii',
+    'ු': 'u', 'ූ': 'uu', 'ෘ': 'ru', 'ෲ': 'ruu', 'ෟ': 'lu', 'ෳ': 'luu',
+    'ෙ': 'e', 'ේ': 'ee', 'ෛ': 'ai', 'ො': 'o', 'ෝ': 'oo', 'ෞ': 'au',
+
+    # Special signs
+    'ං': 'ng', 'ඃ': 'h', '්': ''
+}
+
+# Tamil to Singlish mapping
+TAMIL_MAP = {
+    # Vowels
+    'அ': 'a', 'ஆ': 'aa', 'இ': 'i', 'ஈ': 'ii', 'உ': 'u', 'ஊ': 'uu',
+    'எ': 'e', 'ஏ': 'ee', 'ஐ': 'ai', 'ஒ': 'o', 'ஓ': 'oo', 'ஔ': 'au',
+
+    # Consonants
+    'க': 'ka', 'ங': 'nga', 'ச': 'cha', 'ஞ': 'gna', 'ட': 'ta',
+    'ண': 'na', 'த': 'tha', 'ன': 'na', 'ப': 'pa', 'ம': 'ma',
+    'ய': 'ya', 'ர': 'ra', 'ல': 'la', 'வ': 'va', 'ழ': 'zha',
+    'ள': 'lla', 'ற': 'ra', 'ஜ': 'ja', 'ஷ': 'sha',
+    'ஸ': 'sa', 'ஹ': 'ha', 'க்ஷ': 'ksha', 'ஶ': 'sha', 'ஶ்ரீ': 'shri',
+
+    # Vowel signs (combining marks)
+    'ா': 'aa', 'ி': 'i', 'ீ': 'ii', 'ு': 'u', 'ூ': 'uu',
+    'ெ': 'e', 'ே': 'ee', 'ை': 'ai', 'ொ': 'o', 'ோ': 'oo', 'ௌ': 'au',
+
+    # Special signs
+    'ஂ': 'h', 'ஃ': 'h', '்': ''
+}
+
+VIRAMA = '්'
+ZERO_WIDTH_JOINER = '\u200d'
+
+# Phonetic rewrites applied in order, mirroring fuzzyMatches() in the browser
+PHONETIC_RULES = [
+    # Aspirated consonants can match unaspirated
+    (re.compile(r'dh'), 'd'),
+    (re.compile(r'th'), 't'),
+    (re.compile(r'bh'), 'b'),
+    (re.compile(r'gh'), 'g'),
+    (re.compile(r'kh'), 'k'),
+    (re.compile(r'ph'), 'p'),
+    (re.compile(r'chh'), 'ch'),
+    # Vowel variations - order matters!
+    (re.compile(r'aae'), 'e'),
+    (re.compile(r'mae'), 'me'),
+    (re.compile(r'ae'), 'e'),
+    (re.compile(r'ai'), 'i'),
+    # Double vowels can match single
+    (re.compile(r'aa+'), 'a'),
+    (re.compile(r'ee+'), 'e'),
+    (re.compile(r'ii+'), 'i'),
+    (re.compile(r'oo+'), 'o'),
+    (re.compile(r'uu+'), 'u'),
+    # Common consonant equivalents
+    (re.compile(r'w'), 'v'),
+    (re.compile(r'y'), 'j'),
+    (re.compile(r'nda'), 'nd'),
+    (re.compile(r'll'), 'l'),
+    (re.compile(r'sh'), 's'),
+    # Allow for optional trailing 'a' (common in Sinhala)
+    (re.compile(r'na\Z'), 'n'),
+    # Remove duplicate letters
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+_SPECIAL_CHARS = re.compile(r'[^A-Za-z0-9_\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _is_sinhala_vowel_sign(char):
+    return bool(SINHALA_MAP.get(char)) and 'ා' <= char <= 'ෞ'
+
+
+def to_singlish(text):
+    """Transliterate a text from Sinhala/Tamil to Singlish"""
+    if not text:
+        return ''
+
+    result = []
+    i = 0
+    length = len(text)
+
+    while i < length:
+        char = text[i]
+        next_char = text[i + 1] if i + 1 < length else ''
+        next_next_char = text[i + 2] if i + 2 < length else ''
+
+        # Sinhala consonant
+        if 'ක' <= char <= 'හ':
+            consonant = SINHALA_MAP.get(char, char)
+
+            # Virama removes the inherent 'a'
+            if next_char == VIRAMA:
+                if consonant.endswith('a'):
+                    consonant = consonant[:-1]
+
+                # Consonant + virama + vowel sign
+                if _is_sinhala_vowel_sign(next_next_char):
+                    result.append(consonant + SINHALA_MAP[next_next_char])
+                    i += 3
+                    continue
+                elif next_next_char == ZERO_WIDTH_JOINER:
+                    char_after_zwj = text[i + 3] if i + 3 < length else ''
+                    if SINHALA_MAP.get(char_after_zwj):
+                        result.append(consonant + SINHALA_MAP[char_after_zwj])
+                        i += 4
+                        continue
+
+                # Just consonant + virama (no vowel following)
+                result.append(consonant)
+                i += 2
+                continue
+
+            # Vowel sign directly after consonant replaces the inherent 'a'
+            if _is_sinhala_vowel_sign(next_char):
+                if consonant.endswith('a'):
+                    consonant = consonant[:-1]
+                result.append(consonant + SINHALA_MAP[next_char])
+                i += 2
+                continue
+
+            # Just the consonant with inherent 'a'
+            result.append(consonant)
+            i += 1
+            continue
+
+        # Try two-character combinations for Tamil
+        two_chars = char + next_char
+        if TAMIL_MAP.get(two_chars):
+            result.append(TAMIL_MAP[two_chars])
+            i += 2
+        elif SINHALA_MAP.get(char):
+            result.append(SINHALA_MAP[char])
+            i += 1
+        elif TAMIL_MAP.get(char):
+            result.append(TAMIL_MAP[char])
+            i += 1
+        else:
+            # Keep the character as-is (spaces, punctuation, numbers, etc.)
+            result.append(char)
+            i += 1
+
+    return ''.join(result).lower()
+
+
+def normalize(text):
+    """Lowercase, drop special characters and collapse whitespace"""
+    text = _SPECIAL_CHARS.sub('', text.lower())
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def normalize_phonetic(text):
+    """Fold common romanization variations so they compare equal"""
+    for pattern, replacement in PHONETIC_RULES:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def search_key(text):
+    """Singlish, phonetically normalized form of text used for matching"""
+    return normalize_phonetic(normalize(to_singlish(text)))
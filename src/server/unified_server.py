@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Single-port serving for the Church Presentation Web App Server
+Runs HTTP and WebSocket on one asyncio event loop and one listening socket:
+requests for WEBSOCKET_PATH are upgraded to WebSocket, everything else is
+answered by the server's regular HTTP request handler class.
+
+The handler classes are written against blocking rfile/wfile streams, so each
+HTTP request runs on a bounded worker pool against streams that go through
+the event loop: the body is read from the socket as the handler asks for it
+and the response is written out as the handler writes it. Streamed imports,
+chunked exports and large files keep the bounded memory they have on the
+threaded server (files are copied in chunks, as there is no socket to
+sendfile() from).
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import socket
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
+from websockets.frames import Opcode
+from websockets.http11 import Request
+from websockets.protocol import State
+from websockets.server import ServerProtocol
+
+from http_pool import DEFAULT_MAX_CONNECTIONS
+from ws_encoding import check_compression_mode, deflate_extensions
+
+# Path that is upgraded to WebSocket
+WEBSOCKET_PATH = '/ws'
+
+# Request size limits
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+WEBSOCKET_MAX_SIZE = 10 * 1024 * 1024
+
+# Seconds to wait for a close frame to reach a stalled client
+WEBSOCKET_CLOSE_TIMEOUT = 10
+
+READ_CHUNK_SIZE = 64 * 1024
+
+_CONTINUE_RESPONSE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+
+class _LoopReader(io.RawIOBase):
+    """
+    A request read from the event loop's stream by a worker thread: the
+    head the loop already parsed, then at most `length` body bytes
+    """
+
+    def __init__(self, head, reader, length, loop, timeout):
+        self._head = memoryview(head)
+        self._reader = reader
+        self.remaining = length  # Body bytes not yet read from the socket
+        self._loop = loop
+        self._timeout = timeout
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._head:
+            count = min(len(buffer), len(self._head))
+            buffer[:count] = self._head[:count]
+            self._head = self._head[count:]
+            return count
+        if self.remaining <= 0:
+            return 0
+        data = _call_on_loop(self._reader.read(min(len(buffer), self.remaining)), self._loop, self._timeout)
+        if not data:
+            self.remaining = 0  # Client went away mid-body
+            return 0
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _LoopWriter(io.RawIOBase):
+    """A response written by a worker thread through the event loop's stream"""
+
+    def __init__(self, writer, loop, timeout):
+        self._writer = writer
+        self._loop = loop
+        self._timeout = timeout
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        _call_on_loop(self._send(data), self._loop, self._timeout)
+        return len(data)
+
+    async def _send(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+def _call_on_loop(coroutine, loop, timeout):
+    """Run a coroutine on the event loop from a worker thread and wait for it"""
+    future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Like a socket timeout on the threaded server
+        future.cancel()
+        raise socket.timeout("timed out") from None
+
+
+def _error_response(status, reason):
+    body = f"{status} {reason}\n".encode('ascii')
+    return (
+        f"HTTP/1.1 {status} {reason}\r\n"
+        f"Content-Type: text/plain\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n"
+        f"\r\n"
+    ).encode('ascii') + body
+
+
+class WebSocketConnection:
+    """
+    WebSocket connection driven by the websockets sans-I/O protocol.
+    Offers the part of the websockets server API the handlers rely on:
+    async iteration over messages, recv(), send(), close() and remote_address.
+    """
+
+    def __init__(self, protocol, request, reader, writer):
+        self.protocol = protocol
+        self.request = request
+        self.path = request.path
+        self.request_headers = request.headers
+        self.remote_address = writer.get_extra_info('peername')
+        self._reader = reader
+        self._writer = writer
+        self._messages = deque()
+        self._fragments = []
+        self._opcode = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ConnectionClosedOK:
+            raise StopAsyncIteration
+
+    async def recv(self):
+        """Return the next text (str) or binary (bytes) message"""
+        while not self._messages:
+            if self.protocol.state is State.CLOSED:
+                raise self.protocol.close_exc
+            await self._receive()
+        return self._messages.popleft()
+
+    async def send(self, message):
+        """Send a str as a text frame or bytes as a binary frame"""
+        if self.protocol.state is not State.OPEN or self._writer.is_closing():
+            raise self._closed_exception()
+        if isinstance(message, str):
+            self.protocol.send_text(message.encode('utf-8'))
+        else:
+            self.protocol.send_binary(bytes(message))
+        await self._flush()
+
+    async def close(self, code=1000, reason=''):
+        """Start the closing handshake; the reader finishes it"""
+        if self.protocol.state is State.OPEN:
+            self.protocol.send_close(code, reason)
+            try:
+                await asyncio.wait_for(self._flush(), WEBSOCKET_CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                # The peer stopped reading; drop the connection instead
+                self._writer.transport.abort()
+
+    def _closed_exception(self):
+        if self.protocol.state is State.CLOSED:
+            return self.protocol.close_exc
+        return ConnectionClosedError(None, None)
+
+    async def _receive(self):
+        try:
+            data = await self._reader.read(READ_CHUNK_SIZE)
+        except ConnectionError:
+            data = b''
+
+        if data:
+            self.protocol.receive_data(data)
+        else:
+            self.protocol.receive_eof()
+
+        for frame in self.protocol.events_received():
+            self._handle_frame(frame)
+
+        # Pongs and close replies are queued by the protocol itself
+        await self._flush()
+
+    def _handle_frame(self, frame):
+        if frame.opcode in (Opcode.TEXT, Opcode.BINARY):
+            self._opcode = frame.opcode
+            self._fragments = [frame.data]
+        elif frame.opcode is Opcode.CONT:
+            self._fragments.append(frame.data)
+        else:
+            return
+
+        if frame.fin:
+            data = b''.join(self._fragments)
+            self._fragments = []
+            self._messages.append(data.decode('utf-8') if self._opcode is Opcode.TEXT else data)
+
+    async def _flush(self):
+        for data in self.protocol.data_to_send():
+            if data:
+                self._writer.write(data)
+            elif self._writer.can_write_eof():
+                self._writer.write_eof()
+        try:
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+
+
+class UnifiedServer:
+    """HTTP and WebSocket on a single port, served from one event loop"""
+
+    def __init__(self, handler_class, websocket_handler, max_workers=DEFAULT_MAX_CONNECTIONS,
+                 websocket_path=WEBSOCKET_PATH, compression='auto'):
+        self.handler_class = _loop_handler_class(handler_class)
+        self.websocket_handler = websocket_handler
+        self.websocket_path = websocket_path
+        self.compression = check_compression_mode(compression)  # permessage-deflate: ws_encoding.COMPRESSION_MODES
+        self.keepalive_timeout = getattr(handler_class, 'timeout', None)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='http-worker')
+
+    async def serve_forever(self, host, port):
+        server = await asyncio.start_server(
+            self._handle_connection, host, port,
+            limit=MAX_HEADER_BYTES, reuse_address=True
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle_connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            requests_handled = 0
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except asyncio.LimitOverrunError:
+                    writer.write(_error_response(431, 'Request Header Fields Too Large'))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                method, path, headers = _parse_head(head)
+                if method is None:
+                    writer.write(_error_response(400, 'Bad Request'))
+                    break
+
+                if path.split('?', 1)[0] == self.websocket_path and 'websocket' in headers.get('upgrade', '').lower():
+                    await self._handle_websocket(head, reader, writer)
+                    return
+
+                # Request bodies are only accepted with a Content-Length
+                if 'chunked' in headers.get('transfer-encoding', '').lower():
+                    writer.write(_error_response(411, 'Length Required'))
+                    break
+                try:
+                    content_length = int(headers.get('content-length', 0))
+                except ValueError:
+                    content_length = -1
+                if not 0 <= content_length <= MAX_BODY_BYTES:
+                    writer.write(_error_response(413, 'Payload Too Large'))
+                    break
+
+                if headers.get('expect', '').lower() == '100-continue':
+                    head = _strip_header(head, b'expect')
+                    if content_length:
+                        writer.write(_CONTINUE_RESPONSE)
+
+                loop = asyncio.get_running_loop()
+                rfile = io.BufferedReader(
+                    _LoopReader(head, reader, content_length, loop, self.keepalive_timeout), READ_CHUNK_SIZE)
+                wfile = _LoopWriter(writer, loop, self.keepalive_timeout)
+                close_connection = await loop.run_in_executor(
+                    self._pool, self._run_handler, rfile, wfile,
+                    writer.get_extra_info('peername'), requests_handled
+                )
+                requests_handled += 1
+                if close_connection:
+                    break
+
+                # Skip whatever of the body the handler left unread
+                remaining = rfile.raw.remaining
+                while remaining > 0:
+                    data = await asyncio.wait_for(reader.read(min(READ_CHUNK_SIZE, remaining)),
+                                                  self.keepalive_timeout)
+                    if not data:
+                        return
+                    remaining -= len(data)
+        except (ConnectionError, socket.timeout, asyncio.TimeoutError):
+            pass  # Client went away or stalled mid-request
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _run_handler(self, rfile, wfile, client_address, requests_handled):
+        handler = self.handler_class(rfile, wfile, client_address, self, requests_handled)
+        return handler.close_connection
+
+    async def _handle_websocket(self, head, reader, writer):
+        protocol = ServerProtocol(
+            extensions=deflate_extensions(writer.get_extra_info('peername'), self.compression),
+            max_size=WEBSOCKET_MAX_SIZE
+        )
+        protocol.receive_data(head)
+        request = next((event for event in protocol.events_received() if isinstance(event, Request)), None)
+        if request is None:
+            writer.write(_error_response(400, 'Bad Request'))
+            return
+
+        response = protocol.accept(request)
+        protocol.send_response(response)
+        for data in protocol.data_to_send():
+            writer.write(data)
+        await writer.drain()
+        if response.status_code != 101:
+            return
+
+        await self.websocket_handler(WebSocketConnection(protocol, request, reader, writer))
+
+
+def _parse_head(head):
+    """Return (method, path, {lowercase header: value}) for a request head"""
+    try:
+        lines = head.decode('iso-8859-1').split('\r\n')
+        method, path, _version = lines[0].split(' ')
+    except ValueError:
+        return None, None, None
+
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return method, path, headers
+
+
+def _strip_header(head, name):
+    """Remove a header line from a raw request head"""
+    lines = head.split(b'\r\n')
+    kept = [line for line in lines if line.split(b':', 1)[0].strip().lower() != name]
+    return b'\r\n'.join(kept)
+
+
+def _loop_handler_class(handler_class):
+    """Subclass a request handler to read and write through the event loop"""
+
+    class LoopRequestHandler(handler_class):
+
+        def __init__(self, rfile, wfile, client_address, server, requests_handled):
+            self.rfile = rfile
+            self.wfile = wfile
+            self.previous_requests = requests_handled
+            super().__init__(None, client_address, server)
+
+        def setup(self):
+            self.connection = None  # No socket: no sendfile; the streams time out instead
+
+        def handle(self):
+            # One request per handler; the event loop owns the connection
+            self.requests_handled = self.previous_requests
+            self.close_connection = True
+            self.handle_one_request()
+
+        def finish(self):
+            pass
+
+    LoopRequestHandler.__name__ = handler_class.__name__
+    return LoopRequestHandler
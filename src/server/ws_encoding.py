@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+WebSocket message encodings for the Church Presentation Web App Server
+Each display chooses in its hello how messages reach it:
+
+    encoding   "json" (text frames, the default) or "msgpack" (binary
+               frames, when the msgpack package is installed)
+    songRefs   true for displays that load songs themselves: a song_phrase
+               then arrives as a song_ref naming the song file and phrase
+               index instead of carrying the verse text, with a CRC-32 of
+               the text so the display can tell its copy is out of date
+
+A message is encoded at most once per combination, however many clients
+receive it. permessage-deflate is negotiated per connection: by default
+only clients outside the local network pay for compression.
+
+Usage:
+    python src/server/ws_encoding.py benchmark [songs_dir]
+"""
+
+import ipaddress
+import json
+import sys
+import time
+import zlib
+from pathlib import Path
+
+from websockets.extensions.permessage_deflate import enable_server_permessage_deflate
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ENCODINGS = ('json', 'msgpack') if msgpack is not None else ('json',)
+
+# When to negotiate permessage-deflate: 'auto' (clients outside the LAN),
+# 'always' or 'never'
+COMPRESSION_MODES = ('auto', 'always', 'never')
+
+_COMPACT = (',', ':')
+
+
+class Outbound:
+    """A message to deliver, with its encodings computed on first use"""
+
+    __slots__ = ('_text', '_data', '_encoded', 'created', 'trace')
+
+    def __init__(self, text=None, data=None):
+        self._text = text  # JSON as received, forwarded unchanged
+        self._data = data
+        self._encoded = {}
+        self.created = time.perf_counter()  # For delivery latency
+        self.trace = None  # Trace id, for messages timed by slide_trace
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data=data)
+
+    def replay(self):
+        """The same message, timed from now and untraced, for a client that joins later"""
+        copy = Outbound(self._text, self._data)
+        copy._encoded = self._encoded
+        return copy
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self._text)
+        return self._data
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps(self._data, ensure_ascii=False, separators=_COMPACT)
+        return self._text
+
+    def encode(self, encoding='json', song_refs=False):
+        """Frame payload for a client: str for text frames, bytes for binary"""
+        key = (encoding, song_refs)
+        payload = self._encoded.get(key)
+        if payload is None:
+            data = song_ref(self.data) if song_refs else None
+            if encoding == 'msgpack':
+                payload = msgpack.packb(data or self.data, use_bin_type=True)
+            elif data is not None:
+                payload = json.dumps(data, ensure_ascii=False, separators=_COMPACT)
+            else:
+                payload = self.text
+            self._encoded[key] = payload
+        return payload
+
+
+def song_ref(data):
+    """
+    The song_ref form of a song_phrase that names its song and phrase,
+    or None when the message has to be sent in full
+    """
+    if data.get('type') != 'song_phrase':
+        return None
+    song_file = data.get('songFile')
+    phrase_index = data.get('phraseIndex')
+    text = data.get('text')
+    if not isinstance(song_file, str) or not isinstance(phrase_index, int) or not isinstance(text, str):
+        return None
+    ref = {'type': 'song_ref', 'songFile': song_file, 'phraseIndex': phrase_index,
+           'textCrc': zlib.crc32(text.encode('utf-8'))}
+    if data.get('fontSize'):
+        ref['fontSize'] = data['fontSize']
+    if data.get('trace'):
+        ref['trace'] = data['trace']
+    return ref
+
+
+def decode_incoming(message):
+    """Parse a received text (JSON) or binary (msgpack) message, or None"""
+    try:
+        if isinstance(message, str):
+            return json.loads(message)
+        if msgpack is not None:
+            return msgpack.unpackb(message, raw=False)
+    except ValueError:
+        pass
+    return None
+
+
+def is_local_address(remote_address):
+    """True for loopback, private and link-local peers"""
+    try:
+        address = ipaddress.ip_address(remote_address[0])
+    except (TypeError, ValueError, IndexError):
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_loopback or address.is_private or address.is_link_local
+
+
+def check_compression_mode(mode):
+    if mode not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression mode '{mode}', expected one of: {', '.join(COMPRESSION_MODES)}")
+    return mode
+
+
+def wants_compression(remote_address, mode='auto'):
+    """Whether to offer permessage-deflate to a client"""
+    if mode == 'always':
+        return True
+    if mode == 'never':
+        return False
+    return not is_local_address(remote_address)
+
+
+def deflate_extensions(remote_address, mode='auto'):
+    """Server extensions for a sans-I/O ServerProtocol, or None"""
+    if not wants_compression(remote_address, mode):
+        return None
+    return enable_server_permessage_deflate(None)
+
+
+def selective_deflate_protocol(mode):
+    """
+    websockets.serve() protocol class that only negotiates
+    permessage-deflate with clients wants_compression() picks
+    """
+    from websockets.legacy.server import WebSocketServerProtocol
+
+    check_compression_mode(mode)
+
+    class SelectiveDeflateProtocol(WebSocketServerProtocol):
+
+        def process_extensions(self, headers, available_extensions):
+            if not wants_compression(self.remote_address, mode):
+                available_extensions = []
+            return super().process_extensions(headers, available_extensions)
+
+    return SelectiveDeflateProtocol
+
+
+def _song_phrases(songs_dir):
+    """The song_phrase messages the operator sends for every verse"""
+    messages = []
+    for path in sorted(Path(songs_dir).glob('*.json')):
+        if path.name.startswith('.'):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            song = json.load(f)
+        phrases = [phrase if isinstance(phrase, str) else '\n'.join(phrase) for phrase in song.get('phrases', [])]
+        for index, text in enumerate(phrases):
+            messages.append({
+                'type': 'song_phrase',
+                'text': text,
+                'fontSize': 'auto',
+                'songTitle': song.get('title', ''),
+                'nextVersePreview': phrases[index + 1].split('\n')[0] if index + 1 < len(phrases) else None,
+                'songFile': path.name,
+                'phraseIndex': index
+            })
+    return messages
+
+
+def _frame_size(payload_length):
+    """Bytes on the wire for a server frame (unmasked)"""
+    return payload_length + (2 if payload_length < 126 else 4 if payload_length < 65536 else 10)
+
+
+def benchmark(songs_dir):
+    """Print average message size and encode time for each encoding"""
+    from websockets.extensions.permessage_deflate import PerMessageDeflate
+    from websockets.frames import Frame, Opcode
+
+    messages = _song_phrases(songs_dir)
+    if not messages:
+        print(f"No songs in {songs_dir}")
+        return
+    print(f"{len(messages)} song_phrase messages from {songs_dir}\n")
+    print(f"{'encoding':<16}{'bytes':>8}{'encode us':>11}{'deflated':>10}{'deflate us':>12}")
+
+    for encoding in ENCODINGS:
+        for song_refs in (False, True):
+            payloads = []
+            start = time.perf_counter()
+            for data in messages:
+                payloads.append(Outbound.from_data(data).encode(encoding, song_refs))
+            encode_time = time.perf_counter() - start
+
+            # One connection's worth of messages, with context takeover as negotiated
+            deflate = PerMessageDeflate(False, False, 15, 15)
+            opcode = Opcode.BINARY if encoding == 'msgpack' else Opcode.TEXT
+            frames = [Frame(opcode, p if isinstance(p, bytes) else p.encode('utf-8')) for p in payloads]
+            raw_bytes = sum(_frame_size(len(frame.data)) for frame in frames)
+            start = time.perf_counter()
+            deflated = [deflate.encode(frame) for frame in frames]
+            deflate_time = time.perf_counter() - start
+            deflated_bytes = sum(_frame_size(len(frame.data)) for frame in deflated)
+
+            count = len(messages)
+            name = encoding + (' + refs' if song_refs else '')
+            print(f"{name:<16}{raw_bytes / count:>8.0f}{encode_time / count * 1e6:>11.1f}"
+                  f"{deflated_bytes / count:>10.0f}{deflate_time / count * 1e6:>12.1f}")
+
+    if msgpack is None:
+        print("\nmsgpack is not installed; pip install msgpack to compare it")
+
+
+def main(argv):
+    default_songs_dir = Path(__file__).parent.parent / 'songs'
+
+    command = argv[1] if len(argv) > 1 else ''
+    if command == 'benchmark':
+        benchmark(argv[2] if len(argv) > 2 else default_songs_dir)
+    else:
+        print(__doc__.split('Usage:', 1)[1].rstrip())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
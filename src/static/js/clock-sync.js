@@ -0,0 +1,53 @@
+// Clock Sync JavaScript
+// Estimates how far this device's clock is from the server's, so the slide
+// latency stamps from the operator, the server and the displays can be
+// compared (see src/server/slide_trace.py and diagnostics.html)
+
+// A burst of round trips on connect and then every minute; the sample with
+// the shortest round trip is the most accurate (NTP style)
+const CLOCK_SYNC_BURST = 5;
+const CLOCK_SYNC_SPACING_MS = 500;
+const CLOCK_SYNC_INTERVAL_MS = 60000;
+const MAX_CLOCK_SAMPLES = 10;  // Two bursts, so the estimate follows drift
+
+let clockOffset = 0;  // Server clock minus this device's clock, in ms
+let clockRtt = null;  // Round trip of the sample clockOffset comes from
+let clockSyncTimer = null;
+const clockSamples = [];
+
+// Start (or restart, after a reconnect) syncing over an open WebSocket
+function startClockSync(socket) {
+    clearTimeout(clockSyncTimer);
+    let sent = 0;
+    const ping = () => {
+        if (socket.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        // The current estimate goes along for the server's diagnostics page
+        socket.send(JSON.stringify({ type: 'clock_sync', t0: Date.now(), offset: clockOffset, rtt: clockRtt }));
+        sent = (sent + 1) % CLOCK_SYNC_BURST;
+        clockSyncTimer = setTimeout(ping, sent ? CLOCK_SYNC_SPACING_MS : CLOCK_SYNC_INTERVAL_MS);
+    };
+    ping();
+}
+
+// Apply a clock_sync reply; returns false for any other message
+function handleClockSync(data) {
+    if (data.type !== 'clock_sync' || typeof data.t0 !== 'number' || typeof data.serverTime !== 'number') {
+        return false;
+    }
+    const t3 = Date.now();
+    clockSamples.push({ rtt: t3 - data.t0, offset: data.serverTime - (data.t0 + t3) / 2 });
+    if (clockSamples.length > MAX_CLOCK_SAMPLES) {
+        clockSamples.shift();
+    }
+    const best = clockSamples.reduce((a, b) => (b.rtt < a.rtt ? b : a));
+    clockOffset = best.offset;
+    clockRtt = best.rtt;
+    return true;
+}
+
+// Now, in milliseconds on the server's clock
+function serverNow() {
+    return Date.now() + clockOffset;
+}
@@ -1,13 +1,27 @@
 // Operator Control JavaScript
 
 // Configuration
-const WEBSOCKET_URL = `ws://${window.location.hostname}:8765`;
+// WebSocket address; replaced by the server's own answer in resolveWebSocketUrl()
+let websocketUrl = `ws://${window.location.hostname}:8765`;
 const CHURCH_NAME = "Our Church"; // Configurable
+const SEARCH_DEBOUNCE_MS = 150;
+
+// Displays on the same channel (?channel=name) show this operator's slides
+const CHANNEL = new URLSearchParams(window.location.search).get('channel') || 'main';
+
+// Every message to the displays carries a trace id, so the server can time
+// it to each display's paint (diagnostics.html)
+const TRACE_PREFIX = Math.random().toString(36).slice(2, 8);
+let traceCounter = 0;
 
 // State
 let ws = null;
 let songs = [];
+let catalogEpoch = null;
+let catalogRevision = null;
 let selectedSong = null;
+let searchTimer = null;
+let latestSearchId = 0;
 let currentFontSize = 'medium';
 let currentContent = {
     type: 'simple_slide',
@@ -59,23 +73,41 @@ let currentEditingSong = null;
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
-    initWebSocket();
+    resolveWebSocketUrl().then(initWebSocket);
     loadSongs();
     setupEventListeners();
 });
 
+// Ask the server where its WebSocket lives (a separate port, or /ws on this one)
+async function resolveWebSocketUrl() {
+    try {
+        const response = await fetch('/server-info.json', { cache: 'no-store' });
+        if (!response.ok) return;
+        
+        const info = await response.json();
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const port = info.singlePort ? window.location.port : info.websocketPort;
+        const host = port ? `${window.location.hostname}:${port}` : window.location.hostname;
+        websocketUrl = `${scheme}://${host}${info.websocketPath || '/'}`;
+    } catch (error) {
+        console.warn('Server info unavailable, using default WebSocket port:', error);
+    }
+}
+
 // WebSocket Connection
 function initWebSocket() {
     try {
-        ws = new WebSocket(WEBSOCKET_URL);
+        ws = new WebSocket(websocketUrl);
         
         ws.onopen = () => {
             console.log('WebSocket connected');
             connectionStatus.textContent = 'Connected';
             connectionStatus.className = 'connection-status connected';
             
-            // Send initial welcome message
-            sendToProjector(currentContent);
+            // Announce ourselves so the server routes display messages from us;
+            // the reply says whether the displays are already showing something
+            ws.send(JSON.stringify({ type: 'hello', role: 'operator', channel: CHANNEL }));
+            startClockSync(ws);
         };
         
         ws.onclose = () => {
@@ -93,6 +125,29 @@ function initWebSocket() {
         
         ws.onmessage = (event) => {
             console.log('Message from server:', event.data);
+            
+            let data;
+            try {
+                data = JSON.parse(event.data);
+            } catch (error) {
+                return;
+            }
+            
+            if (handleClockSync(data)) {
+                return;
+            }
+            
+            // Songs were edited outside the app - fetch just the changes
+            if (data.type === 'library_changed') {
+                syncSongs();
+            } else if (data.type === 'hello' && !data.hasState) {
+                // Nothing on screen yet - send the initial welcome message
+                sendToProjector(currentContent);
+            } else if (['song_phrase', 'simple_slide', 'blank', 'welcome_screen'].includes(data.type)) {
+                // What the displays show now, e.g. after reconnecting mid-service
+                currentContent = data;
+                updateCurrentDisplay(data);
+            }
         };
         
     } catch (error) {
@@ -105,7 +160,8 @@ function initWebSocket() {
 // Send message to projector
 function sendToProjector(content) {
     if (ws && ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify(content));
+        const trace = { id: `${TRACE_PREFIX}-${++traceCounter}`, sentAt: serverNow() };
+        ws.send(JSON.stringify({ ...content, trace }));
         currentContent = content;
         updateCurrentDisplay(content);
     } else {
@@ -129,45 +185,17 @@ function updateCurrentDisplay(content) {
     currentDisplay.textContent = displayText;
 }
 
-// Load songs from /songs directory
+// Load the whole song library in a single request
 async function loadSongs() {
     try {
-        // Get list of song files
-        const response = await fetch('/songs/');
-        const html = await response.text();
-        
-        // Parse HTML to extract .json files
-        const parser = new DOMParser();
-        const doc = parser.parseFromString(html, 'text/html');
-        const links = doc.querySelectorAll('a');
-        
-        const songFiles = [];
-        links.forEach(link => {
-            const href = link.getAttribute('href');
-            if (href && href.endsWith('.json')) {
-                songFiles.push(href);
-            }
-        });
-        
-        // Load each song file
-        const songPromises = songFiles.map(async (file) => {
-            try {
-                // Add cache-busting timestamp to force reload
-                const cacheBuster = `?t=${Date.now()}`;
-                const res = await fetch(`/songs/${file}${cacheBuster}`);
-                const song = await res.json();
-                song.filename = file;
-                return song;
-            } catch (error) {
-                console.error(`Failed to load song: ${file}`, error);
-                return null;
-            }
-        });
-        
-        songs = (await Promise.all(songPromises)).filter(s => s !== null);
-        songs.sort((a, b) => a.title.localeCompare(b.title));
-        
-        displaySongs(songs);
+        // Revalidate with the server's ETag instead of cache-busting
+        const response = await fetch('/api/songs', { cache: 'no-cache' });
+        if (!response.ok) {
+            throw new Error(`Server error: ${response.status}`);
+        }
+
+        const data = await response.json();
+        applySongCatalog(data);
         
     } catch (error) {
         console.error('Failed to load songs:', error);
@@ -179,6 +207,48 @@ async function loadSongs() {
     }
 }
 
+// Fetch only the songs that changed since the last load
+async function syncSongs() {
+    if (catalogRevision === null) {
+        return loadSongs();
+    }
+    
+    try {
+        const params = new URLSearchParams({ since: catalogRevision, epoch: catalogEpoch });
+        const response = await fetch(`/api/songs?${params}`, { cache: 'no-store' });
+        if (!response.ok) {
+            throw new Error(`Server error: ${response.status}`);
+        }
+        
+        applySongCatalog(await response.json());
+    } catch (error) {
+        console.error('Failed to sync songs, reloading library:', error);
+        return loadSongs();
+    }
+}
+
+// Apply a full snapshot or a list of changes from /api/songs
+function applySongCatalog(data) {
+    if (data.full) {
+        songs = data.songs;
+    } else {
+        const changed = new Set(data.changes.map(change => change.filename));
+        songs = songs.filter(song => !changed.has(song.filename));
+        
+        data.changes.forEach(change => {
+            if (change.song) {
+                songs.push({ ...change.song, filename: change.filename });
+            }
+        });
+    }
+    
+    catalogEpoch = data.epoch;
+    catalogRevision = data.revision;
+    songs.sort((a, b) => a.title.localeCompare(b.title));
+    
+    displaySongs(songs);
+}
+
 // Display songs in the list
 function displaySongs(songsToDisplay) {
     if (songsToDisplay.length === 0) {
@@ -294,7 +364,10 @@ function displayPhrases(song) {
                 text: phraseText,
                 fontSize: currentFontSize,
                 songTitle: song.title,
-                nextVersePreview: nextVersePreview
+                nextVersePreview: nextVersePreview,
+                // Lets the server send displays that load songs themselves a short reference
+                songFile: song.filename,
+                phraseIndex: index
             });
         });
         phrasesSection.appendChild(phraseItem);
@@ -370,24 +443,15 @@ function setupEventListeners() {
             searchClearBtn.classList.remove('visible');
         }
         
-        // Use transliteration search if available, otherwise fall back to basic search
-        let filteredSongs;
-        if (typeof Transliteration !== 'undefined') {
-            // Use fuzzy matching for better Singlish search experience
-            filteredSongs = Transliteration.searchSongs(songs, searchTerm, true);
-        } else {
-            // Fallback to basic search
-            const searchLower = searchTerm.toLowerCase();
-            filteredSongs = songs.filter(song => 
-                song.title.toLowerCase().includes(searchLower)
-            );
-        }
-        
-        displaySongs(filteredSongs);
+        // Wait for a pause in typing before asking the server
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => searchSongs(searchTerm), SEARCH_DEBOUNCE_MS);
     });
     
     // Clear search button
     searchClearBtn.addEventListener('click', () => {
+        clearTimeout(searchTimer);
+        latestSearchId++;
         songSearch.value = '';
         searchClearBtn.classList.remove('visible');
         displaySongs(songs);
@@ -513,26 +577,25 @@ function setupEventListeners() {
         }
         
         try {
-            const songs = parseBulkSongs(input);
-            if (songs.length === 0) {
+            showImportStatus('Processing songs...', 'info');
+            
+            // The server splits the text into songs and verses and saves them
+            const result = await importSongsText(input);
+            
+            if (result.success && result.total === 0) {
                 showImportStatus('No valid songs found. Please check the format.', 'error');
                 return;
             }
             
-            showImportStatus(`Processing ${songs.length} song(s)...`, 'info');
-            
-            // Save songs to server
-            const result = await saveSongs(songs);
-            
             if (result.success) {
                 showImportStatus(
-                    `Successfully imported ${result.saved} song(s)!${result.skipped > 0 ? ` (${result.skipped} skipped - already exist)` : ''}`,
+                    `Successfully imported ${result.saved} song(s)!${result.skipped > 0 ? ` (${result.skipped} skipped - already exist)` : ''}${result.invalid > 0 ? ` (${result.invalid} invalid)` : ''}`,
                     'success'
                 );
                 
-                // Reload songs after a short delay
+                // Fetch the new songs after a short delay
                 setTimeout(() => {
-                    loadSongs();
+                    syncSongs();
                     bulkImportModal.classList.remove('show');
                 }, 2000);
             } else {
@@ -615,83 +678,70 @@ function setupEventListeners() {
     }
 }
 
-// Parse bulk song input into structured song objects
-function parseBulkSongs(input) {
-    const songs = [];
-    
-    // Split input into lines
-    const allLines = input.split('\n');
+// Search songs on the server, falling back to local matching if unavailable
+async function searchSongs(searchTerm) {
+    if (searchTerm.trim() === '') {
+        displaySongs(songs);
+        return;
+    }
     
-    let currentSong = null;
-    let currentVerse = [];
-    let blankLineCount = 0;
+    const requestId = ++latestSearchId;
+    let filteredSongs;
     
-    for (let i = 0; i < allLines.length; i++) {
-        const line = allLines[i].trim();
+    try {
+        const params = new URLSearchParams({ q: searchTerm, limit: 100 });
+        const response = await fetch(`/api/search?${params}`);
+        if (!response.ok) {
+            throw new Error(`Server error: ${response.status}`);
+        }
         
-        if (line === '') {
-            blankLineCount++;
-            
-            // If we have a current verse, save it
-            if (currentVerse.length > 0 && currentSong) {
-                currentSong.phrases.push([...currentVerse]);
-                currentVerse = [];
-            }
-            
-            // Two or more blank lines in a row = new song
-            if (blankLineCount >= 2 && currentSong) {
-                // Save the current song
-                if (currentSong.phrases.length > 0) {
-                    songs.push(currentSong);
-                }
-                currentSong = null;
-            }
+        const data = await response.json();
+        const songsByFilename = new Map(songs.map(song => [song.filename, song]));
+        filteredSongs = data.results
+            .map(result => songsByFilename.get(result.filename))
+            .filter(song => song !== undefined);
+    } catch (error) {
+        console.warn('Server search unavailable, searching locally:', error);
+        
+        if (typeof Transliteration !== 'undefined') {
+            // Use fuzzy matching for better Singlish search experience
+            filteredSongs = Transliteration.searchSongs(songs, searchTerm, true);
         } else {
-            blankLineCount = 0;
-            
-            // Check if this is a new song (no current song and we have a line)
-            if (!currentSong) {
-                currentSong = {
-                    title: line,
-                    phrases: []
-                };
-            } else {
-                // This is a lyric line
-                currentVerse.push(line);
-            }
+            // Fallback to basic search
+            const searchLower = searchTerm.toLowerCase();
+            filteredSongs = songs.filter(song => 
+                song.title.toLowerCase().includes(searchLower)
+            );
         }
     }
     
-    // Don't forget the last verse and song
-    if (currentVerse.length > 0 && currentSong) {
-        currentSong.phrases.push(currentVerse);
-    }
-    if (currentSong && currentSong.phrases.length > 0) {
-        songs.push(currentSong);
+    // Ignore results that arrive after a newer search
+    if (requestId === latestSearchId) {
+        displaySongs(filteredSongs);
     }
-    
-    return songs;
 }
 
-// Save songs to the server
-async function saveSongs(songs) {
+// Send pasted songs to the server as plain text.
+// A blank line ends a verse and two blank lines end a song; see
+// parse_bulk_songs() in src/server/song_import.py.
+async function importSongsText(text) {
     try {
-        const response = await fetch('/api/save-songs', {
+        const response = await fetch('/api/import-text', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'text/plain; charset=utf-8'
             },
-            body: JSON.stringify({ songs: songs })
+            body: text
         });
         
-        if (!response.ok) {
+        if (!response.ok && response.status !== 400) {
             throw new Error(`Server error: ${response.status}`);
         }
         
         return await response.json();
         
     } catch (error) {
-        console.error('Error saving songs:', error);
+        console.error('Error importing songs:', error);
         throw error;
     }
 }
@@ -853,9 +903,9 @@ async function saveEditedSong() {
         if (result.success) {
             showEditStatus('Song updated successfully!', 'success');
             
-            // Reload songs after a short delay
+            // Fetch the changed song after a short delay
             setTimeout(() => {
-                loadSongs();
+                syncSongs();
                 closeEditModalFunc();
                 
                 // If this was the selected song, clear selection
@@ -903,9 +953,9 @@ async function deleteSong() {
         if (result.success) {
             showEditStatus('Song deleted successfully!', 'success');
             
-            // Reload songs after a short delay
+            // Fetch the changed song after a short delay
             setTimeout(() => {
-                loadSongs();
+                syncSongs();
                 closeEditModalFunc();
                 
                 // If this was the selected song, clear selection
@@ -936,22 +986,10 @@ function exportAllSongs() {
             return;
         }
         
-        // Prepare songs data (without filename property)
-        const exportData = songs.map(song => ({
-            title: song.title,
-            phrases: song.phrases
-        }));
-        
-        // Create JSON string with pretty formatting
-        const jsonString = JSON.stringify(exportData, null, 2);
-        
-        // Create a blob
-        const blob = new Blob([jsonString], { type: 'application/json' });
-        
-        // Create download link
-        const url = URL.createObjectURL(blob);
+        // The server streams the file straight to disk, so the browser
+        // never holds the whole library as one string
         const link = document.createElement('a');
-        link.href = url;
+        link.href = '/api/export?format=json';
         
         // Generate filename with current date
         const now = new Date();
@@ -964,9 +1002,8 @@ function exportAllSongs() {
         
         // Cleanup
         document.body.removeChild(link);
-        URL.revokeObjectURL(url);
         
-        console.log(`Exported ${songs.length} songs successfully`);
+        console.log(`Exporting ${songs.length} songs`);
         
     } catch (error) {
         console.error('Error exporting songs:', error);
@@ -977,67 +1014,71 @@ function exportAllSongs() {
 // Import songs from a JSON file
 async function importSongsFromFile(file) {
     try {
-        // Read the file
-        const fileContent = await file.text();
-        
-        // Parse JSON
-        let importedSongs;
-        try {
-            importedSongs = JSON.parse(fileContent);
-        } catch (parseError) {
-            alert('Invalid JSON file. Please select a valid songs JSON file.');
-            return;
-        }
-        
-        // Validate the data
-        if (!Array.isArray(importedSongs)) {
-            alert('Invalid file format. Expected an array of songs.');
-            return;
-        }
+        // Ask for confirmation
+        const sizeKb = Math.max(1, Math.round(file.size / 1024));
+        const confirmImport = confirm(
+            `Import songs from "${file.name}" (${sizeKb} KB)?\n\n` +
+            `Note: Songs with duplicate titles will be skipped.`
+        );
         
-        if (importedSongs.length === 0) {
-            alert('No songs found in the file.');
+        if (!confirmImport) {
             return;
         }
         
-        // Validate each song has required fields
-        const validSongs = importedSongs.filter(song => {
-            return song.title && 
-                   song.phrases && 
-                   Array.isArray(song.phrases) && 
-                   song.phrases.length > 0;
+        // Upload the file as-is; the server parses it as it arrives
+        const response = await fetch('/api/import-stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: file
         });
         
-        if (validSongs.length === 0) {
-            alert('No valid songs found in the file. Each song must have a title and phrases.');
-            return;
+        if (!response.ok) {
+            throw new Error(`Server error: ${response.status}`);
         }
         
-        // Ask for confirmation
-        const confirmImport = confirm(
-            `Found ${validSongs.length} valid song(s) in the file.\n\n` +
-            `Do you want to import them?\n\n` +
-            `Note: Songs with duplicate titles will be skipped.`
-        );
+        // One JSON line per saved batch, then a final report
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        let result = null;
         
-        if (!confirmImport) {
-            return;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const message = JSON.parse(line);
+                if (message.type === 'progress') {
+                    const percent = Math.round(100 * message.bytesRead / Math.max(message.totalBytes, 1));
+                    showImportStatus(`Importing... ${message.processed} song(s) processed (${percent}%)`, 'info');
+                } else {
+                    result = message;
+                }
+            }
         }
         
-        // Save songs using the existing API
-        const result = await saveSongs(validSongs);
-        
-        if (result.success) {
+        if (result && result.success) {
             const message = 
                 `Successfully imported ${result.saved} song(s)!\n` +
-                (result.skipped > 0 ? `${result.skipped} song(s) skipped (already exist).` : '');
+                (result.skipped > 0 ? `${result.skipped} song(s) skipped (already exist).\n` : '') +
+                (result.invalid > 0 ? `${result.invalid} song(s) invalid.` : '');
             
+            showImportStatus(`Imported ${result.saved} song(s) from ${file.name}`, 'success');
             alert(message);
             
-            // Reload the song list
-            await loadSongs();
+            // Fetch only the newly imported songs
+            await syncSongs();
         } else {
-            alert(`Error importing songs: ${result.message}`);
+            const message = result ? result.message : 'No response from server';
+            showImportStatus(`Error importing songs: ${message}`, 'error');
+            alert(`Error importing songs: ${message}`);
         }
         
     } catch (error) {
@@ -1,10 +1,48 @@
 // Projector Display JavaScript
 
 // Configuration
-const WEBSOCKET_URL = `ws://${window.location.hostname}:8765`;
+// WebSocket address; replaced by the server's own answer in resolveWebSocketUrl()
+let websocketUrl = `ws://${window.location.hostname}:8765`;
+
+// What this screen is and which operator it follows:
+// projector.html?role=stage&channel=hall shows the hall operator's slides on a stage monitor
+const params = new URLSearchParams(window.location.search);
+const DISPLAY_ROLE = ['projector', 'stage', 'viewer'].includes(params.get('role')) ? params.get('role') : 'projector';
+const CHANNEL = params.get('channel') || 'main';
+
+// projector.html?refs=1 asks for song slides as {songFile, phraseIndex} and
+// loads the songs itself, which saves bandwidth on remote viewers
+const USE_SONG_REFS = params.get('refs') === '1';
+
+// Message types this page displays
+const DISPLAY_TYPES = ['song_phrase', 'song_ref', 'simple_slide', 'blank', 'welcome_screen'];
+
+// Length of a slide change (fade out, swap, fade in)
+const TRANSITION_MS = 550;
+let transitionInProgress = false;
+let pendingContent = null;
+
+// Prefetched slides are laid out once the current one has settled (its
+// title and next-verse preview appear 300 ms after the swap), so they are
+// measured against the space they will get
+const PREFETCH_SETTLE_MS = TRANSITION_MS + 350;
+const PREFETCH_SLIDES = 2;  // Looked ahead locally in song_ref mode
+let prefetchTimer = null;
+
+// Auto font sizes by available space and text, so a prefetched slide
+// skips the measuring loop when it is shown
+const layoutCache = new Map();
+const MAX_LAYOUT_CACHE = 32;
+
+// Time from receiving a slide to its text fading in; slideLatency() in the
+// browser console summarizes it
+const slideTimings = [];
+const MAX_SLIDE_TIMINGS = 200;
 
 // State
 let ws = null;
+let messageSequence = 0;  // Latest display message, so slow song loads can't overtake newer slides
+const songCache = new Map();  // songFile -> song, for song_ref messages
 
 // DOM Elements
 const projectorContainer = document.getElementById('projectorContainer');
@@ -19,7 +57,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Show welcome screen by default
     showWelcomeScreen();
     
-    initWebSocket();
+    resolveWebSocketUrl().then(initWebSocket);
     
     // Hide fullscreen hint after 5 seconds
     setTimeout(() => {
@@ -64,13 +102,31 @@ function showWelcomeScreen() {
     }, 500);
 }
 
+// Ask the server where its WebSocket lives (a separate port, or /ws on this one)
+async function resolveWebSocketUrl() {
+    try {
+        const response = await fetch('/server-info.json', { cache: 'no-store' });
+        if (!response.ok) return;
+        
+        const info = await response.json();
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const port = info.singlePort ? window.location.port : info.websocketPort;
+        const host = port ? `${window.location.hostname}:${port}` : window.location.hostname;
+        websocketUrl = `${scheme}://${host}${info.websocketPath || '/'}`;
+    } catch (error) {
+        console.warn('Server info unavailable, using default WebSocket port:', error);
+    }
+}
+
 // WebSocket Connection
 function initWebSocket() {
     try {
-        ws = new WebSocket(WEBSOCKET_URL);
+        ws = new WebSocket(websocketUrl);
         
         ws.onopen = () => {
             console.log('Projector WebSocket connected');
+            ws.send(JSON.stringify({ type: 'hello', role: DISPLAY_ROLE, channel: CHANNEL, songRefs: USE_SONG_REFS }));
+            startClockSync(ws);
         };
         
         ws.onclose = () => {
@@ -87,8 +143,36 @@ function initWebSocket() {
         ws.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                data.receivedAt = performance.now();
+                if (handleClockSync(data)) {
+                    return;
+                }
+                if (data.trace) {
+                    data.traceReceivedAt = serverNow();
+                }
                 console.log('Received content:', data);
-                updateDisplay(data);
+                
+                if (data.type === 'prefetch') {
+                    prefetchSlides(data.slides);
+                    return;
+                }
+                
+                // Ignore protocol replies and anything meant for operators
+                if (!DISPLAY_TYPES.includes(data.type)) {
+                    return;
+                }
+                
+                const sequence = ++messageSequence;
+                if (data.type === 'song_ref') {
+                    resolveSongRef(data)
+                        .then(content => {
+                            if (sequence === messageSequence) showContent(content);
+                        })
+                        .catch(error => console.error('Failed to load song for slide:', error));
+                    return;
+                }
+                
+                showContent(data);
             } catch (error) {
                 console.error('Failed to parse message:', error);
             }
@@ -99,6 +183,111 @@ function initWebSocket() {
     }
 }
 
+// Turn a song_ref into the song_phrase the operator sent, from the cached
+// song, reloading it when the verse text no longer matches
+async function resolveSongRef(ref) {
+    let song = songCache.get(ref.songFile) || await fetchSong(ref.songFile, false);
+    let phrase = song.phrases[ref.phraseIndex];
+    if (phrase === undefined || crc32(phraseText(phrase)) !== ref.textCrc) {
+        song = await fetchSong(ref.songFile, true);
+        phrase = song.phrases[ref.phraseIndex];
+    }
+    if (phrase === undefined) {
+        throw new Error(`${ref.songFile} has no verse ${ref.phraseIndex}`);
+    }
+    
+    // The song is at hand, so look ahead here instead of waiting for a hint
+    const following = [];
+    for (let index = ref.phraseIndex + 1; index <= ref.phraseIndex + PREFETCH_SLIDES && index < song.phrases.length; index++) {
+        following.push(songSlide(song, index, ref.fontSize));
+    }
+    prefetchSlides(following);
+    
+    return {
+        ...songSlide(song, ref.phraseIndex, ref.fontSize),
+        receivedAt: ref.receivedAt,
+        trace: ref.trace,
+        traceReceivedAt: ref.traceReceivedAt
+    };
+}
+
+// The song_phrase message the operator sends for a verse
+function songSlide(song, index, fontSize) {
+    const nextPhrase = song.phrases[index + 1];
+    return {
+        type: 'song_phrase',
+        text: phraseText(song.phrases[index]),
+        fontSize: fontSize,
+        songTitle: song.title,
+        nextVersePreview: nextPhrase ? phraseText(nextPhrase).split('\n')[0] : null
+    };
+}
+
+async function fetchSong(songFile, revalidate) {
+    const response = await fetch(`/songs/${encodeURIComponent(songFile)}`, { cache: revalidate ? 'no-cache' : 'default' });
+    if (!response.ok) {
+        throw new Error(`Server error: ${response.status}`);
+    }
+    const song = await response.json();
+    songCache.set(songFile, song);
+    return song;
+}
+
+// Handle both string phrases (old format) and array phrases
+function phraseText(phrase) {
+    return Array.isArray(phrase) ? phrase.join('\n') : phrase;
+}
+
+const CRC_TABLE = new Uint32Array(256).map((_, n) => {
+    let c = n;
+    for (let k = 0; k < 8; k++) {
+        c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+    }
+    return c;
+});
+
+// CRC-32 of a string's UTF-8 bytes, as the server computes it
+function crc32(text) {
+    let crc = 0xFFFFFFFF;
+    for (const byte of new TextEncoder().encode(text)) {
+        crc = CRC_TABLE[(crc ^ byte) & 0xFF] ^ (crc >>> 8);
+    }
+    return (crc ^ 0xFFFFFFFF) >>> 0;
+}
+
+// Lay out the slides the operator is likely to show next, off-screen and
+// when the browser is idle
+function prefetchSlides(slides) {
+    clearTimeout(prefetchTimer);
+    prefetchTimer = setTimeout(() => {
+        const whenIdle = window.requestIdleCallback || (callback => setTimeout(callback, 0));
+        slides
+            .filter(slide => slide.fontSize === 'auto' && slide.text)
+            .forEach(slide => whenIdle(() => autoFontSize(formatText(slide.text))));
+    }, PREFETCH_SETTLE_MS);
+}
+
+// Show new content, or remember it until the current transition ends.
+// Rapid clicks replace each other, so only the newest slide is shown next
+function showContent(content) {
+    if (transitionInProgress) {
+        pendingContent = content;
+        return;
+    }
+    
+    transitionInProgress = true;
+    updateDisplay(content);
+    
+    setTimeout(() => {
+        transitionInProgress = false;
+        if (pendingContent) {
+            const next = pendingContent;
+            pendingContent = null;
+            showContent(next);
+        }
+    }, TRANSITION_MS);
+}
+
 // Update the display with new content
 function updateDisplay(content) {
     // Handle welcome screen
@@ -134,6 +323,8 @@ function updateDisplay(content) {
             setTimeout(() => {
                 iframe.style.opacity = '1';
             }, 100);
+            
+            acknowledgeSlide(content);
         }, 500);
         
         return;
@@ -158,6 +349,8 @@ function updateDisplay(content) {
             
             // Hide song title for blank screen
             songTitleDisplay.classList.remove('visible');
+            
+            acknowledgeSlide(content);
         }, 500); // Wait for fade out
         
         return;
@@ -175,11 +368,11 @@ function updateDisplay(content) {
     // Step 2: After fade out completes, update content
     setTimeout(() => {
         // Update text content
+        let html = projectorContent.innerHTML;
         if (content.text) {
             // Use innerHTML to preserve line breaks
-            // Replace newlines with <br> tags for proper display
-            const formattedText = content.text.replace(/\n/g, '<br>');
-            projectorContent.innerHTML = formattedText;
+            html = formatText(content.text);
+            projectorContent.innerHTML = html;
         }
         
         // Update font size
@@ -187,9 +380,12 @@ function updateDisplay(content) {
         projectorContent.classList.add(newFontClass);
         
         // If auto font size, calculate optimal size
+        const layoutStart = performance.now();
+        let layout = 'fixed';
         if (isAutoFont) {
-            calculateAutoFontSize();
+            layout = calculateAutoFontSize(html) ? 'prefetched' : 'measured';
         }
+        const layoutMs = performance.now() - layoutStart;
         
         // Handle next verse preview
         if (content.nextVersePreview) {
@@ -217,13 +413,30 @@ function updateDisplay(content) {
         setTimeout(() => {
             projectorContent.classList.remove('fade-out');
             projectorContent.classList.add('fade-in');
+            recordSlideTiming(content, layout, layoutMs);
+            acknowledgeSlide(content);
         }, 50); // Small delay before fade in
         
     }, 500); // Duration matches fade-out transition (0.5s)
 }
 
-// Calculate and apply the optimal font size for auto mode
-function calculateAutoFontSize() {
+// Replace newlines with <br> tags for proper display
+function formatText(text) {
+    return text.replace(/\n/g, '<br>');
+}
+
+// Apply the optimal font size for auto mode; true when it was laid out ahead of time
+function calculateAutoFontSize(html) {
+    const { fontSize, cached } = autoFontSize(html);
+    
+    // Apply the calculated font size with inline styles
+    projectorContent.style.fontSize = fontSize + 'px';
+    projectorContent.style.lineHeight = '1.2';
+    return cached;
+}
+
+// Largest font size at which html fits the space the current screen leaves
+function autoFontSize(html) {
     // Get the container dimensions
     const containerWidth = projectorContainer.clientWidth;
     const containerHeight = projectorContainer.clientHeight;
@@ -247,6 +460,11 @@ function calculateAutoFontSize() {
     const availableWidth = containerWidth - paddingHorizontal;
     const availableHeight = containerHeight - songTitleHeight - nextVerseHeight - logoHeight - paddingVertical;
     
+    const key = `${availableWidth}x${availableHeight}:${html}`;
+    if (layoutCache.has(key)) {
+        return { fontSize: layoutCache.get(key), cached: true };
+    }
+    
     // Start with a large font size and reduce until it fits
     let minFontSize = 20;
     let maxFontSize = 250;
@@ -262,7 +480,7 @@ function calculateAutoFontSize() {
         padding: 0;
         margin: 0;
     `;
-    tempElement.innerHTML = projectorContent.innerHTML;
+    tempElement.innerHTML = html;
     document.body.appendChild(tempElement);
     
     // Binary search for the optimal font size
@@ -286,12 +504,63 @@ function calculateAutoFontSize() {
     // Clean up
     document.body.removeChild(tempElement);
     
-    // Apply the calculated font size with inline styles
-    projectorContent.style.fontSize = bestFontSize + 'px';
-    projectorContent.style.lineHeight = '1.2';
+    layoutCache.set(key, bestFontSize);
+    if (layoutCache.size > MAX_LAYOUT_CACHE) {
+        layoutCache.delete(layoutCache.keys().next().value);
+    }
     
     console.log('Auto font size:', bestFontSize, 'px', 
                 'Available space:', availableWidth, 'x', availableHeight);
+    return { fontSize: bestFontSize, cached: false };
+}
+
+function recordSlideTiming(content, layout, layoutMs) {
+    if (content.receivedAt === undefined) {
+        return;
+    }
+    const totalMs = performance.now() - content.receivedAt;
+    slideTimings.push({ layout, layoutMs, totalMs });
+    if (slideTimings.length > MAX_SLIDE_TIMINGS) {
+        slideTimings.shift();
+    }
+    console.log(`Slide visible ${totalMs.toFixed(1)} ms after it arrived (${layout} layout: ${layoutMs.toFixed(1)} ms)`);
+}
+
+// Tell the server a traced slide is on screen, once the frame showing it
+// has been painted, for its per-display latency figures
+function acknowledgeSlide(content) {
+    if (!content.trace || content.traceReceivedAt === undefined) {
+        return;
+    }
+    requestAnimationFrame(() => setTimeout(() => {
+        if (ws && ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({
+                type: 'slide_ack',
+                trace: content.trace.id,
+                receivedAt: content.traceReceivedAt,
+                paintedAt: serverNow()
+            }));
+        }
+    }, 0));
+}
+
+// Median latencies per layout kind: 'prefetched' (laid out ahead of time),
+// 'measured' (auto size computed on the spot) and 'fixed' font sizes
+function slideLatency() {
+    const median = values => {
+        const sorted = [...values].sort((a, b) => a - b);
+        return sorted.length ? Number(sorted[Math.floor(sorted.length / 2)].toFixed(1)) : null;
+    };
+    const summary = {};
+    ['prefetched', 'measured', 'fixed'].forEach(layout => {
+        const timings = slideTimings.filter(timing => timing.layout === layout);
+        summary[layout] = {
+            slides: timings.length,
+            totalMs: median(timings.map(timing => timing.totalMs)),
+            layoutMs: median(timings.map(timing => timing.layoutMs))
+        };
+    });
+    return summary;
 }
 
 // Allow F11 key for fullscreen